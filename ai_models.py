@@ -4,11 +4,16 @@ This module contains classes for interacting with different AI models.
 """
 import os
 import json
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+import transport
+from context_builder import ContextBuilder
+from instrumentation import timed
+from response_cache import ErrorResponse
+
+# Logging is configured by the entry point (app.py, asgi.py or main())
 logger = logging.getLogger(__name__)
 
 class OpenAIModel:
@@ -16,10 +21,34 @@ class OpenAIModel:
     Class to handle interactions with OpenAI API.
     """
     
-    def __init__(self):
-        """Initialize the OpenAI client."""
+    SYSTEM_PROMPT = "You are a helpful assistant. Respond conversationally to the user's messages."
+    
+    def __init__(self, client=None, async_client=None, context_builder=None):
+        """
+        Initialize the OpenAI client.
+        
+        Args:
+            client: Preconfigured client to use instead of creating one (e.g. a local fake)
+            async_client: Preconfigured asyncio client; without one, async calls run the sync client in a thread
+            context_builder: ContextBuilder packing history into the prompt; defaults to one
+                configured by OPENAI_CONTEXT_TOKENS and OPENAI_CONTEXT_SUMMARY
+        """
+        self.model = "gpt-4o"  # the newest OpenAI model is "gpt-4o" which was released May 13, 2024
+        self.context_builder = context_builder or ContextBuilder(
+            self.SYSTEM_PROMPT,
+            token_budget=int(os.environ.get("OPENAI_CONTEXT_TOKENS", "3000")),
+            summarize=os.environ.get("OPENAI_CONTEXT_SUMMARY", "").lower() in ("1", "true", "yes")
+        )
+        
+        if client is not None:
+            self.api_key = None
+            self.client = client
+            self.async_client = async_client
+            return
+        
+        self.async_client = None
         try:
-            from openai import OpenAI
+            from openai import OpenAI, AsyncOpenAI
             
             # Get API key from environment variable
             self.api_key = os.environ.get("OPENAI_API_KEY")
@@ -27,14 +56,17 @@ class OpenAIModel:
                 logger.warning("OpenAI API key not found in environment variables")
                 self.client = None
             else:
-                self.client = OpenAI(api_key=self.api_key)
-                self.model = "gpt-4o"  # the newest OpenAI model is "gpt-4o" which was released May 13, 2024
+                # Both clients send through the process-wide connection pools
+                timeout = transport.config().timeout() if transport.httpx_available else None
+                self.client = OpenAI(api_key=self.api_key, http_client=transport.shared_client(), timeout=timeout)
+                self.async_client = AsyncOpenAI(api_key=self.api_key, http_client=transport.shared_async_client(),
+                                                timeout=timeout)
                 logger.info("OpenAI client initialized successfully")
         except ImportError:
             logger.error("OpenAI library not installed")
             self.client = None
         except Exception as e:
-            logger.error(f"Error initializing OpenAI client: {str(e)}")
+            logger.error("Error initializing OpenAI client: %s", e)
             self.client = None
     
     def get_response(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None) -> str:
@@ -49,40 +81,133 @@ class OpenAIModel:
             The model's response as a string
         """
         if not self.client:
-            return "OpenAI API is not configured properly. Please check your API key."
+            return ErrorResponse("OpenAI API is not configured properly. Please check your API key.")
         
         try:
-            # Format chat history for OpenAI API
-            messages = []
+            # Call OpenAI API
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=self._build_messages(user_input, chat_history),
+                max_tokens=500
+            )
             
-            # Add system message
-            messages.append({
-                "role": "system", 
-                "content": "You are a helpful assistant. Respond conversationally to the user's messages."
-            })
+            # Extract and return the response text
+            return response.choices[0].message.content
             
-            # Add chat history
-            if chat_history:
-                for exchange in chat_history[-10:]:  # Limit to most recent 10 exchanges
-                    messages.append({"role": "user", "content": exchange.get("user", "")})
-                    messages.append({"role": "assistant", "content": exchange.get("bot", "")})
+        except Exception as e:
+            logger.error("Error getting response from OpenAI: %s", e)
+            return ErrorResponse(f"I'm sorry, I encountered an error: {str(e)}")
+    
+    def stream_response(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None) -> Iterator[str]:
+        """
+        Stream a response from the OpenAI model as it is generated.
+        
+        Args:
+            user_input: The user's message
+            chat_history: List of previous exchanges in the conversation
             
-            # Add current user message
-            messages.append({"role": "user", "content": user_input})
+        Yields:
+            Pieces of the model's response text, in order
+        """
+        if not self.client:
+            yield ErrorResponse("OpenAI API is not configured properly. Please check your API key.")
+            return
+        
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=self._build_messages(user_input, chat_history),
+                max_tokens=500,
+                stream=True
+            )
             
-            # Call OpenAI API
-            response = self.client.chat.completions.create(
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    yield content
+                    
+        except Exception as e:
+            logger.error("Error streaming response from OpenAI: %s", e)
+            yield ErrorResponse(f"I'm sorry, I encountered an error: {str(e)}")
+    
+    async def get_response_async(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None) -> str:
+        """
+        Get a response from the OpenAI model using the asyncio client.
+        
+        Args:
+            user_input: The user's message
+            chat_history: List of previous exchanges in the conversation
+            
+        Returns:
+            The model's response as a string
+        """
+        if not self.client:
+            return ErrorResponse("OpenAI API is not configured properly. Please check your API key.")
+        
+        if self.async_client is None:
+            return await asyncio.to_thread(self.get_response, user_input, chat_history)
+        
+        try:
+            response = await self.async_client.chat.completions.create(
                 model=self.model,
-                messages=messages,
+                messages=self._build_messages(user_input, chat_history),
                 max_tokens=500
             )
             
-            # Extract and return the response text
             return response.choices[0].message.content
             
         except Exception as e:
-            logger.error(f"Error getting response from OpenAI: {str(e)}")
-            return f"I'm sorry, I encountered an error: {str(e)}"
+            logger.error("Error getting response from OpenAI: %s", e)
+            return ErrorResponse(f"I'm sorry, I encountered an error: {str(e)}")
+    
+    async def stream_response_async(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None) -> AsyncIterator[str]:
+        """
+        Stream a response from the OpenAI model using the asyncio client.
+        
+        Args:
+            user_input: The user's message
+            chat_history: List of previous exchanges in the conversation
+            
+        Yields:
+            Pieces of the model's response text, in order
+        """
+        if not self.client or self.async_client is None:
+            yield await self.get_response_async(user_input, chat_history)
+            return
+        
+        try:
+            stream = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=self._build_messages(user_input, chat_history),
+                max_tokens=500,
+                stream=True
+            )
+            
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    yield content
+                    
+        except Exception as e:
+            logger.error("Error streaming response from OpenAI: %s", e)
+            yield ErrorResponse(f"I'm sorry, I encountered an error: {str(e)}")
+    
+    @property
+    def available(self) -> bool:
+        """Whether an OpenAI client is configured."""
+        return self.client is not None
+    
+    def _build_messages(self, user_input: str, chat_history: Optional[List[Dict[str, str]]]) -> List[Dict[str, str]]:
+        """Pack the system prompt, as much chat history as the token budget allows, and the user message."""
+        with timed("context_build", "openai"):
+            window = self.context_builder.build(user_input, chat_history)
+        logger.debug("OpenAI prompt: %s tokens, %s turns, %s summarized",
+                     window.tokens, window.turns, window.summarized_turns)
+        return window.messages
 
 
 class GeminiModel:
@@ -90,8 +215,20 @@ class GeminiModel:
     Class to handle interactions with Google's Gemini API.
     """
     
-    def __init__(self):
-        """Initialize the Gemini client."""
+    def __init__(self, model=None):
+        """
+        Initialize the Gemini client.
+        
+        Args:
+            model: Preconfigured GenerativeModel to use instead of creating one (e.g. a local fake)
+        """
+        if model is not None:
+            self.api_key = None
+            self.genai = None
+            self.model = model
+            return
+        
+        self.model = None
         try:
             import google.generativeai as genai
             
@@ -110,7 +247,7 @@ class GeminiModel:
             logger.error("Google GenerativeAI library not installed")
             self.genai = None
         except Exception as e:
-            logger.error(f"Error initializing Gemini client: {str(e)}")
+            logger.error("Error initializing Gemini client: %s", e)
             self.genai = None
     
     def get_response(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None) -> str:
@@ -124,17 +261,12 @@ class GeminiModel:
         Returns:
             The model's response as a string
         """
-        if not self.genai:
-            return "Gemini API is not configured properly. Please check your API key."
+        if not self.available:
+            return ErrorResponse("Gemini API is not configured properly. Please check your API key.")
         
         try:
-            # Start a chat session
-            chat = self.model.start_chat(history=[])
-            
-            # Add chat history
-            if chat_history:
-                for exchange in chat_history[-10:]:  # Limit to most recent 10 exchanges
-                    chat.send_message(exchange.get("user", ""))
+            # Start a chat session seeded with the previous turns
+            chat = self.model.start_chat(history=self._build_history(chat_history))
             
             # Send current message and get response
             response = chat.send_message(user_input)
@@ -143,5 +275,120 @@ class GeminiModel:
             return response.text
             
         except Exception as e:
-            logger.error(f"Error getting response from Gemini: {str(e)}")
-            return f"I'm sorry, I encountered an error: {str(e)}"
\ No newline at end of file
+            logger.error("Error getting response from Gemini: %s", e)
+            return ErrorResponse(f"I'm sorry, I encountered an error: {str(e)}")
+    
+    def stream_response(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None) -> Iterator[str]:
+        """
+        Stream a response from the Gemini model as it is generated.
+        
+        Args:
+            user_input: The user's message
+            chat_history: List of previous exchanges in the conversation
+            
+        Yields:
+            Pieces of the model's response text, in order
+        """
+        if not self.available:
+            yield ErrorResponse("Gemini API is not configured properly. Please check your API key.")
+            return
+        
+        try:
+            # Start a chat session seeded with the previous turns
+            chat = self.model.start_chat(history=self._build_history(chat_history))
+            
+            # Send current message and stream the response
+            for chunk in chat.send_message(user_input, stream=True):
+                if chunk.text:
+                    yield chunk.text
+                    
+        except Exception as e:
+            logger.error("Error streaming response from Gemini: %s", e)
+            yield ErrorResponse(f"I'm sorry, I encountered an error: {str(e)}")
+    
+    async def get_response_async(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None) -> str:
+        """
+        Get a response from the Gemini model without blocking the event loop.
+        
+        Args:
+            user_input: The user's message
+            chat_history: List of previous exchanges in the conversation
+            
+        Returns:
+            The model's response as a string
+        """
+        if not self.available:
+            return ErrorResponse("Gemini API is not configured properly. Please check your API key.")
+        
+        try:
+            # Start a chat session seeded with the previous turns
+            chat = self.model.start_chat(history=self._build_history(chat_history))
+            
+            # Send current message and get response
+            response = await chat.send_message_async(user_input)
+            
+            # Return the text response
+            return response.text
+            
+        except Exception as e:
+            logger.error("Error getting response from Gemini: %s", e)
+            return ErrorResponse(f"I'm sorry, I encountered an error: {str(e)}")
+    
+    async def stream_response_async(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None) -> AsyncIterator[str]:
+        """
+        Stream a response from the Gemini model without blocking the event loop.
+        
+        Args:
+            user_input: The user's message
+            chat_history: List of previous exchanges in the conversation
+            
+        Yields:
+            Pieces of the model's response text, in order
+        """
+        if not self.available:
+            yield ErrorResponse("Gemini API is not configured properly. Please check your API key.")
+            return
+        
+        try:
+            # Start a chat session seeded with the previous turns
+            chat = self.model.start_chat(history=self._build_history(chat_history))
+            
+            # Send current message and stream the response
+            response = await chat.send_message_async(user_input, stream=True)
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+                    
+        except Exception as e:
+            logger.error("Error streaming response from Gemini: %s", e)
+            yield ErrorResponse(f"I'm sorry, I encountered an error: {str(e)}")
+    
+    def _build_history(self, chat_history: Optional[List[Dict[str, str]]]) -> List[Dict[str, Any]]:
+        """
+        Convert chat history into Gemini's native user/model turns.
+        
+        Passing the turns to start_chat means one request per message instead
+        of replaying every previous user message before the real one.
+        
+        Args:
+            chat_history: List of previous exchanges in the conversation
+            
+        Returns:
+            Content dictionaries for start_chat's history argument
+        """
+        history = []
+        if chat_history:
+            for exchange in chat_history[-10:]:  # Limit to most recent 10 exchanges
+                user_text = exchange.get("user", "")
+                bot_text = exchange.get("bot", "")
+                # Gemini rejects empty parts and needs user and model turns to alternate
+                if not user_text or not bot_text:
+                    continue
+                history.append({"role": "user", "parts": [user_text]})
+                history.append({"role": "model", "parts": [bot_text]})
+        return history
+    
+    @property
+    def available(self) -> bool:
+        """Whether a Gemini model is configured."""
+        return self.model is not None
\ No newline at end of file
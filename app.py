@@ -1,145 +1,347 @@
 import os
+import time
 import logging
-from flask import Flask, render_template, request, jsonify, session
-from chatbot import Chatbot
+import itertools
+from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context, g, url_for
+from flask.sessions import SecureCookieSessionInterface
+from chat_service import (ChatService, RATE_LIMITED_ENDPOINTS, PROFILED_ENDPOINTS, error_body, parse_message,
+                          retry_body, sse_token, sse_error, sse_done)
+from exchange import MAX_DECODED_BYTES
+from context_builder import reset_current_window
+from instrumentation import metrics, timed, begin_request, request_stages, server_timing
+from rate_limit import Overloaded
+from profiling import PROFILE_HEADER
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging; per-message details are logged at DEBUG
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
+class TimedSessionInterface(SecureCookieSessionInterface):
+    """Cookie sessions whose loading and serialization are recorded as stages."""
+
+    def open_session(self, app, request):
+        with timed("session_load"):
+            return super().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        with timed("session_save"):
+            super().save_session(app, session, response)
+
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "default-secret-key-for-development")
+app.session_interface = TimedSessionInterface()
+
+# Backends, storage and the route logic shared with the ASGI app
+service = ChatService(app.static_folder)
+
+def client_key() -> str:
+    """Get the key the rate limiter counts a request under: its session or its client's address."""
+    return service.client_key(session, request.remote_addr, ', '.join(request.headers.getlist('X-Forwarded-For')))
+
+def retry_later(retry_after: float, message: str = 'The server is busy, please retry shortly'):
+    """Build the response telling a client to come back after `retry_after` seconds."""
+    body, headers = retry_body(retry_after, message)
+    response = jsonify(body)
+    response.headers.update(headers)
+    return response
+
+def asset_url(filename: str) -> str:
+    """Get a static file's fingerprinted URL; the plain static URL in debug mode, so edits show up at once."""
+    fingerprinted = None if app.debug else service.assets.fingerprinted(filename)
+    if fingerprinted is None:
+        return url_for('static', filename=filename)
+    return url_for('serve_asset', filename=fingerprinted)
 
-# Check for API keys and determine the best model to use
-openai_api_key = os.environ.get("OPENAI_API_KEY")
-gemini_api_key = os.environ.get("GEMINI_API_KEY")
+app.add_template_global(asset_url)
 
-# Decide on model preference based on available API keys
-if openai_api_key:
-    model_preference = "openai"
-    logger.info("Using OpenAI as primary model")
-elif gemini_api_key:
-    model_preference = "gemini"
-    logger.info("Using Gemini as primary model")
-else:
-    model_preference = "nltk"
-    logger.info("No API keys found, using NLTK rule-based fallback only")
+def render_shared_page(template: str, **context) -> str:
+    """Render a page that is the same for every visitor once, then reuse it; its context must not depend on the session."""
+    if app.debug or app.config.get('TEMPLATES_AUTO_RELOAD'):
+        return render_template(template, **context)
+    key = service.shared_page_key(template, context)
+    page = service.pages.get(key)
+    if page is None:
+        page = render_template(template, **context)
+        service.pages.put(key, page)
+    return page
 
-# Initialize the chatbot with the appropriate model preference
-chatbot = Chatbot(model_preference=model_preference)
+@app.before_request
+def start_timing():
+    """Start collecting the request's stage timings."""
+    g.request_started = time.perf_counter()
+    begin_request()
+
+@app.before_request
+def limit_rate():
+    """Refuse chat requests from clients over their budget before any work is done."""
+    if service.rate_limiter is None or request.endpoint not in RATE_LIMITED_ENDPOINTS:
+        return None
+    allowed, retry_after = service.rate_limiter.check(client_key())
+    if allowed:
+        return None
+    logger.info("Rate limited %s on %s", client_key(), request.endpoint)
+    return retry_later(retry_after, 'Too many requests, please slow down'), 429
+
+@app.after_request
+def record_timing(response):
+    """Record the request's latency and report its stages in a Server-Timing header."""
+    started = g.pop('request_started', None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        metrics.observe_request(request.endpoint or 'unknown', response.status_code, elapsed)
+        stages = dict(request_stages() or {}, total=elapsed)
+        response.headers['Server-Timing'] = server_timing(stages)
+    return response
 
 @app.route('/')
 def home():
     """Render the main chat interface."""
-    # Initialize or reset the chat history when accessing the home page
-    if 'chat_history' not in session:
-        session['chat_history'] = []
-    return render_template('index.html', chat_history=session['chat_history'])
+    chat_history = service.home_history(session)
+    if not chat_history:
+        # A new conversation's page is the same for everyone
+        return render_shared_page('index.html')
+    return render_template('index.html', chat_history=chat_history)
 
 @app.route('/about')
 def about():
     """Render the about page with information about the chatbot."""
-    return render_template('about.html')
+    return render_shared_page('about.html')
+
+@app.route('/assets/<path:filename>', methods=['GET'])
+def serve_asset(filename):
+    """Serve a fingerprinted static file, precompressed and cacheable for a year."""
+    answer = service.assets.respond(filename, request.headers.get('Accept-Encoding'),
+                                    request.headers.get('If-None-Match'))
+    if answer is None:
+        return Response('Not found', status=404, mimetype='text/plain')
+    status, body, headers = answer
+    return Response(body, status=status, headers=headers)
 
 @app.route('/chat', methods=['POST'])
 def chat():
     """Process a chat message and return the AI response."""
     try:
-        user_message = request.json.get('message', '')
-        
-        if not user_message.strip():
-            return jsonify({'error': 'Please enter a message'}), 400
-        
-        # Initialize chat history if it doesn't exist
-        if 'chat_history' not in session:
-            session['chat_history'] = []
-        
+        try:
+            user_message = parse_message(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        chatbot = service.router.chatbot_for(session)
+        conversation, chat_history, context = service.load_conversation(session)
+
         # Get chatbot response
-        response = chatbot.get_response(user_message, session['chat_history'])
-        
-        # Update chat history
-        new_exchange = {
-            'user': user_message,
-            'bot': response
-        }
-        
-        session['chat_history'].append(new_exchange)
-        session.modified = True
-        
-        return jsonify({
-            'response': response,
-            'history': session['chat_history']
-        })
-    
+        reset_current_window()
+        response = chatbot.get_response(user_message, chat_history, context)
+        new_exchange = service.save_exchange(chatbot, conversation, context, user_message, response)
+
+        return jsonify(service.chat_result(conversation, response, new_exchange))
+
+    except Overloaded as e:
+        return retry_later(e.retry_after), 503
+    except Exception as e:
+        logger.error("Error in chat endpoint: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Process a chat message and stream the AI response as Server-Sent Events."""
+    try:
+        try:
+            user_message = parse_message(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        chatbot = service.router.chatbot_for(session)
+        conversation, chat_history, context = service.load_conversation(session)
+
+        # The first chunk is awaited here, so a request refused for lack of capacity still gets a 503
+        stream = chatbot.stream_response(user_message, chat_history, context)
+        first = next(stream, None)
+
+        def generate():
+            chunks = []
+            try:
+                for chunk in itertools.chain(() if first is None else (first,), stream):
+                    chunks.append(chunk)
+                    yield sse_token(chunk)
+            except Exception as e:
+                logger.error("Error in chat stream: %s", e)
+                yield sse_error(e)
+                return
+
+            response = ''.join(chunks)
+            service.save_exchange(chatbot, conversation, context, user_message, response)
+            yield sse_done(response)
+
+        return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    except Overloaded as e:
+        return retry_later(e.retry_after), 503
     except Exception as e:
-        logger.error(f"Error in chat endpoint: {str(e)}")
-        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+        logger.error("Error in chat stream endpoint: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """Answer many (conversation, message) pairs in one request, e.g. for replay and evaluation jobs."""
+    try:
+        try:
+            chatbot, batch, histories = service.batch_chatbot(session, request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        responses = chatbot.get_responses(batch, histories)
+        return jsonify(service.batch_result(batch, responses))
+
+    except Overloaded as e:
+        return retry_later(e.retry_after), 503
+    except Exception as e:
+        logger.error("Error in chat batch endpoint: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/history', methods=['GET'])
+def history():
+    """Return one page of the conversation history, oldest first."""
+    try:
+        return jsonify(service.history_page(session, request.args.get('offset', type=int),
+                                            request.args.get('limit', type=int)))
+    except Exception as e:
+        logger.error("Error getting history: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/history/export', methods=['GET'])
+def export_history():
+    """Download the whole conversation in the compact encoded form read by /history/import."""
+    try:
+        data, count = service.export_history(session)
+        return Response(data, mimetype='application/octet-stream',
+                        headers={'Content-Disposition': 'attachment; filename="conversation.chx"',
+                                 'X-Exchange-Count': str(count)})
+    except Exception as e:
+        logger.error("Error exporting history: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/history/import', methods=['POST'])
+def import_history():
+    """Replace the conversation with one downloaded from /history/export."""
+    try:
+        if (request.content_length or 0) > MAX_DECODED_BYTES:
+            return jsonify({'error': 'History is too large'}), 413
+        try:
+            total = service.import_history(session, request.get_data())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'status': 'Chat history imported successfully', 'total': total})
+    except Exception as e:
+        logger.error("Error importing history: %s", e)
+        return jsonify(error_body(e)), 500
 
 @app.route('/reset', methods=['POST'])
 def reset_chat():
     """Reset the chat history."""
     try:
-        session['chat_history'] = []
+        service.reset(session)
         return jsonify({'status': 'Chat history reset successfully'})
     except Exception as e:
-        logger.error(f"Error resetting chat: {str(e)}")
-        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
-        
+        logger.error("Error resetting chat: %s", e)
+        return jsonify(error_body(e)), 500
+
 @app.route('/model', methods=['GET'])
 def get_model():
     """Get the current AI model being used."""
     try:
-        available_models = chatbot.available_models
-        current_model = chatbot.model_preference
-        
-        # Check if API keys are available
-        openai_available = "openai" in available_models
-        gemini_available = "gemini" in available_models
-        nltk_available = "nltk" in available_models
-        
-        return jsonify({
-            'current_model': current_model,
-            'available_models': available_models,
-            'openai_available': openai_available,
-            'gemini_available': gemini_available,
-            'nltk_available': nltk_available
-        })
+        return jsonify(service.model_info(session))
     except Exception as e:
-        logger.error(f"Error getting model info: {str(e)}")
-        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
-        
+        logger.error("Error getting model info: %s", e)
+        return jsonify(error_body(e)), 500
+
 @app.route('/model', methods=['POST'])
 def set_model():
     """Change the AI model being used."""
     try:
-        model_name = request.json.get('model', 'auto')
-        
-        # Validate model name
-        if model_name not in ['auto', 'openai', 'gemini', 'nltk']:
-            return jsonify({'error': 'Invalid model name'}), 400
-            
-        # Recreate the chatbot with the new model preference
-        global chatbot
-        chatbot = Chatbot(model_preference=model_name)
-        
-        return jsonify({
-            'status': 'Model updated successfully',
-            'current_model': chatbot.model_preference,
-            'available_models': chatbot.available_models
-        })
-        
+        try:
+            return jsonify(service.set_model(session, request.get_json(silent=True)))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error("Error setting model: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """Get response cache hit rates and other backend statistics."""
+    if not service.stats_authorized(request.headers.get('Authorization')):
+        return jsonify({'error': 'Unauthorized'}), 401, {'WWW-Authenticate': 'Bearer'}
+    try:
+        return jsonify(service.stats())
     except Exception as e:
-        logger.error(f"Error setting model: {str(e)}")
-        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+        logger.error("Error getting stats: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Expose stage and request latency histograms in the Prometheus text format."""
+    if not service.stats_authorized(request.headers.get('Authorization')):
+        return jsonify({'error': 'Unauthorized'}), 401, {'WWW-Authenticate': 'Bearer'}
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Profiling hooks and admin routes, registered below only when profiling is enabled
+def start_profile():
+    """Run the request under the profiler when it presents the profiling token or is sampled."""
+    if request.endpoint not in PROFILED_ENDPOINTS:
+        return None
+    reason = service.profiler.wants(request.headers.get(PROFILE_HEADER))
+    if reason is not None:
+        g.profile = service.profiler.start(request.endpoint, request.method, request.path, reason)
+    return None
+
+def label_profile(response):
+    """Tell the client which profile its request was captured as."""
+    capture = g.get('profile')
+    if capture is not None:
+        response.headers['X-Profile-Id'] = str(capture.id)
+        g.profile_status = response.status_code
+    return response
+
+def finish_profile(exc):
+    """Stop the request's profile at teardown, which follows session saving and, for streams, the last chunk."""
+    capture = g.pop('profile', None)
+    if capture is not None:
+        service.profiler.finish(capture, g.pop('profile_status', 500))
+
+def list_profiles():
+    """List the kept profiles, newest first, with the functions each spent the most time in."""
+    if not service.profiler.authorized(request.headers.get(PROFILE_HEADER)):
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(service.profile_listing())
+
+def get_profile(capture_id):
+    """Get one profile as a pstats text report, a pstats file (?format=pstats) or collapsed stacks (?format=collapsed)."""
+    if not service.profiler.authorized(request.headers.get(PROFILE_HEADER)):
+        return jsonify({'error': 'Forbidden'}), 403
+    status, body, headers = service.profile(capture_id, request.args.get('format', 'text'),
+                                            request.args.get('sort', 'cumulative'))
+    if isinstance(body, dict):
+        return jsonify(body), status
+    return Response(body, status=status, headers=headers)
+
+if service.profiler is not None:
+    app.before_request(start_profile)
+    app.after_request(label_profile)
+    app.teardown_request(finish_profile)
+    app.add_url_rule('/admin/profiles', view_func=list_profiles, methods=['GET'])
+    app.add_url_rule('/admin/profiles/<int:capture_id>', view_func=get_profile, methods=['GET'])
+    logger.info("Request profiling enabled (sample rate %s)", service.profiler.sample_rate)
 
 # Error handlers
 @app.errorhandler(404)
 def page_not_found(e):
     """Handle 404 errors."""
-    return render_template('index.html', error="Page not found"), 404
+    return render_shared_page('index.html', error="Page not found"), 404
 
 @app.errorhandler(500)
 def server_error(e):
     """Handle 500 errors."""
-    return render_template('index.html', error="Server error occurred"), 500
+    return render_shared_page('index.html', error="Server error occurred"), 500
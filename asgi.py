@@ -0,0 +1,365 @@
+"""
+ASGI variant of the web application.
+Serves the same routes as app.py on an event loop, so one process can hold many
+in-flight conversations while the upstream models are working.
+
+Run with: uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import os
+import time
+import asyncio
+import logging
+from quart import Quart, render_template, request, jsonify, session, g, Response, url_for
+from quart.sessions import SecureCookieSessionInterface
+from chat_service import (ChatService, RATE_LIMITED_ENDPOINTS, PROFILED_ENDPOINTS, error_body, parse_message,
+                          retry_body, sse_token, sse_error, sse_done)
+from exchange import MAX_DECODED_BYTES
+from context_builder import reset_current_window
+from instrumentation import metrics, timed, begin_request, request_stages, server_timing
+from rate_limit import Overloaded
+from profiling import PROFILE_HEADER
+
+# Configure logging; per-message details are logged at DEBUG
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
+class TimedSessionInterface(SecureCookieSessionInterface):
+    """Cookie sessions whose loading and serialization are recorded as stages."""
+
+    async def open_session(self, app, request):
+        with timed("session_load"):
+            return await super().open_session(app, request)
+
+    async def save_session(self, app, session, response):
+        with timed("session_save"):
+            await super().save_session(app, session, response)
+
+# Initialize Quart app; sessions are signed the same way as the Flask app's
+app = Quart(__name__)
+app.secret_key = os.environ.get("SESSION_SECRET", "default-secret-key-for-development")
+app.session_interface = TimedSessionInterface()
+
+# Backends, storage and the route logic shared with the Flask app.
+# Store queries and context updates block, so they run in worker threads
+# rather than stalling every request in flight on the event loop.
+service = ChatService(app.static_folder)
+
+def client_key() -> str:
+    """Get the key the rate limiter counts a request under: its session or its client's address."""
+    return service.client_key(session, request.remote_addr, ', '.join(request.headers.getlist('X-Forwarded-For')))
+
+def retry_later(retry_after: float, message: str = 'The server is busy, please retry shortly'):
+    """Build the response telling a client to come back after `retry_after` seconds."""
+    body, headers = retry_body(retry_after, message)
+    response = jsonify(body)
+    response.headers.update(headers)
+    return response
+
+def asset_url(filename: str) -> str:
+    """Get a static file's fingerprinted URL; the plain static URL in debug mode, so edits show up at once."""
+    fingerprinted = None if app.debug else service.assets.fingerprinted(filename)
+    if fingerprinted is None:
+        return url_for('static', filename=filename)
+    return url_for('serve_asset', filename=fingerprinted)
+
+app.add_template_global(asset_url)
+
+async def render_shared_page(template: str, **context) -> str:
+    """Render a page that is the same for every visitor once, then reuse it; its context must not depend on the session."""
+    if app.debug or app.config.get('TEMPLATES_AUTO_RELOAD'):
+        return await render_template(template, **context)
+    key = service.shared_page_key(template, context)
+    page = service.pages.get(key)
+    if page is None:
+        page = await render_template(template, **context)
+        service.pages.put(key, page)
+    return page
+
+@app.before_request
+async def start_timing():
+    """Start collecting the request's stage timings."""
+    g.request_started = time.perf_counter()
+    begin_request()
+
+@app.before_request
+async def limit_rate():
+    """Refuse chat requests from clients over their budget before any work is done."""
+    if service.rate_limiter is None or request.endpoint not in RATE_LIMITED_ENDPOINTS:
+        return None
+    # The limiter may keep its buckets in SQLite
+    allowed, retry_after = await asyncio.to_thread(service.rate_limiter.check, client_key())
+    if allowed:
+        return None
+    logger.info("Rate limited %s on %s", client_key(), request.endpoint)
+    return retry_later(retry_after, 'Too many requests, please slow down'), 429
+
+@app.after_request
+async def record_timing(response):
+    """Record the request's latency and report its stages in a Server-Timing header."""
+    started = g.pop('request_started', None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        metrics.observe_request(request.endpoint or 'unknown', response.status_code, elapsed)
+        stages = dict(request_stages() or {}, total=elapsed)
+        response.headers['Server-Timing'] = server_timing(stages)
+    return response
+
+@app.route('/')
+async def home():
+    """Render the main chat interface."""
+    chat_history = await asyncio.to_thread(service.home_history, session)
+    if not chat_history:
+        # A new conversation's page is the same for everyone
+        return await render_shared_page('index.html')
+    return await render_template('index.html', chat_history=chat_history)
+
+@app.route('/about')
+async def about():
+    """Render the about page with information about the chatbot."""
+    return await render_shared_page('about.html')
+
+@app.route('/assets/<path:filename>', methods=['GET'])
+async def serve_asset(filename):
+    """Serve a fingerprinted static file, precompressed and cacheable for a year."""
+    answer = service.assets.respond(filename, request.headers.get('Accept-Encoding'),
+                                    request.headers.get('If-None-Match'))
+    if answer is None:
+        return Response('Not found', status=404, mimetype='text/plain')
+    status, body, headers = answer
+    return Response(body, status=status, headers=headers)
+
+@app.route('/chat', methods=['POST'])
+async def chat():
+    """Process a chat message and return the AI response."""
+    try:
+        try:
+            user_message = parse_message(await request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        chatbot = service.router.chatbot_for(session)
+        conversation, chat_history, context = await asyncio.to_thread(service.load_conversation, session)
+
+        # Get chatbot response without holding a thread while the model works
+        reset_current_window()
+        response = await chatbot.get_response_async(user_message, chat_history, context)
+        new_exchange = await asyncio.to_thread(service.save_exchange, chatbot, conversation, context,
+                                               user_message, response)
+
+        return jsonify(service.chat_result(conversation, response, new_exchange))
+
+    except Overloaded as e:
+        return retry_later(e.retry_after), 503
+    except Exception as e:
+        logger.error("Error in chat endpoint: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/chat/stream', methods=['POST'])
+async def chat_stream():
+    """Process a chat message and stream the AI response as Server-Sent Events."""
+    try:
+        try:
+            user_message = parse_message(await request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        chatbot = service.router.chatbot_for(session)
+        conversation, chat_history, context = await asyncio.to_thread(service.load_conversation, session)
+
+        # The first chunk is awaited here, so a request refused for lack of capacity still gets a 503
+        stream = chatbot.stream_response_async(user_message, chat_history, context)
+        first = await anext(stream, None)
+
+        async def generate():
+            chunks = []
+            try:
+                if first is not None:
+                    chunks.append(first)
+                    yield sse_token(first).encode()
+                async for chunk in stream:
+                    chunks.append(chunk)
+                    yield sse_token(chunk).encode()
+            except Exception as e:
+                logger.error("Error in chat stream: %s", e)
+                yield sse_error(e).encode()
+                return
+
+            response = ''.join(chunks)
+            await asyncio.to_thread(service.save_exchange, chatbot, conversation, context, user_message, response)
+            yield sse_done(response).encode()
+
+        return generate(), 200, {
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+
+    except Overloaded as e:
+        return retry_later(e.retry_after), 503
+    except Exception as e:
+        logger.error("Error in chat stream endpoint: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/chat/batch', methods=['POST'])
+async def chat_batch():
+    """Answer many (conversation, message) pairs in one request, e.g. for replay and evaluation jobs."""
+    try:
+        try:
+            chatbot, batch, histories = service.batch_chatbot(session, await request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        responses = await chatbot.get_responses_async(batch, histories)
+        return jsonify(service.batch_result(batch, responses))
+
+    except Overloaded as e:
+        return retry_later(e.retry_after), 503
+    except Exception as e:
+        logger.error("Error in chat batch endpoint: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/history', methods=['GET'])
+async def history():
+    """Return one page of the conversation history, oldest first."""
+    try:
+        return jsonify(await asyncio.to_thread(service.history_page, session,
+                                               request.args.get('offset', type=int),
+                                               request.args.get('limit', type=int)))
+    except Exception as e:
+        logger.error("Error getting history: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/history/export', methods=['GET'])
+async def export_history():
+    """Download the whole conversation in the compact encoded form read by /history/import."""
+    try:
+        data, count = await asyncio.to_thread(service.export_history, session)
+        return Response(data, mimetype='application/octet-stream',
+                        headers={'Content-Disposition': 'attachment; filename="conversation.chx"',
+                                 'X-Exchange-Count': str(count)})
+    except Exception as e:
+        logger.error("Error exporting history: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/history/import', methods=['POST'])
+async def import_history():
+    """Replace the conversation with one downloaded from /history/export."""
+    try:
+        if (request.content_length or 0) > MAX_DECODED_BYTES:
+            return jsonify({'error': 'History is too large'}), 413
+        data = await request.get_data()
+        try:
+            total = await asyncio.to_thread(service.import_history, session, data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'status': 'Chat history imported successfully', 'total': total})
+    except Exception as e:
+        logger.error("Error importing history: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/reset', methods=['POST'])
+async def reset_chat():
+    """Reset the chat history."""
+    try:
+        await asyncio.to_thread(service.reset, session)
+        return jsonify({'status': 'Chat history reset successfully'})
+    except Exception as e:
+        logger.error("Error resetting chat: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/model', methods=['GET'])
+async def get_model():
+    """Get the current AI model being used."""
+    try:
+        return jsonify(service.model_info(session))
+    except Exception as e:
+        logger.error("Error getting model info: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/model', methods=['POST'])
+async def set_model():
+    """Change the AI model being used."""
+    try:
+        try:
+            return jsonify(service.set_model(session, await request.get_json(silent=True)))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error("Error setting model: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/stats', methods=['GET'])
+async def get_stats():
+    """Get response cache hit rates and other backend statistics."""
+    if not service.stats_authorized(request.headers.get('Authorization')):
+        return jsonify({'error': 'Unauthorized'}), 401, {'WWW-Authenticate': 'Bearer'}
+    try:
+        return jsonify(service.stats())
+    except Exception as e:
+        logger.error("Error getting stats: %s", e)
+        return jsonify(error_body(e)), 500
+
+@app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    """Expose stage and request latency histograms in the Prometheus text format."""
+    if not service.stats_authorized(request.headers.get('Authorization')):
+        return jsonify({'error': 'Unauthorized'}), 401, {'WWW-Authenticate': 'Bearer'}
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Profiling hooks and admin routes, registered below only when profiling is enabled
+async def start_profile():
+    """
+    Run the request under the profiler when it presents the profiling token or is sampled.
+
+    cProfile runs on the event loop thread, so a profile also captures every other
+    coroutine the loop runs until the request finishes; it shows where the process
+    spent its time during the request rather than the request's time alone.
+    """
+    if request.endpoint not in PROFILED_ENDPOINTS:
+        return None
+    reason = service.profiler.wants(request.headers.get(PROFILE_HEADER))
+    if reason is not None:
+        g.profile = service.profiler.start(request.endpoint, request.method, request.path, reason)
+    return None
+
+async def finish_profile(response):
+    """Stop the request's profile; a streamed response is profiled up to its first chunk."""
+    capture = g.pop('profile', None)
+    if capture is not None:
+        service.profiler.finish(capture, response.status_code)
+        response.headers['X-Profile-Id'] = str(capture.id)
+    return response
+
+async def list_profiles():
+    """List the kept profiles, newest first, with the functions each spent the most time in."""
+    if not service.profiler.authorized(request.headers.get(PROFILE_HEADER)):
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(service.profile_listing(event_loop=True))
+
+async def get_profile(capture_id):
+    """Get one profile as a pstats text report, a pstats file (?format=pstats) or collapsed stacks (?format=collapsed)."""
+    if not service.profiler.authorized(request.headers.get(PROFILE_HEADER)):
+        return jsonify({'error': 'Forbidden'}), 403
+    status, body, headers = service.profile(capture_id, request.args.get('format', 'text'),
+                                            request.args.get('sort', 'cumulative'))
+    if isinstance(body, dict):
+        return jsonify(body), status
+    return Response(body, status=status, headers=headers)
+
+if service.profiler is not None:
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.add_url_rule('/admin/profiles', view_func=list_profiles, methods=['GET'])
+    app.add_url_rule('/admin/profiles/<int:capture_id>', view_func=get_profile, methods=['GET'])
+    logger.info("Request profiling enabled (sample rate %s)", service.profiler.sample_rate)
+
+# Error handlers
+@app.errorhandler(404)
+async def page_not_found(e):
+    """Handle 404 errors."""
+    return await render_shared_page('index.html', error="Page not found"), 404
+
+@app.errorhandler(500)
+async def server_error(e):
+    """Handle 500 errors."""
+    return await render_shared_page('index.html', error="Server error occurred"), 500
@@ -0,0 +1,253 @@
+"""
+Static asset delivery and rendered page caching.
+This module fingerprints the files under the static folder, compresses them once at startup and
+answers asset requests with long-lived cache headers, and caches pages that render the same for everyone.
+"""
+import os
+import gzip
+import hashlib
+import logging
+import mimetypes
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Any, Tuple, Hashable
+
+try:
+    import brotli
+    brotli_available = True
+except ImportError:
+    brotli_available = False
+
+logger = logging.getLogger(__name__)
+
+# Fingerprinted URLs never change content, so clients and proxies may keep them for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Hex digits of the content hash put in file names
+FINGERPRINT_LENGTH = 12
+
+# Types worth compressing; images and fonts are compressed already
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml', 'image/svg+xml')
+
+# Files smaller than this are sent as they are; compression would not pay for the Content-Encoding round trip
+MIN_COMPRESS_BYTES = 256
+
+# A compressed variant is kept only if it is at most this fraction of the original
+MAX_COMPRESSED_RATIO = 0.9
+
+# Content-Encoding values in order of preference, with the ETag suffix of each variant
+ENCODINGS = (('br', '-br'), ('gzip', '-gz'))
+
+
+class Asset:
+    """One static file with its fingerprinted name and precompressed variants."""
+
+    __slots__ = ('name', 'fingerprinted', 'content_type', 'digest', 'variants')
+
+    def __init__(self, name: str, data: bytes):
+        digest = hashlib.sha256(data).hexdigest()[:FINGERPRINT_LENGTH]
+        stem, extension = os.path.splitext(name)
+        self.name = name
+        self.fingerprinted = f"{stem}.{digest}{extension}"
+        self.digest = digest
+
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in ('application/javascript', 'image/svg+xml'):
+            content_type += '; charset=utf-8'
+        self.content_type = content_type
+
+        self.variants: Dict[str, bytes] = {'identity': data}
+        if len(data) >= MIN_COMPRESS_BYTES and content_type.startswith(COMPRESSIBLE_TYPES):
+            # mtime=0 keeps the gzip bytes, and so the ETag's representation, the same across restarts
+            compressed = {'gzip': gzip.compress(data, 9, mtime=0)}
+            if brotli_available:
+                compressed['br'] = brotli.compress(data, quality=11)
+            for encoding, body in compressed.items():
+                if len(body) <= MAX_COMPRESSED_RATIO * len(data):
+                    self.variants[encoding] = body
+
+    def etag(self, encoding: str) -> str:
+        """Get the strong ETag of one representation of the file."""
+        suffix = dict(ENCODINGS).get(encoding, '')
+        return f'"{self.digest}{suffix}"'
+
+
+def _accepted_encodings(header: Optional[str]) -> Dict[str, float]:
+    """Parse an Accept-Encoding header into encoding -> quality."""
+    accepted = {}
+    for part in (header or '').split(','):
+        fields = part.strip().split(';')
+        encoding = fields[0].strip().lower()
+        if not encoding:
+            continue
+        quality = 1.0
+        for field in fields[1:]:
+            key, _, value = field.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[encoding] = quality
+    return accepted
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check whether an If-None-Match header lists an ETag, comparing weakly as RFC 9110 requires."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(candidate.strip().removeprefix('W/') == etag for candidate in if_none_match.split(','))
+
+
+class AssetManifest:
+    """
+    Fingerprinted, precompressed copies of the files under a static folder.
+
+    The files are read once, so changes show up after a restart; in debug
+    mode the apps link the plain static URLs instead.
+    """
+
+    def __init__(self, root: str):
+        """
+        Read and compress every file under a folder.
+
+        Args:
+            root: The static folder
+        """
+        self.root = root
+        self._assets: Dict[str, Asset] = {}  # name -> asset
+        self._fingerprinted: Dict[str, Asset] = {}  # fingerprinted name -> asset
+
+        if os.path.isdir(root):
+            for directory, directories, files in os.walk(root):
+                directories.sort()
+                for filename in sorted(files):
+                    path = os.path.join(directory, filename)
+                    name = os.path.relpath(path, root).replace(os.sep, '/')
+                    try:
+                        with open(path, 'rb') as f:
+                            asset = Asset(name, f.read())
+                    except OSError as e:
+                        logger.warning("Static file %s skipped: %s", path, e)
+                        continue
+                    self._assets[name] = asset
+                    self._fingerprinted[asset.fingerprinted] = asset
+        logger.info("Asset manifest: %s files under %s (brotli %s)", len(self._assets), root,
+                    "enabled" if brotli_available else "not installed")
+
+    def fingerprinted(self, name: str) -> Optional[str]:
+        """Get the fingerprinted name of a static file, or None if it is not in the manifest."""
+        asset = self._assets.get(name.lstrip('/'))
+        return asset.fingerprinted if asset is not None else None
+
+    def respond(self, fingerprinted: str, accept_encoding: Optional[str] = None,
+                if_none_match: Optional[str] = None) -> Optional[Tuple[int, bytes, Dict[str, str]]]:
+        """
+        Answer a request for a fingerprinted file.
+
+        Brotli is preferred over gzip over no encoding, among the encodings the
+        client accepts; a client that already holds the chosen representation
+        gets 304 Not Modified.
+
+        Args:
+            fingerprinted: The fingerprinted name requested
+            accept_encoding: The request's Accept-Encoding header
+            if_none_match: The request's If-None-Match header
+
+        Returns:
+            Tuple of the status, body and headers, or None if there is no such file
+        """
+        asset = self._fingerprinted.get(fingerprinted)
+        if asset is None:
+            return None
+
+        accepted = _accepted_encodings(accept_encoding)
+        wildcard = accepted.get('*', 0.0)
+        encoding = 'identity'
+        for candidate, _ in ENCODINGS:
+            if candidate in asset.variants and accepted.get(candidate, wildcard) > 0:
+                encoding = candidate
+                break
+
+        etag = asset.etag(encoding)
+        headers = {'Cache-Control': IMMUTABLE_CACHE_CONTROL, 'ETag': etag}
+        if len(asset.variants) > 1:
+            headers['Vary'] = 'Accept-Encoding'
+        if _matches(if_none_match, etag):
+            return 304, b'', headers
+
+        headers['Content-Type'] = asset.content_type
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return 200, asset.variants[encoding], headers
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get manifest statistics.
+
+        Returns:
+            Dictionary with the file count and the bytes of each representation
+        """
+        totals: Dict[str, int] = {}
+        for asset in self._assets.values():
+            for encoding, body in asset.variants.items():
+                totals[encoding] = totals.get(encoding, 0) + len(body)
+        return {'files': len(self._assets), 'bytes': totals, 'brotli': brotli_available}
+
+
+class RenderCache:
+    """
+    Rendered pages keyed by template and context, for pages that render the same for every visitor.
+
+    Only pages whose context is fully described by the key may be cached:
+    nothing from the session, the user or the time of day.
+    """
+
+    def __init__(self, max_entries: int = 64):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Pages kept; the least recently used one is dropped past this
+        """
+        self.max_entries = max_entries
+        self._pages: 'OrderedDict[Hashable, str]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: Hashable) -> Optional[str]:
+        """Get a rendered page, or None if it has not been rendered yet."""
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None:
+                self._misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self._hits += 1
+            return page
+
+    def put(self, key: Hashable, page: str):
+        """Keep a rendered page."""
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            if len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+
+    def clear(self):
+        """Drop every page, e.g. after the templates changed."""
+        with self._lock:
+            self._pages.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics.
+
+        Returns:
+            Dictionary with the cached page count and the hit and miss counts
+        """
+        with self._lock:
+            return {'pages': len(self._pages), 'hits': self._hits, 'misses': self._misses}
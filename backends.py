@@ -0,0 +1,237 @@
+"""
+Shared model backends and per-session model routing.
+This module builds each backend once per process and picks the chatbot for a session
+from the model preference stored in that session.
+"""
+import logging
+import threading
+from typing import Dict, List, Tuple, Callable, Any, Optional
+
+import transport
+from chatbot import Chatbot, ai_models_available
+from response_cache import create_response_cache
+from semantic_cache import create_semantic_cache
+from dispatch import create_dispatcher
+from knowledge_base import shared_knowledge_base
+from preprocessing import TextPreprocessor
+
+if ai_models_available:
+    from ai_models import OpenAIModel, GeminiModel
+
+logger = logging.getLogger(__name__)
+
+MODEL_PREFERENCES = ['auto', 'openai', 'gemini', 'nltk']
+
+# Largest number of items accepted by one /chat/batch request
+MAX_BATCH_SIZE = 1000
+
+# Most previous exchanges accepted for one conversation of a /chat/batch request
+MAX_HISTORY_EXCHANGES = 50
+
+def parse_batch(payload: Any) -> Tuple[List[Tuple[str, str]], Dict[str, List[Dict[str, str]]], Optional[str]]:
+    """
+    Validate a /chat/batch request body.
+
+    The body holds "items", a list of {"conversation": id, "message": text},
+    and optionally "histories" (conversation id -> at most MAX_HISTORY_EXCHANGES
+    previous {"user": text, "bot": text} exchanges) and "model" to override
+    the session's model preference.
+
+    Args:
+        payload: The decoded JSON body
+
+    Returns:
+        Tuple of the (conversation, message) pairs, the histories and the model preference (None for the session's)
+
+    Raises:
+        ValueError: If the body is malformed or too large
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get('items'), list):
+        raise ValueError("Expected a JSON object with an 'items' list")
+    items = payload['items']
+    if not items:
+        raise ValueError("The batch is empty")
+    if len(items) > MAX_BATCH_SIZE:
+        raise ValueError(f"A batch holds at most {MAX_BATCH_SIZE} items")
+
+    batch = []
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get('message'), str):
+            raise ValueError("Every item needs a 'message' string")
+        batch.append((str(item.get('conversation', '')), item['message']))
+
+    histories = payload.get('histories') or {}
+    if not isinstance(histories, dict) or not all(isinstance(history, list) for history in histories.values()):
+        raise ValueError("'histories' must map conversation ids to lists of exchanges")
+    for history in histories.values():
+        if len(history) > MAX_HISTORY_EXCHANGES:
+            raise ValueError(f"A history holds at most {MAX_HISTORY_EXCHANGES} exchanges")
+        for exchange in history:
+            if (not isinstance(exchange, dict) or not isinstance(exchange.get('user'), str)
+                    or not isinstance(exchange.get('bot'), str)):
+                raise ValueError("Every exchange needs 'user' and 'bot' strings")
+
+    model = payload.get('model')
+    if model is not None and model not in MODEL_PREFERENCES:
+        raise ValueError("Invalid model name")
+    return batch, histories, model
+
+class BackendRegistry:
+    """
+    Build each model backend once and share it across requests.
+
+    API clients are created on first use and reused by every chatbot, and one
+    Chatbot is kept per model preference. Chatbots are never modified after
+    construction, so requests can share them without locking. All chatbots
+    share one response cache and one semantic cache, both keyed by the model
+    preference, and one dispatcher, so a backend's circuit breaker sees
+    every request sent to it.
+    """
+
+    def __init__(self, factories: Optional[Dict[str, Callable[[], Any]]] = None, response_cache=None,
+                 semantic_cache=None, dispatcher=None, knowledge_base=None):
+        """
+        Initialize the registry.
+
+        Args:
+            factories: Backend name -> callable building that backend; defaults to the API models
+            response_cache: ResponseCache shared by the chatbots; defaults to one configured from the environment
+            semantic_cache: SemanticCache shared by the chatbots; defaults to one configured from the environment
+            dispatcher: Dispatcher shared by the chatbots; defaults to one configured from the environment
+            knowledge_base: KnowledgeBase shared by the chatbots; defaults to the one configured by KNOWLEDGE_BASE, if any
+        """
+        if factories is None:
+            factories = {'openai': OpenAIModel, 'gemini': GeminiModel} if ai_models_available else {}
+        self._factories = factories
+        self._backends: Dict[str, Any] = {}
+        self._chatbots: Dict[str, Chatbot] = {}
+        self._lock = threading.RLock()
+        self.response_cache = response_cache if response_cache is not None else create_response_cache()
+        if semantic_cache is None:
+            # Embed the NLTK-preprocessed tokens, so stop words and inflections do not count
+            semantic_cache = create_semantic_cache(preprocess=TextPreprocessor().preprocess)
+        self.semantic_cache = semantic_cache
+        self.dispatcher = dispatcher or create_dispatcher()
+        self.knowledge_base = knowledge_base or shared_knowledge_base()
+
+    def backend(self, name: str) -> Optional[Any]:
+        """
+        Get the shared instance of a backend, building it on first use.
+
+        Args:
+            name: Backend name, e.g. "openai"
+
+        Returns:
+            The backend, or None if the registry has no factory for it
+        """
+        backend = self._backends.get(name)
+        if backend is not None or name not in self._factories:
+            return backend
+
+        with self._lock:
+            if name not in self._backends:
+                self._backends[name] = self._factories[name]()
+                logger.info("Built shared %s backend", name)
+            return self._backends[name]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get statistics of the shared backends.
+
+        Returns:
+            Dictionary with response cache, semantic cache, knowledge base, dispatch, HTTP pool and OpenAI
+            context window statistics
+        """
+        stats = {
+            'dispatch': self.dispatcher.stats(),
+            'http_pool': transport.stats(),
+            'response_cache': self.response_cache.stats() if self.response_cache is not None else None,
+            'semantic_cache': self.semantic_cache.stats() if self.semantic_cache is not None else None,
+            'knowledge_base': self.knowledge_base.stats() if self.knowledge_base is not None else None
+        }
+        openai_model = self._backends.get('openai')
+        if openai_model is not None and openai_model.available:
+            stats['openai_context'] = openai_model.context_builder.stats()
+        return stats
+
+    def chatbot(self, preference: str) -> Chatbot:
+        """
+        Get the shared chatbot for a model preference, building it on first use.
+
+        Args:
+            preference: One of MODEL_PREFERENCES
+
+        Returns:
+            A chatbot backed by the shared backends
+        """
+        chatbot = self._chatbots.get(preference)
+        if chatbot is not None:
+            return chatbot
+
+        with self._lock:
+            if preference not in self._chatbots:
+                # Only the backends the preference can use are built, as building one imports its SDK
+                openai_model = self.backend('openai') if preference in ('auto', 'openai') else None
+                gemini_model = None
+                if preference in ('auto', 'gemini') or (
+                        preference == 'openai' and not getattr(openai_model, 'available', False)):
+                    gemini_model = self.backend('gemini')
+                self._chatbots[preference] = Chatbot(
+                    model_preference=preference,
+                    openai_model=openai_model,
+                    gemini_model=gemini_model,
+                    response_cache=self.response_cache,
+                    semantic_cache=self.semantic_cache,
+                    dispatcher=self.dispatcher,
+                    knowledge_base=self.knowledge_base
+                )
+            return self._chatbots[preference]
+
+
+class ModelRouter:
+    """
+    Route each session to a chatbot according to its stored model preference.
+
+    Switching models only changes the session, so it costs nothing and does
+    not affect other users or requests already in flight.
+    """
+
+    SESSION_KEY = 'model_preference'
+
+    def __init__(self, registry: BackendRegistry, default_preference: str = 'auto'):
+        """
+        Initialize the router.
+
+        Args:
+            registry: Registry providing the shared chatbots
+            default_preference: Preference for sessions that have not chosen a model
+        """
+        self.registry = registry
+        self.default_preference = default_preference
+
+    def preference(self, session) -> str:
+        """Get the model preference stored in a session."""
+        preference = session.get(self.SESSION_KEY, self.default_preference)
+        if preference not in MODEL_PREFERENCES:
+            return self.default_preference
+        return preference
+
+    def set_preference(self, session, preference: str) -> Chatbot:
+        """
+        Store a model preference in a session.
+
+        Args:
+            session: The user's session
+            preference: One of MODEL_PREFERENCES
+
+        Returns:
+            The chatbot that will serve the session from now on
+        """
+        if preference not in MODEL_PREFERENCES:
+            raise ValueError(f"Invalid model name: {preference}")
+        session[self.SESSION_KEY] = preference
+        return self.registry.chatbot(preference)
+
+    def chatbot_for(self, session) -> Chatbot:
+        """Get the chatbot serving a session."""
+        return self.registry.chatbot(self.preference(session))
@@ -0,0 +1,304 @@
+"""
+Offline batch replay for the chatbot.
+This module reads conversations as JSONL from a file or stdin, answers them on a pool of worker
+processes and streams the responses back as JSONL, ending with a throughput summary.
+
+Usage: python chatbot.py --batch conversations.jsonl --workers 8 --output responses.jsonl
+"""
+import os
+import json
+import zlib
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from typing import List, Dict, Optional, Any, TextIO, Tuple
+
+from instrumentation import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets for the summary percentiles: 10us to about 10 minutes in 15% steps
+LATENCY_BUCKETS = tuple(1e-5 * 1.15 ** i for i in range(129))
+
+# Items handed to a worker at a time; larger chunks cost less interprocess traffic
+CHUNK_SIZE = 64
+
+# Chunks waiting per worker; reading the input pauses when a worker is this far behind
+QUEUE_CHUNKS = 8
+
+# Exchanges of a conversation kept as context, like the web apps' HISTORY_CONTEXT_LIMIT
+HISTORY_LIMIT = 50
+
+# Conversations a worker keeps context for; the least recently active one is dropped past this
+MAX_CONVERSATIONS = 10000
+
+
+def default_workers() -> int:
+    """Count the CPUs this process may run on, which respects container CPU sets."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def shard(conversation: str, workers: int) -> int:
+    """Get the worker answering a conversation; the same id always maps to the same worker."""
+    return zlib.crc32(conversation.encode('utf-8')) % workers
+
+
+def parse_line(text: str, line: int, message_field: str = 'message',
+               conversation_field: str = 'conversation') -> Tuple[str, str]:
+    """
+    Read one input line.
+
+    Args:
+        text: The JSON line
+        line: Line number, used as the conversation id of items without one
+        message_field: Key of the user's message
+        conversation_field: Key of the conversation id
+
+    Returns:
+        Tuple of the conversation id and the message
+
+    Raises:
+        ValueError: If the line is not a JSON object with a message string
+    """
+    item = json.loads(text)
+    if not isinstance(item, dict) or not isinstance(item.get(message_field), str):
+        raise ValueError(f"Expected a JSON object with a '{message_field}' string")
+    conversation = item.get(conversation_field)
+    return (f"line-{line}" if conversation is None else str(conversation)), item[message_field]
+
+
+def _answer(worker: int, model: str, inbox, outbox, history_limit: int, max_conversations: int):
+    """
+    Answer the chunks sent to one worker process, in order.
+
+    Every conversation is sent to a single worker, so its turns are answered
+    one after the other and each sees the exchanges before it.
+    """
+    from chatbot import Chatbot
+    from context_state import ContextState
+    from exchange import Exchange
+
+    chatbot = Chatbot(model_preference=model)
+    conversations: 'OrderedDict[str, Tuple[deque, ContextState]]' = OrderedDict()
+    latencies = Histogram(LATENCY_BUCKETS)
+    errors = 0
+
+    while True:
+        chunk = inbox.get()
+        if chunk is None:
+            break
+        records = []
+        for line, conversation, message in chunk:
+            state = conversations.pop(conversation, None)
+            if state is None:
+                state = (deque(maxlen=history_limit), ContextState())
+            conversations[conversation] = state
+            if len(conversations) > max_conversations:
+                conversations.popitem(last=False)
+            history, context = state
+
+            record = {'line': line, 'conversation': conversation}
+            started = time.perf_counter()
+            try:
+                response = chatbot.get_response(message, list(history), context)
+                if message.strip():
+                    chatbot.update_context(context, message, response)
+                    history.append(Exchange(message, response))
+                record['response'] = response
+            except Exception as e:
+                errors += 1
+                record['error'] = str(e)
+            latency = time.perf_counter() - started
+            latencies.observe(latency)
+            record['latency_ms'] = round(latency * 1000, 3)
+            record['worker'] = worker
+            records.append(json.dumps(record))
+        outbox.put(('records', records))
+
+    outbox.put(('done', latencies, errors))
+
+
+def _put(target, item, process: multiprocessing.Process, writer: threading.Thread):
+    """Put an item on a worker's queue, failing instead of blocking forever if the worker or writer died."""
+    while True:
+        try:
+            target.put(item, timeout=1)
+            return
+        except queue.Full:
+            if not process.is_alive():
+                raise RuntimeError(f"Batch worker {process.name} exited with code {process.exitcode}")
+            if not writer.is_alive():
+                raise RuntimeError(f"Batch output failed: {writer.failure}")
+
+
+class _Writer(threading.Thread):
+    """Write the workers' records to the output as they arrive and collect their statistics."""
+
+    # Records written between flushes
+    FLUSH_EVERY = 256
+
+    def __init__(self, outbox, sink: TextIO, processes: List[multiprocessing.Process]):
+        super().__init__(name='batch-writer', daemon=True)
+        self.outbox = outbox
+        self.sink = sink
+        self.processes = processes
+        self.latencies = Histogram(LATENCY_BUCKETS)
+        self.items = 0
+        self.errors = 0
+        self.invalid_lines = 0
+        self.failure: Optional[BaseException] = None
+
+    def run(self):
+        try:
+            finished = 0
+            unflushed = 0
+            while finished < len(self.processes):
+                try:
+                    message = self.outbox.get(timeout=1)
+                except queue.Empty:
+                    if any(not process.is_alive() and process.exitcode != 0 for process in self.processes):
+                        raise RuntimeError("A batch worker exited before finishing its items")
+                    self.sink.flush()
+                    unflushed = 0
+                    continue
+
+                if message[0] in ('records', 'invalid'):
+                    records = message[1]
+                    self.sink.write('\n'.join(records) + '\n')
+                    unflushed += len(records)
+                    if message[0] == 'records':
+                        self.items += len(records)
+                    else:
+                        self.invalid_lines += len(records)
+                    if unflushed >= self.FLUSH_EVERY:
+                        self.sink.flush()
+                        unflushed = 0
+                else:
+                    _, latencies, errors = message
+                    self.latencies.merge(latencies)
+                    self.errors += errors
+                    finished += 1
+            self.sink.flush()
+        except BaseException as e:
+            self.failure = e
+
+    def invalid(self, record: Dict[str, Any]):
+        """Queue the record of an input line that could not be read."""
+        self.outbox.put(('invalid', [json.dumps(record)]))
+
+
+def run_batch(source: TextIO, sink: TextIO, workers: Optional[int] = None, model: Optional[str] = None,
+              message_field: str = 'message', conversation_field: str = 'conversation',
+              history_limit: int = HISTORY_LIMIT, max_conversations: int = MAX_CONVERSATIONS) -> Dict[str, Any]:
+    """
+    Answer every message of a JSONL stream and write the responses as JSONL.
+
+    Each input line is an object holding a message and, optionally, a
+    conversation id; lines without one are answered on their own.
+    Conversations are sharded across worker processes by id, so the turns
+    of a conversation are answered in input order with the earlier turns
+    as context. Output records are written as soon as they are ready, so
+    they follow input order within a conversation but not across
+    conversations; each carries its input line number. The input is read
+    as it is consumed and the pending work per worker is bounded, so
+    memory does not grow with the size of the input. A summary record
+    ends the output.
+
+    Args:
+        source: Input stream of JSON lines
+        sink: Output stream for JSON lines
+        workers: Worker processes; defaults to one per CPU
+        model: Model preference of the workers; defaults to the one picked from the API keys
+        message_field: Key of the user's message in the input objects
+        conversation_field: Key of the conversation id in the input objects
+        history_limit: Exchanges of a conversation kept as context
+        max_conversations: Conversations each worker keeps context for
+
+    Returns:
+        The summary: item, error and invalid line counts, wall time, throughput and latency percentiles
+    """
+    from chatbot import default_model_preference
+    from nltk_resources import prewarm
+    from intent_catalog import shared_catalog
+    from knowledge_base import shared_knowledge_base
+
+    workers = max(1, workers or default_workers())
+    model = model or default_model_preference()
+
+    # Load the corpora, intent catalog and knowledge base once, so forked workers share them
+    prewarm()
+    shared_catalog()
+    shared_knowledge_base()
+
+    inboxes = [multiprocessing.Queue(maxsize=QUEUE_CHUNKS) for _ in range(workers)]
+    outbox = multiprocessing.Queue(maxsize=workers * QUEUE_CHUNKS)
+    processes = [
+        multiprocessing.Process(target=_answer, name=f'batch-worker-{i}', daemon=True,
+                                args=(i, model, inboxes[i], outbox, history_limit, max_conversations))
+        for i in range(workers)
+    ]
+    writer = _Writer(outbox, sink, processes)
+
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    writer.start()
+
+    pending: List[List[Tuple[int, str, str]]] = [[] for _ in range(workers)]
+    for line, text in enumerate(source, 1):
+        if not text.strip():
+            continue
+        try:
+            conversation, message = parse_line(text, line, message_field, conversation_field)
+        except ValueError as e:
+            writer.invalid({'line': line, 'error': f"Invalid input: {e}"})
+            continue
+
+        index = shard(conversation, workers)
+        pending[index].append((line, conversation, message))
+        if len(pending[index]) >= CHUNK_SIZE:
+            _put(inboxes[index], pending[index], processes[index], writer)
+            pending[index] = []
+
+    for index, chunk in enumerate(pending):
+        if chunk:
+            _put(inboxes[index], chunk, processes[index], writer)
+        _put(inboxes[index], None, processes[index], writer)
+
+    writer.join()
+    for process in processes:
+        process.join()
+    if writer.failure is not None:
+        raise writer.failure
+
+    wall = time.perf_counter() - started
+    latencies = writer.latencies
+
+    def percentile(q: float) -> Optional[float]:
+        value = latencies.quantile(q)
+        return None if value is None else round(value * 1000, 3)
+
+    summary = {
+        'items': writer.items,
+        'errors': writer.errors,
+        'invalid_lines': writer.invalid_lines,
+        'workers': workers,
+        'model': model,
+        'wall_s': round(wall, 3),
+        'items_per_s': round(writer.items / wall, 1) if wall > 0 else None,
+        'latency_ms': {
+            'mean': round(latencies.sum / latencies.count * 1000, 3) if latencies.count else None,
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'p99': percentile(0.99)
+        }
+    }
+    sink.write(json.dumps({'summary': summary}) + '\n')
+    sink.flush()
+    return summary
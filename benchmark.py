@@ -0,0 +1,1366 @@
+"""
+Offline benchmarks for the chatbot.
+Fake OpenAI and Gemini clients stand in for the upstream APIs, so nothing here needs a network or an API key.
+
+Usage: python benchmark.py concurrency --requests 400 --latency 0.2 --workers 8
+       python benchmark.py semantic --sizes 10000 100000
+       python benchmark.py dispatch --requests 200 --slow-rate 0.03 --error-rate 0.05
+       python benchmark.py transport --requests 200 --workers 8
+       python benchmark.py batch --items 1000 --conversations 50
+       python benchmark.py --output results.json suite
+       python benchmark.py compare baseline.json results.json
+       python benchmark.py serve --workers 4 --requests 2000
+       python benchmark.py overload --rate 100 --duration 10 --capacity 8
+       python benchmark.py kb --documents 100000 --queries 1000
+       python benchmark.py history --turns 10 100 1000
+       python benchmark.py profiling --requests 500
+       python benchmark.py pages --requests 500
+"""
+import os
+import sys
+import json
+import time
+import random
+import itertools
+import asyncio
+import argparse
+import platform
+import statistics
+import threading
+import zlib
+import tempfile
+import subprocess
+import http.client
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Callable, Iterable, Optional, Tuple
+
+import transport
+from ai_models import OpenAIModel, GeminiModel
+from chatbot import Chatbot
+from intent_matcher import IntentMatcher
+from intent_catalog import IntentCatalog
+from backends import BackendRegistry
+from dispatch import Dispatcher, CircuitBreaker
+from rate_limit import AdmissionGate, RateLimiter
+from semantic_cache import SemanticCache
+from assets import RenderCache
+from exchange import Exchange, encode_history, decode_history
+import knowledge_base
+from knowledge_base import KnowledgeBase
+
+
+def _completion(text: str):
+    """Build an object shaped like an OpenAI chat completion."""
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+def _chunk(text: str):
+    """Build an object shaped like an OpenAI streaming chunk."""
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class Faults:
+    """Injects slow calls and errors into a fake client at fixed rates."""
+
+    def __init__(self, slow_rate: float = 0.0, slow_latency: float = 2.0, error_rate: float = 0.0, seed: int = 0):
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    def latency(self, latency: float) -> float:
+        """Get the latency of the next call, raising if it is chosen to fail."""
+        roll = self._random.random()
+        if roll < self.error_rate:
+            raise ConnectionError("injected upstream error")
+        if roll < self.error_rate + self.slow_rate:
+            return self.slow_latency
+        return latency
+
+
+class FakeOpenAIClient:
+    """
+    Blocking stand-in for openai.OpenAI that answers after a fixed latency.
+
+    With a `capacity`, at most that many calls are served at once and the
+    others wait their turn, like an upstream with a concurrency quota.
+    """
+
+    def __init__(self, latency: float = 0.2, reply: str = "This is a fake response.", faults: Faults = None,
+                 capacity: Optional[int] = None):
+        self.latency = latency
+        self.reply = reply
+        self.faults = faults or Faults()
+        self.calls = 0
+        self._capacity = threading.BoundedSemaphore(capacity) if capacity else None
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model: str, messages: List[Dict[str, str]], max_tokens: int = 500, stream: bool = False, **kwargs):
+        self.calls += 1
+        if self._capacity is not None:
+            with self._capacity:
+                time.sleep(self.faults.latency(self.latency))
+        else:
+            time.sleep(self.faults.latency(self.latency))
+        if stream:
+            return iter([_chunk(word + " ") for word in self.reply.split()])
+        return _completion(self.reply)
+
+
+class FakeAsyncOpenAIClient:
+    """Asyncio stand-in for openai.AsyncOpenAI that answers after a fixed latency."""
+
+    def __init__(self, latency: float = 0.2, reply: str = "This is a fake response."):
+        self.latency = latency
+        self.reply = reply
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, model: str, messages: List[Dict[str, str]], max_tokens: int = 500, stream: bool = False, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if stream:
+            return self._stream()
+        return _completion(self.reply)
+
+    async def _stream(self):
+        for word in self.reply.split():
+            yield _chunk(word + " ")
+
+
+class FakeGeminiChat:
+    """Stand-in for a Gemini ChatSession that counts the messages sent upstream."""
+
+    def __init__(self, model, history):
+        self.model = model
+        self.history = list(history)
+
+    def send_message(self, content, stream: bool = False):
+        self.model.calls += 1
+        time.sleep(self.model.faults.latency(self.model.latency))
+        if stream:
+            return iter([SimpleNamespace(text=word + " ") for word in self.model.reply.split()])
+        return SimpleNamespace(text=self.model.reply)
+
+    async def send_message_async(self, content, stream: bool = False):
+        self.model.calls += 1
+        await asyncio.sleep(self.model.latency)
+        if stream:
+            return self._stream()
+        return SimpleNamespace(text=self.model.reply)
+
+    async def _stream(self):
+        for word in self.model.reply.split():
+            yield SimpleNamespace(text=word + " ")
+
+
+class FakeGeminiModel:
+    """Stand-in for google.generativeai.GenerativeModel that answers after a fixed latency."""
+
+    def __init__(self, latency: float = 0.2, reply: str = "This is a fake Gemini response.", faults: Faults = None):
+        self.latency = latency
+        self.reply = reply
+        self.faults = faults or Faults()
+        self.calls = 0
+
+    def start_chat(self, history=None):
+        return FakeGeminiChat(self, history or [])
+
+
+def fake_chatbot(latency: float = 0.2) -> Chatbot:
+    """Create a chatbot whose OpenAI backend is served by the fake clients."""
+    model = OpenAIModel(client=FakeOpenAIClient(latency), async_client=FakeAsyncOpenAIClient(latency))
+    return Chatbot(model_preference="openai", openai_model=model)
+
+
+def bench_concurrency(requests: int, latency: float, workers: int) -> Dict[str, Any]:
+    """
+    Compare a thread pool sized like a WSGI server against one asyncio event loop.
+
+    Args:
+        requests: Number of chat requests to send
+        latency: Simulated upstream latency per request, in seconds
+        workers: Threads in the pool, standing in for WSGI worker threads
+
+    Returns:
+        Throughput and wall time for both request paths
+    """
+    chatbot = fake_chatbot(latency)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda i: chatbot.get_response(f"message {i}"), range(requests)))
+    threaded = time.perf_counter() - start
+
+    async def run_async():
+        await asyncio.gather(*(chatbot.get_response_async(f"message {i}") for i in range(requests)))
+
+    start = time.perf_counter()
+    asyncio.run(run_async())
+    evented = time.perf_counter() - start
+
+    return {
+        'requests': requests,
+        'latency_s': latency,
+        'threaded': {'workers': workers, 'wall_s': threaded, 'req_per_s': requests / threaded},
+        'async': {'wall_s': evented, 'req_per_s': requests / evented},
+        'speedup': threaded / evented
+    }
+
+
+def _percentile(timings: List[float], percentile: float) -> float:
+    """Get a percentile of sorted timings."""
+    return timings[min(len(timings) - 1, int(len(timings) * percentile / 100))]
+
+
+def bench_dispatch(requests: int, latency: float, slow_rate: float, slow_latency: float,
+                   error_rate: float, deadline: float) -> Dict[str, Any]:
+    """
+    Compare response latency with a faulty OpenAI backend and a healthy Gemini backend.
+
+    Args:
+        requests: Number of sequential chat requests per configuration
+        latency: Normal upstream latency, in seconds
+        slow_rate: Share of OpenAI calls that take `slow_latency`
+        slow_latency: Latency of a slow call, in seconds
+        error_rate: Share of OpenAI calls that fail
+        deadline: Per-backend deadline, in seconds
+
+    Returns:
+        Latency percentiles and the backends that answered, per dispatch configuration
+    """
+    configurations = {
+        'no_deadline': dict(default_deadline=3600.0, breaker_factory=lambda name: _NeverOpen(name)),
+        'deadline_breaker': dict(default_deadline=deadline),
+        'deadline_breaker_hedge': dict(default_deadline=deadline, hedge=True)
+    }
+    results = {}
+    for name, options in configurations.items():
+        openai_client = FakeOpenAIClient(latency, faults=Faults(slow_rate, slow_latency, error_rate))
+        gemini = GeminiModel(model=FakeGeminiModel(latency))
+        chatbot = Chatbot(model_preference="auto", openai_model=OpenAIModel(client=openai_client),
+                          gemini_model=gemini, dispatcher=Dispatcher(**options))
+
+        timings = []
+        for i in range(requests):
+            start = time.perf_counter()
+            chatbot.get_response(f"message {i}")
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+
+        results[name] = {
+            'p50_ms': _percentile(timings, 50) * 1000,
+            'p99_ms': _percentile(timings, 99) * 1000,
+            'max_ms': timings[-1] * 1000,
+            'openai_calls': openai_client.calls,
+            'gemini_calls': gemini.model.calls,
+            'dispatch': chatbot.dispatcher.stats()
+        }
+    return {
+        'requests': requests,
+        'latency_s': latency,
+        'slow_rate': slow_rate,
+        'slow_latency_s': slow_latency,
+        'error_rate': error_rate,
+        'configurations': results
+    }
+
+
+class _NeverOpen(CircuitBreaker):
+    """Breaker that records outcomes but never opens, standing in for no breaker at all."""
+
+    def _trip(self):
+        pass
+
+
+class StubOpenAIServer(ThreadingHTTPServer):
+    """Local HTTP/1.1 server answering chat completions like the OpenAI API, counting TCP connections."""
+
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.connections = 0
+        self._lock = threading.Lock()
+        super().__init__(('127.0.0.1', 0), _StubOpenAIHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+
+class _StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.count_connection()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.latency)
+        body = json.dumps({
+            'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': 'stub',
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': 'This is a stub response.'}}]
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_transport(requests: int, workers: int, latency: float) -> Dict[str, Any]:
+    """
+    Compare a new HTTP client per request with the shared connection pool, against a local stub server.
+
+    Args:
+        requests: Number of chat requests per mode
+        workers: Concurrent request threads
+        latency: Server-side latency per request, in seconds
+
+    Returns:
+        Wall time, throughput and TCP connections accepted by the server, per mode
+    """
+    import httpx
+    from openai import OpenAI
+
+    results = {}
+    for mode in ('client_per_request', 'shared_pool'):
+        server = StubOpenAIServer(latency)
+        shared = OpenAIModel(client=OpenAI(api_key='stub', base_url=server.base_url,
+                                           http_client=transport.shared_client(), max_retries=0))
+
+        def send(i):
+            if mode == 'shared_pool':
+                return shared.get_response(f"message {i}")
+            with httpx.Client() as http_client:
+                model = OpenAIModel(client=OpenAI(api_key='stub', base_url=server.base_url,
+                                                  http_client=http_client, max_retries=0))
+                return model.get_response(f"message {i}")
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            responses = list(pool.map(send, range(requests)))
+        wall = time.perf_counter() - start
+        server.shutdown()
+        server.server_close()
+
+        results[mode] = {
+            'wall_s': wall,
+            'req_per_s': requests / wall,
+            'server_connections': server.connections,
+            'errors': sum(1 for response in responses if response != 'This is a stub response.')
+        }
+    results['shared_pool']['pool'] = transport.stats()
+    return {'requests': requests, 'workers': workers, 'latency_s': latency, 'modes': results}
+
+
+REPLAY_MESSAGES = ["hello", "how are you?", "tell me a joke", "why?", "what can you do",
+                   "what's the weather like", "thanks!", "who are you", "what time is it", "bye"]
+
+
+def bench_batch(items: int, conversations: int, latency: float, workers: int) -> Dict[str, Any]:
+    """
+    Compare replaying messages one /chat request at a time with /chat/batch and get_responses.
+
+    Args:
+        items: Number of messages replayed
+        conversations: Number of conversations the messages are spread over
+        latency: Simulated upstream latency of the API backend, in seconds
+        workers: Thread pool size for the API-backed batch
+
+    Returns:
+        Wall time and throughput of each replay path
+    """
+    os.environ.setdefault("CONVERSATION_STORE", "memory")
+    os.environ.setdefault("RATE_LIMIT", "0")
+    from app import app
+
+    batch = [(f"conversation-{i % conversations}", REPLAY_MESSAGES[i % len(REPLAY_MESSAGES)]) for i in range(items)]
+    results = {'items': items, 'conversations': conversations}
+
+    client = app.test_client()
+    client.post('/model', json={'model': 'nltk'})
+    start = time.perf_counter()
+    for _, message in batch:
+        client.post('/chat', json={'message': message})
+    single = time.perf_counter() - start
+    results['nltk_chat_requests'] = {'wall_s': single, 'items_per_s': items / single}
+
+    start = time.perf_counter()
+    response = client.post('/chat/batch', json={
+        'items': [{'conversation': conversation, 'message': message} for conversation, message in batch]
+    })
+    batched = time.perf_counter() - start
+    assert response.status_code == 200, response.get_json()
+    results['nltk_chat_batch'] = {'wall_s': batched, 'items_per_s': items / batched, 'speedup': single / batched}
+
+    # API-backed items: sequential calls against one get_responses call on a thread pool
+    chatbot = fake_chatbot(latency)
+    sample = batch[:max(conversations, min(items, 200))]
+    start = time.perf_counter()
+    for _, message in sample:
+        chatbot.get_response(message)
+    sequential = time.perf_counter() - start
+    start = time.perf_counter()
+    chatbot.get_responses(sample, max_workers=workers)
+    pooled = time.perf_counter() - start
+    results['api_batch'] = {
+        'items': len(sample),
+        'latency_s': latency,
+        'sequential_s': sequential,
+        'get_responses_s': pooled,
+        'speedup': sequential / pooled
+    }
+    return results
+
+
+def _random_prompt(rng: random.Random, vocabulary: List[str]) -> str:
+    """Build a random prompt of 3 to 12 words."""
+    return ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(3, 12)))
+
+
+def bench_semantic(sizes: List[int], lookups: int) -> Dict[str, Any]:
+    """
+    Measure semantic cache lookup latency as the index grows.
+
+    Args:
+        sizes: Numbers of cached entries to measure at
+        lookups: Lookups timed at each size
+
+    Returns:
+        Build time and lookup latency percentiles per size
+    """
+    rng = random.Random(0)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    results = []
+    for size in sizes:
+        cache = SemanticCache(capacity=size)
+        start = time.perf_counter()
+        for i in range(size):
+            cache.add(_random_prompt(rng, vocabulary), None, "auto", f"response {i}", "openai")
+        build = time.perf_counter() - start
+
+        namespace = cache.namespace(None, "auto")
+        queries = [_random_prompt(rng, vocabulary) for _ in range(lookups)]
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            cache.search(query, namespace)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+
+        results.append({
+            'entries': size,
+            'build_s': build,
+            'lookup_p50_ms': _percentile(timings, 50) * 1000,
+            'lookup_p99_ms': _percentile(timings, 99) * 1000,
+            'index_mb': cache._vectors.nbytes / 2 ** 20
+        })
+    return {'lookups': lookups, 'sizes': results}
+
+
+def _synthetic_corpus(rng: random.Random, documents: int, vocabulary: List[str]) -> List[Tuple[str, str, str]]:
+    """Build FAQ-like documents of 20 to 80 words, with a Zipf-like word distribution."""
+    cumulative = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    corpus = []
+    for i in range(documents):
+        words = rng.choices(vocabulary, cum_weights=cumulative, k=rng.randint(20, 80))
+        corpus.append((f"doc-{i}", ' '.join(words[:6]), ' '.join(words[6:])))
+    return corpus
+
+
+def bench_knowledge_base(documents: int, queries: int) -> Dict[str, Any]:
+    """
+    Measure building, updating, persisting and querying the knowledge base index.
+
+    Args:
+        documents: Number of synthetic documents indexed
+        queries: Queries timed per scoring path; each takes a few words from a random document
+
+    Returns:
+        Build, incremental update, save and load times, index size and query latency percentiles
+    """
+    rng = random.Random(0)
+    vocabulary = [f"word{i}" for i in range(20000)]
+    corpus = _synthetic_corpus(rng, documents, vocabulary)
+    preprocess = str.lower
+    results = {'documents': documents, 'numpy': knowledge_base.numpy_available}
+
+    kb = KnowledgeBase(preprocess)
+    start = time.perf_counter()
+    kb.update(corpus)
+    results['build_s'] = time.perf_counter() - start
+
+    # Edit 1% of the documents and re-apply the whole corpus, as a rebuild after a content change would
+    edited = list(corpus)
+    for index in rng.sample(range(documents), max(1, documents // 100)):
+        doc_id, title, text = edited[index]
+        edited[index] = (doc_id, title, f"{text} {rng.choice(vocabulary)}")
+    start = time.perf_counter()
+    counts = kb.update(edited)
+    results['update_1pct'] = {'s': time.perf_counter() - start, **counts}
+
+    path = os.path.join(tempfile.mkdtemp(), 'benchmark.index')
+    try:
+        start = time.perf_counter()
+        kb.save(path)
+        results['save_s'] = time.perf_counter() - start
+        results['index_mb'] = os.path.getsize(path) / 2 ** 20
+        start = time.perf_counter()
+        kb = KnowledgeBase.load(path, preprocess)
+        results['load_s'] = time.perf_counter() - start
+    finally:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+    samples = []
+    for _ in range(queries):
+        _, title, text = rng.choice(edited)
+        words = f"{title} {text}".split()
+        samples.append(' '.join(rng.sample(words, min(len(words), rng.randint(3, 8)))))
+
+    paths = [True, False] if knowledge_base.numpy_available else [False]
+    try:
+        for vectorized in paths:
+            knowledge_base.numpy_available = vectorized
+            kb._norms_key = None
+            kb.search(samples[0])
+            timings = []
+            for query in samples:
+                start = time.perf_counter()
+                kb.search(query)
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            results['query_numpy' if vectorized else 'query_python'] = {
+                'p50_ms': _percentile(timings, 50) * 1000,
+                'p99_ms': _percentile(timings, 99) * 1000
+            }
+    finally:
+        knowledge_base.numpy_available = results['numpy']
+    return results
+
+
+def _history_size(history: List[Any]) -> int:
+    """Count the bytes of a history list, its exchanges and their message strings."""
+    return sys.getsizeof(history) + sum(
+        sys.getsizeof(exchange) + sys.getsizeof(exchange['user']) + sys.getsizeof(exchange['bot'])
+        for exchange in history
+    )
+
+
+def bench_history(turns: Iterable[int]) -> Dict[str, Any]:
+    """
+    Compare history as dictionaries and JSON with Exchange records and the encoded form.
+
+    Two kinds of conversation are measured: replayed messages answered by the
+    rule-based backend (short canned replies), and replies of 40 to 120 random
+    words, which compress worse than real model output.
+
+    Args:
+        turns: Conversation lengths to measure at
+
+    Returns:
+        Per kind and length: in-memory bytes, JSON, compressed JSON and encoded bytes, and encode/decode time
+    """
+    rng = random.Random(0)
+    chatbot = _nltk_chatbot()
+    vocabulary = [f"word{i}" for i in range(5000)]
+    longest = max(turns)
+    messages = [REPLAY_MESSAGES[i % len(REPLAY_MESSAGES)] for i in range(longest)]
+    replies = {
+        'rule_based': [chatbot.get_nltk_response(message) for message in messages],
+        'long_replies': [' '.join(rng.choice(vocabulary) for _ in range(rng.randint(40, 120)))
+                         for _ in range(longest)]
+    }
+
+    results = {}
+    for kind, bot in replies.items():
+        rows = []
+        for count in turns:
+            # Copies of the strings, as rows read from the conversation store would be
+            pairs = [(''.join(list(messages[i])), ''.join(list(bot[i]))) for i in range(count)]
+            dicts = [{'user': user, 'bot': reply} for user, reply in pairs]
+            exchanges = [Exchange(user, reply) for user, reply in pairs]
+            as_json = json.dumps({'history': dicts}).encode('utf-8')
+            encoded = encode_history(exchanges)
+            timings = _measure(encode_history, [exchanges])
+            decode = _measure(decode_history, [encoded])
+            rows.append({
+                'turns': count,
+                'dict_bytes': _history_size(dicts),
+                'exchange_bytes': _history_size(exchanges),
+                'json_bytes': len(as_json),
+                'json_zlib_bytes': len(zlib.compress(as_json, 6)),
+                'encoded_bytes': len(encoded),
+                'encode_us': timings['per_call_us_median'],
+                'decode_us': decode['per_call_us_median']
+            })
+        results[kind] = rows
+    return results
+
+
+def _measure(func: Callable, inputs: List[Any], repeat: int = 5) -> Dict[str, float]:
+    """
+    Time a function over a list of inputs.
+
+    Args:
+        func: Function called with each input
+        inputs: Inputs, all passed once per repeat
+        repeat: Number of passes
+
+    Returns:
+        Median and minimum microseconds per call across passes, after one untimed warm-up pass
+    """
+    for value in inputs:
+        func(value)
+    per_call = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for value in inputs:
+            func(value)
+        per_call.append((time.perf_counter() - start) / len(inputs) * 1e6)
+    return {'per_call_us_median': statistics.median(per_call), 'per_call_us_min': min(per_call)}
+
+
+def _latency_summary(timings: List[float], wall: float) -> Dict[str, float]:
+    """Summarize request latencies in milliseconds and the throughput they add up to."""
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'req_per_s': len(timings) / wall,
+        'p50_ms': _percentile(timings, 50) * 1000,
+        'p99_ms': _percentile(timings, 99) * 1000,
+        'max_ms': timings[-1] * 1000
+    }
+
+
+def _nltk_chatbot() -> Chatbot:
+    """Create a chatbot answering from the rule-based backend only."""
+    return Chatbot(model_preference="nltk")
+
+
+def bench_preprocess(repeat: int) -> Dict[str, Any]:
+    """Time _preprocess_text on short and long messages, with a cold and a warm lemma cache."""
+    chatbot = _nltk_chatbot()
+    short = [message for message in REPLAY_MESSAGES]
+    long = [" ".join(REPLAY_MESSAGES[i:] + REPLAY_MESSAGES[:i]) * 3 for i in range(len(REPLAY_MESSAGES))]
+
+    chatbot.preprocessor.clear_cache()
+    start = time.perf_counter()
+    for message in short + long:
+        chatbot._preprocess_text(message)
+    cold = (time.perf_counter() - start) / len(short + long) * 1e6
+
+    return {
+        'cold_per_call_us': cold,
+        'short': _measure(chatbot._preprocess_text, short, repeat),
+        'long': _measure(chatbot._preprocess_text, long, repeat),
+        'lemma_cache': chatbot.preprocessor.cache_info()
+    }
+
+
+def synthetic_intents(count: int) -> Dict[str, List[str]]:
+    """Build `count` distinct intent patterns shaped like the built-in ones."""
+    return {
+        rf'topic{i}|subject {i}|tell.*about thing{i}': [f"Response for topic {i}."]
+        for i in range(count)
+    }
+
+
+def bench_intents(counts: Iterable[int], repeat: int) -> List[Dict[str, Any]]:
+    """Time get_nltk_response as synthetic intents are added in front of the built-in ones."""
+    random.seed(0)
+    chatbot = _nltk_chatbot()
+    builtin = dict(chatbot.patterns_responses)
+    results = []
+    for count in counts:
+        patterns = synthetic_intents(count)
+        patterns.update(builtin)
+        chatbot.intent_catalog = IntentCatalog(IntentMatcher(patterns), chatbot.default_responses)
+        inputs = REPLAY_MESSAGES + [f"tell me about thing{count - 1}", "something unrelated entirely"]
+        results.append(dict(_measure(chatbot.get_nltk_response, inputs, repeat), intents=len(patterns)))
+    return results
+
+
+def bench_check_context(lengths: Iterable[int], repeat: int) -> List[Dict[str, Any]]:
+    """Time _check_context on follow-up questions as the conversation history grows."""
+    chatbot = _nltk_chatbot()
+    results = []
+    for length in lengths:
+        history = [{'user': REPLAY_MESSAGES[i % len(REPLAY_MESSAGES)], 'bot': "A response."} for i in range(length)]
+        inputs = ["why?", "tell me more", "ok", "what about tomorrow"]
+        results.append(dict(_measure(lambda text: chatbot._check_context(text, history), inputs, repeat),
+                            history=length))
+    return results
+
+
+def _fake_registry(latency: float) -> BackendRegistry:
+    """Build a backend registry whose API models are served by the fake clients."""
+    return BackendRegistry(factories={
+        'openai': lambda: OpenAIModel(client=FakeOpenAIClient(latency), async_client=FakeAsyncOpenAIClient(latency)),
+        'gemini': lambda: GeminiModel(model=FakeGeminiModel(latency))
+    })
+
+
+def _chat_app(latency: float):
+    """Import the Flask app with an in-memory store, no rate limit and fake API backends."""
+    os.environ.setdefault("CONVERSATION_STORE", "memory")
+    os.environ.setdefault("RATE_LIMIT", "0")
+    import app as web
+
+    registry = _fake_registry(latency)
+    web.service.registry = registry
+    web.service.router.registry = registry
+    return web.app
+
+
+def bench_chat_test_client(models: Iterable[str], requests: int, latency: float) -> Dict[str, Any]:
+    """Measure /chat latency through the Flask test client, which skips the network and the WSGI server."""
+    random.seed(0)
+    app = _chat_app(latency)
+    results = {}
+    for model in models:
+        client = app.test_client()
+        client.post('/model', json={'model': model})
+        timings = []
+        wall_start = time.perf_counter()
+        for i in range(requests):
+            start = time.perf_counter()
+            response = client.post('/chat', json={'message': REPLAY_MESSAGES[i % len(REPLAY_MESSAGES)]})
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.get_json()
+        results[model] = _latency_summary(timings, time.perf_counter() - wall_start)
+    return results
+
+
+def bench_profiling(requests: int) -> Dict[str, Any]:
+    """
+    Measure /chat latency with request profiling enabled, unprofiled and profiled.
+
+    With PROFILE_TOKEN unset no profiling hooks are registered at all, so
+    the unprofiled run shows the whole cost of enabling it.
+
+    Args:
+        requests: /chat requests per run, answered by the rule-based backend
+
+    Returns:
+        Latency summaries of requests without and with the profiling header, and the capture sizes
+    """
+    os.environ.setdefault("PROFILE_TOKEN", "benchmark")
+    app = _chat_app(0.0)
+    import app as web
+    if web.service.profiler is None:
+        raise RuntimeError("Profiling is disabled; the app was imported before PROFILE_TOKEN was set")
+
+    client = app.test_client()
+    client.post('/model', json={'model': 'nltk'})
+    results = {}
+    for run, headers in (('unprofiled', {}), ('profiled', {'X-Profile-Token': web.service.profiler.token})):
+        timings = []
+        wall_start = time.perf_counter()
+        for i in range(requests):
+            start = time.perf_counter()
+            response = client.post('/chat', json={'message': REPLAY_MESSAGES[i % len(REPLAY_MESSAGES)]},
+                                   headers=headers)
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.get_json()
+        results[run] = _latency_summary(timings, time.perf_counter() - wall_start)
+
+    capture = web.service.profiler.captures()[0]
+    results['capture'] = {
+        'functions': len(capture.stats),
+        'pstats_bytes': len(capture.pstats_bytes()),
+        'collapsed_bytes': len(capture.collapsed())
+    }
+    return results
+
+
+def bench_pages(requests: int) -> Dict[str, Any]:
+    """
+    Measure page views: rendering with and without the page cache, and the bytes of the page's static files.
+
+    Args:
+        requests: Requests timed per page and mode
+
+    Returns:
+        Latency per page with and without the page cache, and the static bytes of a first and a repeat view
+    """
+    app = _chat_app(0.0)
+    import app as web
+
+    results = {}
+    shared_pages = web.service.pages
+    for page, fresh in (('about', False), ('home_new_visitor', True)):
+        path = '/about' if page == 'about' else '/'
+        for mode, pages in (('rendered', RenderCache(max_entries=0)), ('cached', shared_pages)):
+            # A cache that keeps nothing renders every request, as before the page cache
+            web.service.pages = pages
+            client = app.test_client()
+            timings = []
+            wall_start = time.perf_counter()
+            for _ in range(requests):
+                if fresh:
+                    client = app.test_client()
+                start = time.perf_counter()
+                response = client.get(path)
+                timings.append(time.perf_counter() - start)
+                assert response.status_code == 200
+            results[f"{page}_{mode}"] = _latency_summary(timings, time.perf_counter() - wall_start)
+    web.service.pages = shared_pages
+
+    client = app.test_client()
+    html = client.get('/').get_data(as_text=True)
+    names = ['css/style.css', 'js/chat.js']
+    plain = sum(len(client.get(f'/static/{name}').data) for name in names)
+    variants = {}
+    for accept in ('gzip', 'gzip, br'):
+        variants[accept] = sum(len(client.get(f"/assets/{web.service.assets.fingerprinted(name)}",
+                                              headers={'Accept-Encoding': accept}).data) for name in names)
+    results['static_files'] = {
+        'files': names,
+        'plain_bytes': plain,
+        'gzip_bytes': variants['gzip'],
+        'br_bytes': variants['gzip, br'],
+        'fingerprinted_in_page': all(f"/assets/{web.service.assets.fingerprinted(name)}" in html for name in names),
+        'cache_control': client.get(f"/assets/{web.service.assets.fingerprinted(names[0])}").headers['Cache-Control']
+    }
+    return results
+
+
+def _chat_client(port: int, model: str, count: int) -> List[float]:
+    """
+    Post messages to /chat over one keep-alive connection, keeping the session cookie.
+
+    Args:
+        port: Port of the server on localhost
+        model: Model preference to select first
+        count: Number of messages
+
+    Returns:
+        Latency of each /chat request in seconds
+    """
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    headers = {'Content-Type': 'application/json'}
+
+    def post(path: str, body: Dict[str, str]):
+        connection.request('POST', path, json.dumps(body), headers)
+        response = connection.getresponse()
+        response.read()
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            headers['Cookie'] = cookie.split(';', 1)[0]
+        return response.status
+
+    post('/model', {'model': model})
+    timings = []
+    for i in range(count):
+        start = time.perf_counter()
+        status = post('/chat', {'message': REPLAY_MESSAGES[i % len(REPLAY_MESSAGES)]})
+        timings.append(time.perf_counter() - start)
+        assert status == 200, status
+    connection.close()
+    return timings
+
+
+def bench_chat_server(models: Iterable[str], requests: int, latency: float, workers: int) -> Dict[str, Any]:
+    """Measure /chat latency and throughput through a threaded werkzeug server over keep-alive connections."""
+    from werkzeug.serving import make_server
+
+    random.seed(0)
+    app = _chat_app(latency)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    port = server.server_port
+
+    results = {}
+    try:
+        for model in models:
+            per_worker = max(1, requests // workers)
+            wall_start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                timings = [t for chunk in pool.map(lambda _: _chat_client(port, model, per_worker), range(workers))
+                           for t in chunk]
+            results[model] = dict(_latency_summary(timings, time.perf_counter() - wall_start), workers=workers)
+    finally:
+        server.shutdown()
+    return results
+
+
+def _process_memory(pid: int) -> Dict[str, float]:
+    """
+    Read a process's memory from /proc (Linux only).
+
+    Returns:
+        RSS, PSS and private bytes in MB; PSS splits each shared page between the processes sharing it
+    """
+    fields = {'Rss': 'rss_mb', 'Pss': 'pss_mb', 'Private_Clean': 'private_mb', 'Private_Dirty': 'private_mb'}
+    memory = {'rss_mb': 0.0, 'pss_mb': 0.0, 'private_mb': 0.0}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in fields:
+                memory[fields[key]] += int(value.split()[0]) / 1024
+    return memory
+
+
+def _child_pids(pid: int) -> List[int]:
+    """List the child processes of a process (Linux only)."""
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def _memory_summary(master: int, workers: List[int]) -> Dict[str, Any]:
+    """Summarize the memory of the gunicorn master and its workers."""
+    per_worker = [_process_memory(pid) for pid in workers]
+    return {
+        'master': _process_memory(master),
+        'worker_rss_mb': statistics.mean(m['rss_mb'] for m in per_worker),
+        'worker_pss_mb': statistics.mean(m['pss_mb'] for m in per_worker),
+        'worker_private_mb': statistics.mean(m['private_mb'] for m in per_worker),
+        'total_pss_mb': sum(m['pss_mb'] for m in per_worker) + _process_memory(master)['pss_mb']
+    }
+
+
+def bench_serve(workers: int, threads: int, requests: int, clients: int, preload: bool) -> Dict[str, Any]:
+    """
+    Start the production gunicorn profile and measure per-worker memory and /chat throughput.
+
+    The server answers from the rule-based backend only (API keys are removed
+    from its environment), so the run is offline and measures the app itself.
+
+    Args:
+        workers: gunicorn worker processes
+        threads: Threads per worker
+        requests: Total /chat requests
+        clients: Concurrent keep-alive clients
+        preload: Load the app in the master before forking
+
+    Returns:
+        Startup time, memory after startup and after the load, and latency/throughput
+    """
+    import socket
+    import tempfile
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    store = tempfile.NamedTemporaryFile(suffix='.db', delete=False).name
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads),
+               GUNICORN_PRELOAD='1' if preload else '0', CONVERSATION_STORE=store, LOG_LEVEL='WARNING',
+               RATE_LIMIT='0')
+    for key in ('OPENAI_API_KEY', 'GEMINI_API_KEY'):
+        env.pop(key, None)
+
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(root, 'gunicorn.conf.py')],
+                              cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # Ready once every worker answers; each new connection may land on a different worker
+        deadline = time.monotonic() + 120
+        while True:
+            if server.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError("gunicorn did not start")
+            pids = _child_pids(server.pid)
+            if len(pids) == workers:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                try:
+                    connection.request('GET', '/about')
+                    if connection.getresponse().status == 200:
+                        break
+                except OSError:
+                    pass
+                finally:
+                    connection.close()
+            time.sleep(0.05)
+        startup = time.perf_counter() - started
+        # Workers that import the app themselves finish after the first one answers
+        time.sleep(1.0 if not preload else 0.2)
+        idle = _memory_summary(server.pid, _child_pids(server.pid))
+
+        per_client = max(1, requests // clients)
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            timings = [t for chunk in pool.map(lambda _: _chat_client(port, 'nltk', per_client), range(clients))
+                       for t in chunk]
+        latency = _latency_summary(timings, time.perf_counter() - wall_start)
+        loaded = _memory_summary(server.pid, _child_pids(server.pid))
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=40)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(store + suffix):
+                os.remove(store + suffix)
+
+    return {
+        'preload': preload,
+        'workers': workers,
+        'threads': threads,
+        'clients': clients,
+        'startup_s': startup,
+        'memory_idle': idle,
+        'memory_after_load': loaded,
+        'chat': latency
+    }
+
+
+def _open_loop(port: int, rate: float, duration: float, message: Callable[[int], str],
+               model: str = 'openai', max_clients: int = 256) -> List[Tuple[int, float, str]]:
+    """
+    Post /chat requests at a fixed rate, whether or not earlier ones were answered.
+
+    Each client thread keeps a keep-alive connection and session of its own.
+    Latency is measured from the time a request was due, so requests held
+    up by a saturated client pool count the wait too.
+
+    Args:
+        port: Port of the server on localhost
+        rate: Requests per second
+        duration: Seconds to send for
+        message: Request number -> message to send
+        model: Model preference of the sessions
+        max_clients: Maximum requests in flight
+
+    Returns:
+        (status, latency in seconds, response text) of each request
+    """
+    local = threading.local()
+
+    def post(path: str, body: Dict[str, str]):
+        connection = getattr(local, 'connection', None)
+        if connection is None:
+            connection = local.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+            local.headers = {'Content-Type': 'application/json'}
+            post('/model', {'model': model})
+        connection.request('POST', path, json.dumps(body), local.headers)
+        response = connection.getresponse()
+        data = response.read()
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            local.headers['Cookie'] = cookie.split(';', 1)[0]
+        return response.status, data
+
+    def send(i: int, due: float):
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        status, data = post('/chat', {'message': message(i)})
+        text = json.loads(data).get('response', '') if status == 200 else ''
+        return status, time.perf_counter() - due, text
+
+    count = int(rate * duration)
+    start = time.perf_counter() + 0.1
+    with ThreadPoolExecutor(max_workers=max_clients) as pool:
+        futures = [pool.submit(send, i, start + i / rate) for i in range(count)]
+        return [future.result() for future in futures]
+
+
+def _outcome_summary(outcomes: List[Tuple[int, float, str]], reply: str) -> Dict[str, Any]:
+    """Count the outcomes of an overload run and summarize the latency of each kind."""
+    served = [latency for status, latency, text in outcomes if status == 200 and text == reply]
+    fallback = [latency for status, latency, text in outcomes if status == 200 and text != reply]
+    shed = [latency for status, latency, _ in outcomes if status in (429, 503)]
+
+    def percentiles(timings: List[float]) -> Dict[str, float]:
+        if not timings:
+            return {}
+        timings = sorted(timings)
+        return {
+            'p50_ms': timings[len(timings) // 2] * 1000,
+            'p99_ms': timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000,
+            'max_ms': timings[-1] * 1000
+        }
+
+    return {
+        'requests': len(outcomes),
+        'upstream_answers': dict(count=len(served), **percentiles(served)),
+        'fallback_answers': dict(count=len(fallback), **percentiles(fallback)),
+        'rejected': dict(count=len(shed), **percentiles(shed)),
+        'other_errors': sum(1 for status, _, _ in outcomes if status not in (200, 429, 503))
+    }
+
+
+def bench_overload(rate: float, duration: float, latency: float, capacity: int, deadline: float,
+                   flood: int) -> Dict[str, Any]:
+    """
+    Offer /chat more requests than the upstream can serve, with and without admission gates.
+
+    The fake OpenAI upstream serves `capacity` calls at once, each taking
+    `latency`, so it saturates at capacity / latency requests per second.
+    Without gates the excess waits upstream until the deadline and then
+    falls back, while its abandoned calls keep the upstream busy. With a
+    gate sized to the upstream, the excess is refused at once with a 503.
+    A last run floods one client past its rate limit.
+
+    Args:
+        rate: Offered requests per second
+        duration: Seconds of load per run
+        latency: Upstream latency per call in seconds
+        capacity: Calls the upstream serves at once
+        deadline: Seconds allowed for an upstream answer before falling back
+        flood: Requests sent back to back by the flooding client
+
+    Returns:
+        Outcome counts and latency percentiles of each run
+    """
+    from werkzeug.serving import make_server
+
+    os.environ.setdefault("CONVERSATION_STORE", "memory")
+    os.environ.setdefault("RATE_LIMIT", "0")
+    import app as web
+
+    reply = "This is a fake response."
+    server = make_server('127.0.0.1', 0, web.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    results = {
+        'offered_per_s': rate,
+        'upstream_capacity_per_s': capacity / latency,
+        'deadline_s': deadline
+    }
+    runs = {
+        'no_admission': {},
+        'admission': {'openai': AdmissionGate('openai', capacity, max_queue=capacity, queue_timeout=latency)}
+    }
+    try:
+        for name, gates in runs.items():
+            client = FakeOpenAIClient(latency, reply=reply, capacity=capacity)
+            registry = BackendRegistry(
+                factories={'openai': lambda: OpenAIModel(client=client, async_client=FakeAsyncOpenAIClient(latency))},
+                dispatcher=Dispatcher(deadlines={'openai': deadline}, max_workers=256, gates=gates)
+            )
+            web.service.registry = registry
+            web.service.router.registry = registry
+            # Unique messages, so the response cache does not absorb the load
+            outcomes = _open_loop(server.server_port, rate, duration, lambda i, run=name: f"{run} question {i}")
+            results[name] = dict(_outcome_summary(outcomes, reply), upstream_calls=client.calls)
+            # Let abandoned upstream calls drain before the next run
+            time.sleep(deadline + latency)
+
+        web.service.rate_limiter = RateLimiter(rate=1.0, burst=10)
+        outcomes = _open_loop(server.server_port, 1000, flood / 1000, lambda i: REPLAY_MESSAGES[i % 10],
+                              model='nltk', max_clients=1)
+        results['flood'] = {
+            'requests': flood,
+            'rate_limit': {'rate_per_s': 1.0, 'burst': 10},
+            'allowed': sum(1 for status, _, _ in outcomes if status == 200),
+            'limited': sum(1 for status, _, _ in outcomes if status == 429)
+        }
+    finally:
+        web.service.rate_limiter = None
+        server.shutdown()
+    return results
+
+
+def bench_suite(quick: bool = False) -> Dict[str, Any]:
+    """
+    Run the standard scenarios with fixed sizes, so results can be compared between commits.
+
+    Args:
+        quick: Use smaller sizes for a fast smoke run
+
+    Returns:
+        Results per scenario
+    """
+    repeat = 3 if quick else 7
+    requests = 100 if quick else 500
+    return {
+        'preprocess': bench_preprocess(repeat),
+        'nltk_response_by_intents': bench_intents([10, 100, 1000] if quick else [10, 100, 1000, 5000], repeat),
+        'check_context_by_history': bench_check_context([10, 1000] if quick else [10, 100, 1000, 10000], repeat),
+        'chat_test_client': bench_chat_test_client(['nltk', 'openai'], requests, latency=0.0),
+        'chat_wsgi_server': bench_chat_server(['nltk', 'openai'], requests, latency=0.0, workers=4)
+    }
+
+
+def environment() -> Dict[str, Any]:
+    """Describe where the results were measured."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    }
+
+
+def _flatten(results: Any, prefix: str = '') -> Dict[str, float]:
+    """Flatten nested results into dotted keys of their numeric leaves."""
+    flat = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            flat.update(_flatten(value, f"{prefix}{key}."))
+    elif isinstance(results, list):
+        for index, value in enumerate(results):
+            flat.update(_flatten(value, f"{prefix}{index}."))
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        flat[prefix.rstrip('.')] = results
+    return flat
+
+
+def compare(baseline_path: str, current_path: str) -> Dict[str, Any]:
+    """
+    Compare the numeric results of two runs written with --output.
+
+    Args:
+        baseline_path: Results of the reference commit
+        current_path: Results of the commit under test
+
+    Returns:
+        Per metric, both values and the current / baseline ratio
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+
+    old = _flatten(baseline.get('results'))
+    new = _flatten(current.get('results'))
+    return {
+        'baseline': baseline.get('environment'),
+        'current': current.get('environment'),
+        'metrics': {
+            key: {'baseline': old[key], 'current': new[key], 'ratio': new[key] / old[key] if old[key] else None}
+            for key in sorted(old.keys() & new.keys())
+        }
+    }
+
+
+def main():
+    """Run the benchmark selected on the command line and print its results as JSON."""
+    parser = argparse.ArgumentParser(description="Offline chatbot benchmarks")
+    parser.add_argument("--output", help="also write the results, with the commit and environment, to this JSON file")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    concurrency = subparsers.add_parser("concurrency", help="threaded vs asyncio request path")
+    concurrency.add_argument("--requests", type=int, default=400)
+    concurrency.add_argument("--latency", type=float, default=0.2)
+    concurrency.add_argument("--workers", type=int, default=8)
+
+    semantic = subparsers.add_parser("semantic", help="semantic cache lookup latency")
+    semantic.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    semantic.add_argument("--lookups", type=int, default=200)
+
+    dispatch = subparsers.add_parser("dispatch", help="deadlines, circuit breaker and hedging with a faulty backend")
+    dispatch.add_argument("--requests", type=int, default=200)
+    dispatch.add_argument("--latency", type=float, default=0.05)
+    dispatch.add_argument("--slow-rate", type=float, default=0.03)
+    dispatch.add_argument("--slow-latency", type=float, default=2.0)
+    dispatch.add_argument("--error-rate", type=float, default=0.05)
+    dispatch.add_argument("--deadline", type=float, default=0.5)
+
+    pooling = subparsers.add_parser("transport", help="shared HTTP connection pool against a local stub server")
+    pooling.add_argument("--requests", type=int, default=200)
+    pooling.add_argument("--workers", type=int, default=8)
+    pooling.add_argument("--latency", type=float, default=0.0)
+
+    batching = subparsers.add_parser("batch", help="/chat one by one vs /chat/batch")
+    batching.add_argument("--items", type=int, default=1000)
+    batching.add_argument("--conversations", type=int, default=50)
+    batching.add_argument("--latency", type=float, default=0.05)
+    batching.add_argument("--workers", type=int, default=8)
+
+    suite = subparsers.add_parser("suite", help="preprocessing, intent matching, context check and /chat latency")
+    suite.add_argument("--quick", action="store_true", help="smaller sizes for a smoke run")
+
+    serving = subparsers.add_parser("serve", help="gunicorn profile: per-worker memory and throughput, with and without preload")
+    serving.add_argument("--workers", type=int, default=4)
+    serving.add_argument("--threads", type=int, default=4)
+    serving.add_argument("--requests", type=int, default=2000)
+    serving.add_argument("--clients", type=int, default=8)
+    serving.add_argument("--mode", choices=["both", "preload", "no-preload"], default="both")
+
+    overload = subparsers.add_parser("overload", help="admission control and rate limiting past upstream capacity")
+    overload.add_argument("--rate", type=float, default=100.0)
+    overload.add_argument("--duration", type=float, default=10.0)
+    overload.add_argument("--latency", type=float, default=0.2)
+    overload.add_argument("--capacity", type=int, default=8)
+    overload.add_argument("--deadline", type=float, default=2.0)
+    overload.add_argument("--flood", type=int, default=100)
+
+    kb = subparsers.add_parser("kb", help="knowledge base index build, incremental update, load and query latency")
+    kb.add_argument("--documents", type=int, default=100000)
+    kb.add_argument("--queries", type=int, default=1000)
+
+    history = subparsers.add_parser("history", help="history memory and wire size: dictionaries and JSON vs Exchange and encode_history")
+    history.add_argument("--turns", type=int, nargs="+", default=[10, 100, 1000])
+
+    profiling = subparsers.add_parser("profiling", help="/chat latency with request profiling enabled, unprofiled and profiled")
+    profiling.add_argument("--requests", type=int, default=500)
+
+    pages = subparsers.add_parser("pages", help="page rendering with and without the page cache, and static file bytes")
+    pages.add_argument("--requests", type=int, default=500)
+
+    comparison = subparsers.add_parser("compare", help="compare two --output files")
+    comparison.add_argument("baseline")
+    comparison.add_argument("current")
+
+    args = parser.parse_args()
+
+    if args.benchmark == "concurrency":
+        results = bench_concurrency(args.requests, args.latency, args.workers)
+    elif args.benchmark == "semantic":
+        results = bench_semantic(args.sizes, args.lookups)
+    elif args.benchmark == "dispatch":
+        results = bench_dispatch(args.requests, args.latency, args.slow_rate, args.slow_latency,
+                                 args.error_rate, args.deadline)
+    elif args.benchmark == "transport":
+        results = bench_transport(args.requests, args.workers, args.latency)
+    elif args.benchmark == "batch":
+        results = bench_batch(args.items, args.conversations, args.latency, args.workers)
+    elif args.benchmark == "suite":
+        results = bench_suite(args.quick)
+    elif args.benchmark == "serve":
+        modes = {'both': [True, False], 'preload': [True], 'no-preload': [False]}[args.mode]
+        results = {
+            'preload' if preload else 'no_preload': bench_serve(args.workers, args.threads, args.requests,
+                                                                args.clients, preload)
+            for preload in modes
+        }
+    elif args.benchmark == "overload":
+        results = bench_overload(args.rate, args.duration, args.latency, args.capacity, args.deadline, args.flood)
+    elif args.benchmark == "kb":
+        results = bench_knowledge_base(args.documents, args.queries)
+    elif args.benchmark == "history":
+        results = bench_history(args.turns)
+    elif args.benchmark == "profiling":
+        results = bench_profiling(args.requests)
+    elif args.benchmark == "pages":
+        results = bench_pages(args.requests)
+    elif args.benchmark == "compare":
+        results = compare(args.baseline, args.current)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': args.benchmark, 'arguments': vars(args), 'environment': environment(),
+                       'results': results}, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+"""
+Route logic shared by the web applications.
+This module holds the state and request handling that the Flask app (app.py) and the ASGI app
+(asgi.py) have in common, so each app only translates between its framework and these methods.
+"""
+import os
+import hmac
+import json
+import logging
+from typing import List, Dict, Optional, Any, Tuple
+
+from chatbot import Chatbot, default_model_preference
+from backends import BackendRegistry, ModelRouter, MODEL_PREFERENCES, parse_batch
+from conversation_store import create_store
+from exchange import Exchange, encode_history, decode_history
+from context_state import ContextState
+from context_builder import current_window
+from instrumentation import timed
+from rate_limit import create_rate_limiter, retry_after_header
+from profiling import create_profiler
+from assets import AssetManifest, RenderCache
+
+logger = logging.getLogger(__name__)
+
+# Endpoints counted by the rate limiter and eligible for profiling
+RATE_LIMITED_ENDPOINTS = {'chat', 'chat_stream', 'chat_batch'}
+PROFILED_ENDPOINTS = {'chat', 'chat_stream', 'chat_batch'}
+
+# Exchanges fetched as context; the OpenAI context builder trims them to its token budget
+HISTORY_CONTEXT_LIMIT = 50
+
+# Exchanges rendered on the home page and returned per /history page
+HISTORY_PAGE_LIMIT = 50
+MAX_HISTORY_PAGE_LIMIT = 200
+
+
+def error_body(e: Exception) -> Dict[str, str]:
+    """Get the JSON body reporting an unexpected error."""
+    return {'error': f'An error occurred: {str(e)}'}
+
+
+def parse_message(payload: Any) -> str:
+    """
+    Get the message of a /chat or /chat/stream request body.
+
+    Raises:
+        ValueError: If the message is missing or blank
+    """
+    message = payload.get('message', '') if isinstance(payload, dict) else ''
+    if not isinstance(message, str) or not message.strip():
+        raise ValueError('Please enter a message')
+    return message
+
+
+def retry_body(retry_after: float, message: str = 'The server is busy, please retry shortly'
+               ) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """Get the JSON body and headers telling a client to come back after `retry_after` seconds."""
+    return ({'error': message, 'retry_after': round(retry_after, 2)},
+            {'Retry-After': retry_after_header(retry_after)})
+
+
+def client_address(remote_addr: Optional[str], forwarded_for: Optional[str], trusted_proxies: int) -> Optional[str]:
+    """
+    Get the address of the client that sent a request.
+
+    Each proxy appends the address it received the request from to
+    X-Forwarded-For, so behind `trusted_proxies` proxies the client's address
+    is that many entries from the end; earlier entries come from the client
+    and are not trusted. With fewer entries, the peer address is used.
+
+    Args:
+        remote_addr: Address of the peer that connected to the app
+        forwarded_for: The request's X-Forwarded-For values, comma separated
+        trusted_proxies: Number of reverse proxies in front of the app
+
+    Returns:
+        The client's address
+    """
+    if trusted_proxies <= 0 or not forwarded_for:
+        return remote_addr
+    hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+    if len(hops) < trusted_proxies:
+        return remote_addr
+    return hops[-trusted_proxies]
+
+
+def sse_token(chunk: str) -> str:
+    """Format a streamed chunk as a Server-Sent Event."""
+    return f"data: {json.dumps({'token': chunk})}\n\n"
+
+
+def sse_error(e: Exception) -> str:
+    """Format a stream failure as a Server-Sent Event."""
+    return f"event: error\ndata: {json.dumps(error_body(e))}\n\n"
+
+
+def sse_done(response: str) -> str:
+    """Format the end of a stream, carrying the whole response, as a Server-Sent Event."""
+    return f"event: done\ndata: {json.dumps({'response': response})}\n\n"
+
+
+class ChatService:
+    """
+    Backends, storage and route logic of the web applications.
+
+    Methods take the session and request values they need as arguments and
+    return plain data, so both apps can call them. The methods that touch
+    the conversation store or update a context state block; the ASGI app
+    runs those in a worker thread.
+    """
+
+    def __init__(self, static_folder: str):
+        """
+        Build the shared backends and stores configured by the environment.
+
+        Args:
+            static_folder: The app's static folder, fingerprinted for /assets
+        """
+        # Backends are built once and shared; each session picks its model preference
+        self.registry = BackendRegistry()
+        self.router = ModelRouter(self.registry, default_preference=default_model_preference())
+
+        # Build the default chatbot up front so the first request does not pay for it
+        self.registry.chatbot(self.router.default_preference)
+
+        # Conversation history lives server-side; the session only carries its id
+        self.store = create_store()
+
+        # Per-client request budget on the chat endpoints; None unless RATE_LIMIT is set.
+        # Clients are told apart by session or by address, read past TRUSTED_PROXY_HOPS proxies.
+        self.rate_limiter = create_rate_limiter()
+        self.rate_limit_key = os.environ.get("RATE_LIMIT_KEY", "ip")
+        self.trusted_proxies = int(os.environ.get("TRUSTED_PROXY_HOPS", "0"))
+
+        # Fingerprinted, precompressed static files, and pages that render the same for every visitor
+        self.assets = AssetManifest(static_folder)
+        self.pages = RenderCache()
+
+        # Request profiling; None, with no hooks or routes registered, unless PROFILE_TOKEN is set
+        self.profiler = create_profiler()
+
+        # Bearer token required by /stats and /metrics; without it they are open to anyone who can reach them
+        self.stats_token = os.environ.get("STATS_TOKEN") or None
+        if self.stats_token is None:
+            logger.info("STATS_TOKEN is not set; /stats and /metrics are not authenticated")
+
+    def conversation_id(self, session) -> str:
+        """Get the session's conversation id, starting a conversation if needed."""
+        if 'conversation_id' not in session:
+            session['conversation_id'] = self.store.create()
+        return session['conversation_id']
+
+    def client_key(self, session, remote_addr: Optional[str], forwarded_for: Optional[str] = None) -> str:
+        """
+        Get the key the rate limiter counts a request under.
+
+        RATE_LIMIT_KEY=session counts per browser session, which keeps clients
+        behind a shared address apart; requests without a session yet, and
+        every request by default, are counted per client address.
+
+        Args:
+            session: The user's session
+            remote_addr: Address of the peer that connected to the app
+            forwarded_for: The request's X-Forwarded-For values, used behind trusted proxies
+        """
+        if self.rate_limit_key == 'session' and 'conversation_id' in session:
+            return f"session:{session['conversation_id']}"
+        return f"ip:{client_address(remote_addr, forwarded_for, self.trusted_proxies)}"
+
+    def home_history(self, session) -> List[Exchange]:
+        """
+        Get the exchanges rendered on the home page.
+
+        Visitors without a conversation get an empty page and no conversation:
+        one is started by their first message, so crawlers and health checks
+        leave nothing behind.
+        """
+        conversation = session.get('conversation_id')
+        if conversation is None:
+            return []
+        return self.store.recent(conversation, HISTORY_PAGE_LIMIT)
+
+    def shared_page_key(self, template: str, context: Dict[str, Any]) -> Tuple:
+        """Get the render cache key of a page that is the same for every visitor."""
+        return template, tuple(sorted(context.items()))
+
+    def load_conversation(self, session) -> Tuple[str, List[Exchange], ContextState]:
+        """
+        Get the session's conversation with the history and context state a response is built from.
+
+        Returns:
+            Tuple of the conversation id, its recent exchanges and its context state
+        """
+        conversation = self.conversation_id(session)
+        with timed("history_load"):
+            chat_history = self.store.recent(conversation, HISTORY_CONTEXT_LIMIT)
+            saved = self.store.context(conversation)
+            # Rebuild the state from the history if none was saved
+            context = ContextState.from_dict(saved) if saved is not None else ContextState.from_history(chat_history)
+        return conversation, chat_history, context
+
+    def save_exchange(self, chatbot: Chatbot, conversation: str, context: ContextState,
+                      user_message: str, response: str) -> Dict[str, str]:
+        """
+        Update the context state with a new exchange and append both to the conversation.
+
+        Returns:
+            The new exchange
+        """
+        chatbot.update_context(context, user_message, response)
+        new_exchange = {
+            'user': user_message,
+            'bot': response
+        }
+        with timed("history_save"):
+            self.store.append(conversation, new_exchange, context.to_dict())
+        return new_exchange
+
+    def chat_result(self, conversation: str, response: str, new_exchange: Dict[str, str]) -> Dict[str, Any]:
+        """Get the /chat response body; call it in the context the response was built in, which holds its window."""
+        # Only the new exchange is returned; older ones are available from /history
+        result = {
+            'response': response,
+            'exchange': new_exchange
+        }
+
+        # Report the prompt size when an API model built a context window
+        window = current_window()
+        if window is not None:
+            result['context'] = window.to_dict()
+            logger.debug("Conversation %s: %s prompt tokens", conversation, window.tokens)
+        return result
+
+    def batch_chatbot(self, session, payload: Any) -> Tuple[Chatbot, List[Tuple[str, str]], Dict[str, List]]:
+        """
+        Validate a /chat/batch request body and pick the chatbot answering it.
+
+        Returns:
+            Tuple of the chatbot, the (conversation, message) pairs and the histories
+
+        Raises:
+            ValueError: If the body is malformed or too large
+        """
+        batch, histories, model = parse_batch(payload)
+        # Batch conversations are labels within the request; they are not saved to the store
+        chatbot = self.registry.chatbot(model) if model else self.router.chatbot_for(session)
+        return chatbot, batch, histories
+
+    @staticmethod
+    def batch_result(batch: List[Tuple[str, str]], responses: List[str]) -> Dict[str, Any]:
+        """Get the /chat/batch response body."""
+        return {
+            'responses': [
+                {'conversation': conversation, 'message': message, 'response': response}
+                for (conversation, message), response in zip(batch, responses)
+            ],
+            'count': len(responses)
+        }
+
+    def history_page(self, session, offset: Optional[int], limit: Optional[int]) -> Dict[str, Any]:
+        """Get one page of the conversation history, oldest first, as the /history response body."""
+        offset = max(offset or 0, 0)
+        limit = min(max(HISTORY_PAGE_LIMIT if limit is None else limit, 1), MAX_HISTORY_PAGE_LIMIT)
+        # Reading history never starts a conversation
+        conversation = session.get('conversation_id')
+        if conversation is None:
+            return {'history': [], 'offset': offset, 'limit': limit, 'total': 0}
+        return {
+            'history': [exchange.to_dict() for exchange in self.store.page(conversation, offset, limit)],
+            'offset': offset,
+            'limit': limit,
+            'total': self.store.count(conversation)
+        }
+
+    def export_history(self, session) -> Tuple[bytes, int]:
+        """
+        Encode the whole conversation in the form read by import_history().
+
+        Returns:
+            Tuple of the encoded history and its exchange count; an empty history without a conversation
+        """
+        conversation = session.get('conversation_id')
+        if conversation is None:
+            return encode_history([]), 0
+        exchanges = self.store.page(conversation, 0, self.store.count(conversation))
+        return encode_history(exchanges), len(exchanges)
+
+    def import_history(self, session, data: bytes) -> int:
+        """
+        Replace the conversation with an encoded one.
+
+        Returns:
+            The number of exchanges imported
+
+        Raises:
+            ValueError: If the data is not an encoded history
+        """
+        exchanges = decode_history(data)
+        # The saved context state belonged to the old history; it is rebuilt from the new one when next needed
+        conversation = self.conversation_id(session)
+        self.store.clear(conversation)
+        self.store.extend(conversation, exchanges)
+        return len(exchanges)
+
+    def reset(self, session):
+        """Delete the conversation's history, if the session has one."""
+        conversation = session.get('conversation_id')
+        if conversation is not None:
+            self.store.clear(conversation)
+
+    def model_info(self, session) -> Dict[str, Any]:
+        """Get the session's model and the models available, as the GET /model response body."""
+        chatbot = self.router.chatbot_for(session)
+        available_models = chatbot.available_models
+        return {
+            'current_model': chatbot.model_preference,
+            'available_models': available_models,
+            'openai_available': "openai" in available_models,
+            'gemini_available': "gemini" in available_models,
+            'nltk_available': "nltk" in available_models
+        }
+
+    def set_model(self, session, payload: Any) -> Dict[str, Any]:
+        """
+        Switch the session's model, as the POST /model request; only this session switches.
+
+        Raises:
+            ValueError: If the model name is invalid
+        """
+        model_name = payload.get('model', 'auto') if isinstance(payload, dict) else 'auto'
+        if model_name not in MODEL_PREFERENCES:
+            raise ValueError('Invalid model name')
+        chatbot = self.router.set_preference(session, model_name)
+        return {
+            'status': 'Model updated successfully',
+            'current_model': chatbot.model_preference,
+            'available_models': chatbot.available_models
+        }
+
+    def stats_authorized(self, authorization: Optional[str]) -> bool:
+        """Check a request's Authorization header against STATS_TOKEN in constant time; open without a token."""
+        if self.stats_token is None:
+            return True
+        scheme, _, token = (authorization or '').partition(' ')
+        return (scheme.lower() == 'bearer' and bool(token)
+                and hmac.compare_digest(token.strip().encode(), self.stats_token.encode()))
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the /stats response body: cache hit rates and other backend statistics."""
+        stats = self.registry.stats()
+        stats['rate_limit'] = self.rate_limiter.stats() if self.rate_limiter is not None else None
+        stats['profiling'] = self.profiler.stats() if self.profiler is not None else None
+        stats['assets'] = self.assets.stats()
+        stats['page_cache'] = self.pages.stats()
+        return stats
+
+    def profile_listing(self, event_loop: bool = False) -> Dict[str, Any]:
+        """
+        Get the kept profiles, newest first, as the /admin/profiles response body.
+
+        Args:
+            event_loop: Whether the profiles were taken on an event loop thread, where
+                they include every coroutine the loop ran while the request was profiled
+
+        Returns:
+            Dictionary with the profiles, the profiler's stats and the profiles' scope
+        """
+        body = {
+            'profiles': [capture.summary() for capture in self.profiler.captures()],
+            'stats': self.profiler.stats(),
+            'scope': 'event_loop' if event_loop else 'request'
+        }
+        if event_loop:
+            body['note'] = ("Profiles include every coroutine the event loop ran while the request was profiled, "
+                            "not only the profiled request")
+        return body
+
+    def profile(self, capture_id: int, output: str, sort: str) -> Tuple[int, Any, Dict[str, str]]:
+        """
+        Answer a request for one profile.
+
+        Args:
+            capture_id: The capture requested
+            output: "text" for a pstats report, "pstats" for a pstats file or "collapsed" for collapsed stacks
+            sort: pstats sort key of the text report
+
+        Returns:
+            Tuple of the status, the body (a dictionary for a JSON body) and the headers
+        """
+        capture = self.profiler.get(capture_id)
+        if capture is None:
+            return 404, {'error': 'Profile not found'}, {}
+        if output == 'pstats':
+            return 200, capture.pstats_bytes(), {
+                'Content-Type': 'application/octet-stream',
+                'Content-Disposition': f'attachment; filename="profile-{capture.id}.prof"'
+            }
+        if output == 'collapsed':
+            return 200, capture.collapsed(), {'Content-Type': 'text/plain'}
+        if output == 'text':
+            try:
+                return 200, capture.report(sort), {'Content-Type': 'text/plain'}
+            except ValueError as e:
+                return 400, {'error': str(e)}, {}
+        return 400, {'error': "format must be 'text', 'pstats' or 'collapsed'"}, {}
@@ -1,29 +1,14 @@
 import os
+import sys
+import asyncio
 import logging
 import random
-import re
-from typing import List, Dict, Any, Optional
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Callable, Iterator, AsyncIterator, Tuple
 
-# Try importing nltk for the rule-based fallback system
-try:
-    import nltk
-    from nltk.tokenize import word_tokenize
-    from nltk.corpus import stopwords
-    from nltk.stem import WordNetLemmatizer
-    nltk_available = True
-    
-    # Download necessary NLTK data
-    try:
-        nltk.download('punkt', quiet=True)
-        nltk.download('wordnet', quiet=True)
-        nltk.download('stopwords', quiet=True)
-        nltk.download('omw-1.4', quiet=True)  # Open Multilingual WordNet data
-        logging.info("NLTK resources downloaded successfully")
-    except Exception as e:
-        logging.warning(f"Error downloading NLTK resources: {str(e)}")
-        
-except ImportError:
-    nltk_available = False
+# NLTK corpora are checked and loaded lazily by nltk_resources; nothing is downloaded at import time
+from nltk_resources import nltk_available, prewarm
 
 # Try importing AI model classes
 try:
@@ -32,20 +17,32 @@ try:
 except ImportError:
     ai_models_available = False
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+from intent_matcher import IntentMatcher
+from intent_catalog import shared_catalog
+from context_state import ContextState, is_follow_up
+from exchange import Exchange
+from knowledge_base import KnowledgeBase, Hit, shared_knowledge_base, terms, MAX_PASSAGE_CHARS
+from preprocessing import TextPreprocessor
+from response_cache import ErrorResponse
+from dispatch import Dispatcher
+from rate_limit import Overloaded
+from instrumentation import timed
+
+# Logging is configured by the entry point (app.py, asgi.py or main())
 logger = logging.getLogger(__name__)
 
 class Chatbot:
     """
     A class that handles interactions to create a conversational AI chatbot.
     This implementation supports multiple backend systems:
-    1. OpenAI API (if API key is available)
-    2. Google Gemini API (if API key is available)
-    3. NLTK-based rule approach (as fallback, no API key required)
+    1. Local knowledge base (if one is configured), answering confident matches directly
+    2. OpenAI API (if API key is available)
+    3. Google Gemini API (if API key is available)
+    4. NLTK-based rule approach (as fallback, no API key required)
     """
     
-    def __init__(self, model_preference="auto"):
+    def __init__(self, model_preference="auto", openai_model=None, gemini_model=None, response_cache=None,
+                 semantic_cache=None, dispatcher=None, intent_catalog=None, knowledge_base=None):
         """
         Initialize the chatbot with the preferred model.
         
@@ -55,16 +52,27 @@ class Chatbot:
                 - "gemini": Use Gemini if available, fall back to others
                 - "nltk": Use rule-based NLTK approach only
                 - "auto" (default): Try OpenAI, then Gemini, then NLTK
+            openai_model: Existing OpenAIModel to use instead of creating one
+            gemini_model: Existing GeminiModel to use instead of creating one
+            response_cache: ResponseCache consulted before any backend is called
+            semantic_cache: SemanticCache consulted for near-duplicates after an exact cache miss
+            dispatcher: Dispatcher applying deadlines and circuit breakers to the API models
+            intent_catalog: IntentCatalog or ReloadingCatalog for the rule-based fallback; defaults to the shared one
+            knowledge_base: KnowledgeBase answering from a local corpus; defaults to the shared one, if configured
         """
         self.model_preference = model_preference
         self.available_models = []
+        self.response_cache = response_cache
+        self.semantic_cache = semantic_cache
+        self.dispatcher = dispatcher or Dispatcher()
+        self.intent_catalog = intent_catalog
         
         # Try to initialize each model in order of preference
         if ai_models_available and model_preference != "nltk":
             # Try OpenAI first (or if specified)
             if model_preference in ["auto", "openai"]:
-                self.openai_model = OpenAIModel()
-                if self.openai_model.client:
+                self.openai_model = openai_model or OpenAIModel()
+                if self.openai_model.available:
                     self.available_models.append("openai")
                     logger.info("OpenAI model initialized successfully")
                 else:
@@ -72,8 +80,8 @@ class Chatbot:
             
             # Try Gemini second (or if specified)
             if model_preference in ["auto", "gemini"] or (model_preference == "openai" and "openai" not in self.available_models):
-                self.gemini_model = GeminiModel()
-                if self.gemini_model.genai:
+                self.gemini_model = gemini_model or GeminiModel()
+                if self.gemini_model.available:
                     self.available_models.append("gemini")
                     logger.info("Gemini model initialized successfully")
                 else:
@@ -86,11 +94,22 @@ class Chatbot:
                 self.available_models.append("nltk")
             logger.info("Rule-based fallback model initialized successfully")
         
+        # The knowledge base goes ahead of the API models: a confident match costs no API call
+        self.knowledge_base: Optional[KnowledgeBase] = knowledge_base or shared_knowledge_base()
+        if self.knowledge_base is not None and len(self.knowledge_base):
+            self.available_models.insert(0, "kb")
+            logger.info("Knowledge base initialized with %s documents", len(self.knowledge_base))
+        
+        # Disk reads and the vector and knowledge base searches take milliseconds; the async paths
+        # run them in a worker thread rather than stalling every other request on the event loop
+        self.lookups_block = bool((response_cache is not None and response_cache.disk_path)
+                                  or semantic_cache is not None or "kb" in self.available_models)
+        
         # Log which models are available
         if not self.available_models:
             logger.warning("No models available, chatbot functionality will be limited")
         else:
-            logger.info(f"Chatbot initialized with models: {', '.join(self.available_models)}")
+            logger.info("Chatbot initialized with models: %s", ', '.join(self.available_models))
     
     def initialize_nltk_fallback(self):
         """Initialize the NLTK rule-based fallback system."""
@@ -98,134 +117,489 @@ class Chatbot:
             logger.warning("NLTK not available for fallback")
             return
             
-        # Initialize the lemmatizer for word normalization
-        self.lemmatizer = WordNetLemmatizer()
-        
-        # Define patterns and responses
-        self.patterns_responses = {
-            r'hello|hi|hey|howdy': [
-                "Hello! How can I help you today?",
-                "Hi there! What can I do for you?",
-                "Hey! Nice to meet you. What's on your mind?"
-            ],
-            r'how are you|how\'s it going': [
-                "I'm just a program, but I'm functioning well! How can I assist you?",
-                "I'm doing great, thanks for asking! How can I help?"
-            ],
-            r'bye|goodbye|see you|farewell': [
-                "Goodbye! Feel free to come back if you have more questions.",
-                "Farewell! Have a great day!",
-                "See you later! Take care!"
-            ],
-            r'thank|thanks': [
-                "You're welcome!",
-                "Happy to help!",
-                "Anytime! That's what I'm here for."
-            ],
-            r'name|your name|who are you': [
-                "I'm a simple AI chatbot created to help answer your questions.",
-                "I'm an AI assistant here to chat with you."
-            ],
-            r'(what|how) (can|do) you do': [
-                "I can answer questions, have a conversation, or just chat about various topics.",
-                "I'm designed to engage in conversation and provide information on a variety of subjects."
-            ],
-            r'weather|temperature|forecast': [
-                "I don't have access to real-time weather data, but I'd be happy to chat about other topics!",
-                "I can't check the current weather, but I can help with other questions you might have."
-            ],
-            r'joke|tell.*joke|funny': [
-                "Why don't scientists trust atoms? Because they make up everything!",
-                "What did one wall say to the other wall? I'll meet you at the corner!",
-                "Why did the scarecrow win an award? Because he was outstanding in his field!"
-            ],
-            r'time|current time|what time': [
-                "I don't have access to the current time, but your device should have that information!",
-                "I can't tell you the exact time right now, but I'm always ready to chat."
-            ],
-            r'help|assist|support': [
-                "I'm here to help! Feel free to ask me any questions or just chat.",
-                "I'm at your service! What do you need assistance with?",
-                "How can I assist you today? Just let me know what you're looking for."
-            ],
-            r'model|which model|what model|how do you work': [
-                f"I'm currently using the following models: {', '.join(self.available_models)}. I'll try to give you the best responses possible!",
-                f"My brain is powered by: {', '.join(self.available_models)}. I'm here to assist you with various tasks and questions."
-            ]
-        }
-        
-        # Default responses for when no pattern matches
-        self.default_responses = [
-            "I'm not sure I understand. Could you rephrase that?",
-            "That's an interesting point. Can you tell me more?",
-            "I don't have specific information about that, but I'm happy to chat about something else.",
-            "I'm still learning and may not have the answer to that. What else would you like to talk about?",
-            "That's beyond my current capabilities, but I'm here if you have other questions."
-        ]
-    
-    def get_response(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None) -> str:
+        # Initialize the preprocessing pipeline (stopwords loaded once, lemmas cached)
+        self.preprocessor = TextPreprocessor()
+        
+        # Intents come from the process-wide catalog, loaded (or memory-mapped) once and reloaded on change
+        if self.intent_catalog is None:
+            self.intent_catalog = shared_catalog()
+    
+    @property
+    def intent_matcher(self) -> IntentMatcher:
+        """Get the matcher of the current intent catalog."""
+        return self.intent_catalog.current().matcher
+    
+    @property
+    def patterns_responses(self) -> Dict[str, List[str]]:
+        """Get the patterns and responses of the current intent catalog."""
+        return self.intent_catalog.current().patterns_responses
+    
+    @property
+    def default_responses(self) -> List[str]:
+        """Get the responses used when no intent of the current catalog matches."""
+        return self.intent_catalog.current().default_responses
+    
+    def _backend_order(self) -> List[str]:
+        """
+        List the backends to try for a message, in fallback order.
+        
+        Returns:
+            Backend names, ending with "nltk" when the rule-based fallback is available
+        """
+        order = []
+        
+        # Answer from the knowledge base when it has a confident match
+        if "kb" in self.available_models:
+            order.append("kb")
+        
+        # Use OpenAI if available and preferred
+        if "openai" in self.available_models and self.model_preference in ["auto", "openai"]:
+            order.append("openai")
+        
+        # Use Gemini if available and preferred, or if OpenAI failed
+        if "gemini" in self.available_models and (self.model_preference in ["auto", "gemini"] or 
+                (self.model_preference == "openai" and "openai" in self.available_models)):
+            order.append("gemini")
+        
+        # Fall back to NLTK rule-based approach
+        if "nltk" in self.available_models:
+            order.append("nltk")
+        
+        return order
+    
+    def _api_model(self, backend: str):
+        """Get the model object for an API backend."""
+        return self.openai_model if backend == "openai" else self.gemini_model
+    
+    def _invoke(self, backend: str, user_input: str, chat_history: Optional[List[Dict[str, str]]],
+                context: Optional[ContextState] = None, hits: Optional[List[Hit]] = None) -> Optional[str]:
+        """Get a response from one backend; the knowledge base returns None without a confident match."""
+        if backend == "nltk":
+            return self.get_nltk_response(user_input, chat_history, context)
+        if backend == "kb":
+            return self.knowledge_base.answer(hits or [])
+        return self._api_model(backend).get_response(self._with_passages(user_input, hits), chat_history)
+    
+    def _open_stream(self, backend: str, user_input: str, chat_history: Optional[List[Dict[str, str]]],
+                     context: Optional[ContextState] = None, hits: Optional[List[Hit]] = None) -> Iterator[str]:
+        """Start streaming a response from one backend."""
+        if backend in ("nltk", "kb"):
+            response = self._invoke(backend, user_input, chat_history, context, hits)
+            return iter([response] if response is not None else [])
+        return self._api_model(backend).stream_response(self._with_passages(user_input, hits), chat_history)
+    
+    def _retrieve(self, user_input: str) -> List[Hit]:
+        """
+        Search the knowledge base for a message.
+        
+        The search runs once per message: its best hit may answer directly,
+        and its top passages are added to the prompts of the API models.
+        
+        Returns:
+            The best hits, best first; empty without a knowledge base
+        """
+        if "kb" not in self.available_models or not user_input or not user_input.strip():
+            return []
+        with timed("preprocess", "kb"):
+            query_terms = terms(self._preprocess_text(user_input))
+        with timed("kb_search", "kb"):
+            return self.knowledge_base.search_terms(query_terms)
+    
+    def _with_passages(self, user_input: str, hits: Optional[List[Hit]]) -> str:
+        """Prepend the knowledge base passages relevant to a message, if any, for an API model."""
+        passages = self.knowledge_base.passages(hits) if hits else []
+        if not passages:
+            return user_input
+        lines = ["Use these passages from the knowledge base if they help answer the message below."]
+        for number, document in enumerate(passages, 1):
+            text = document.text[:MAX_PASSAGE_CHARS]
+            lines.append(f"[{number}] {document.title}: {text}" if document.title else f"[{number}] {text}")
+        lines.append(f"\nMessage: {user_input}")
+        return '\n'.join(lines)
+    
+    async def _off_loop(self, func: Callable[..., Any], *args) -> Any:
+        """Run cache and knowledge base work in a worker thread if it may block, else inline."""
+        if self.lookups_block:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+    
+    def _cache_lookup(self, user_input: str, chat_history: Optional[List[Dict[str, str]]]):
+        """
+        Look up a request in the response cache, then in the semantic cache.
+        
+        Returns:
+            Tuple of the cache key (None without a cache, or if the request is not cacheable)
+            and the cached response (None on a miss)
+        """
+        key = cached = None
+        if self.response_cache is not None:
+            with timed("cache_lookup"):
+                key = self.response_cache.make_key(user_input, chat_history, self.model_preference)
+                if key is not None:
+                    cached = self.response_cache.get(key)
+        if cached is None and self.semantic_cache is not None:
+            with timed("semantic_cache_lookup"):
+                cached = self.semantic_cache.get(user_input, chat_history, self.model_preference)
+        return key, cached
+    
+    def _cache_store(self, key: Optional[str], backend: str, response: str, user_input: str,
+                     chat_history: Optional[List[Dict[str, str]]]):
+        """Store a backend's response in the response and semantic caches."""
+        if key is not None:
+            self.response_cache.put(key, response, backend)
+        if self.semantic_cache is not None:
+            self.semantic_cache.add(user_input, chat_history, self.model_preference, response, backend)
+    
+    def get_response(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None,
+                     context: Optional[ContextState] = None) -> str:
         """
         Get a response based on user input and conversation history.
         
         Args:
             user_input: The user's message
             chat_history: List of previous exchanges in the conversation
+            context: Context state of the conversation; derived from the last exchange if omitted
             
         Returns:
             The chatbot's response
+
+        Raises:
+            Overloaded: If every API model is at capacity and the request should be retried later
         """
         if not user_input or not user_input.strip():
             return "Please type a message to start the conversation."
             
         try:
-            # Use OpenAI if available and preferred
-            if "openai" in self.available_models and self.model_preference in ["auto", "openai"]:
-                try:
-                    return self.openai_model.get_response(user_input, chat_history)
-                except Exception as e:
-                    logger.error(f"Error with OpenAI model: {str(e)}, falling back to alternative")
+            cache_key, cached = self._cache_lookup(user_input, chat_history)
+            if cached is not None:
+                return cached
+            
+            hits = self._retrieve(user_input)
+            backend, response = self.dispatcher.call(
+                self._backend_order(),
+                lambda backend: self._invoke(backend, user_input, chat_history, context, hits)
+            )
+            if backend is not None:
+                self._cache_store(cache_key, backend, response, user_input, chat_history)
+                return response
+            
+            # If no models are available, pass on the last model's error
+            return response or "I'm sorry, no AI models are available at the moment. Please try again later."
+            
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.error("Error generating response: %s", e)
+            return "I'm sorry, I encountered an error. Let's try a different topic."
+    
+    async def get_response_async(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None,
+                                 context: Optional[ContextState] = None) -> str:
+        """
+        Get a response without blocking the event loop while an API model works.
+        
+        Args:
+            user_input: The user's message
+            chat_history: List of previous exchanges in the conversation
+            context: Context state of the conversation; derived from the last exchange if omitted
+            
+        Returns:
+            The chatbot's response
+
+        Raises:
+            Overloaded: If every API model is at capacity and the request should be retried later
+        """
+        if not user_input or not user_input.strip():
+            return "Please type a message to start the conversation."
             
-            # Use Gemini if available and preferred, or if OpenAI failed
-            if "gemini" in self.available_models and (self.model_preference in ["auto", "gemini"] or 
-                    (self.model_preference == "openai" and "openai" in self.available_models)):
-                try:
-                    return self.gemini_model.get_response(user_input, chat_history)
-                except Exception as e:
-                    logger.error(f"Error with Gemini model: {str(e)}, falling back to rule-based approach")
+        try:
+            cache_key, cached = await self._off_loop(self._cache_lookup, user_input, chat_history)
+            if cached is not None:
+                return cached
             
-            # Fall back to NLTK rule-based approach
-            if "nltk" in self.available_models:
-                return self.get_nltk_response(user_input, chat_history)
+            hits = await self._off_loop(self._retrieve, user_input)
+            backend, response = await self.dispatcher.call_async(
+                self._backend_order(),
+                lambda backend: self._api_model(backend).get_response_async(
+                    self._with_passages(user_input, hits), chat_history),
+                # The knowledge base and rule-based fallback are CPU-only and fast enough to run inline
+                lambda backend: self._invoke(backend, user_input, chat_history, context, hits)
+            )
+            if backend is not None:
+                await self._off_loop(self._cache_store, cache_key, backend, response, user_input, chat_history)
+                return response
             
-            # If no models are available
-            return "I'm sorry, no AI models are available at the moment. Please try again later."
+            # If no models are available, pass on the last model's error
+            return response or "I'm sorry, no AI models are available at the moment. Please try again later."
             
+        except Overloaded:
+            raise
         except Exception as e:
-            logger.error(f"Error generating response: {str(e)}")
+            logger.error("Error generating response: %s", e)
             return "I'm sorry, I encountered an error. Let's try a different topic."
     
-    def get_nltk_response(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None) -> str:
+    def stream_response(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None,
+                        context: Optional[ContextState] = None) -> Iterator[str]:
+        """
+        Stream a response based on user input and conversation history.
+        
+        The API models yield text as it is generated; the rule-based fallback
+        yields its whole response at once.
+        
+        Args:
+            user_input: The user's message
+            chat_history: List of previous exchanges in the conversation
+            context: Context state of the conversation; derived from the last exchange if omitted
+            
+        Yields:
+            Pieces of the chatbot's response, in order
+
+        Raises:
+            Overloaded: If every API model is at capacity; raised before any piece is yielded
+        """
+        if not user_input or not user_input.strip():
+            yield "Please type a message to start the conversation."
+            return
+        
+        # Fall back only if a model fails before producing any output
+        started = False
+        try:
+            cache_key, cached = self._cache_lookup(user_input, chat_history)
+            if cached is not None:
+                yield cached
+                return
+            
+            hits = self._retrieve(user_input)
+            chunks = []
+            for backend, chunk in self.dispatcher.stream(
+                    self._backend_order(),
+                    lambda backend: self._open_stream(backend, user_input, chat_history, context, hits)):
+                started = True
+                chunks.append(chunk)
+                yield chunk
+            
+            if not started:
+                yield "I'm sorry, no AI models are available at the moment. Please try again later."
+            # Error chunks are ErrorResponse instances and keep the response out of the cache
+            elif backend is not None and not any(isinstance(chunk, ErrorResponse) for chunk in chunks):
+                self._cache_store(cache_key, backend, ''.join(chunks), user_input, chat_history)
+            
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.error("Error streaming response: %s", e)
+            if not started:
+                yield "I'm sorry, I encountered an error. Let's try a different topic."
+    
+    async def stream_response_async(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None,
+                                    context: Optional[ContextState] = None) -> AsyncIterator[str]:
+        """
+        Stream a response without blocking the event loop while an API model works.
+        
+        Args:
+            user_input: The user's message
+            chat_history: List of previous exchanges in the conversation
+            context: Context state of the conversation; derived from the last exchange if omitted
+            
+        Yields:
+            Pieces of the chatbot's response, in order
+
+        Raises:
+            Overloaded: If every API model is at capacity; raised before any piece is yielded
+        """
+        if not user_input or not user_input.strip():
+            yield "Please type a message to start the conversation."
+            return
+        
+        # Fall back only if a model fails before producing any output
+        started = False
+        try:
+            cache_key, cached = await self._off_loop(self._cache_lookup, user_input, chat_history)
+            if cached is not None:
+                yield cached
+                return
+            
+            hits = await self._off_loop(self._retrieve, user_input)
+            chunks = []
+            async for backend, chunk in self.dispatcher.stream_async(
+                    self._backend_order(),
+                    lambda backend: self._api_model(backend).stream_response_async(
+                        self._with_passages(user_input, hits), chat_history),
+                    lambda backend: self._invoke(backend, user_input, chat_history, context, hits)):
+                started = True
+                chunks.append(chunk)
+                yield chunk
+            
+            if not started:
+                yield "I'm sorry, no AI models are available at the moment. Please try again later."
+            # Error chunks are ErrorResponse instances and keep the response out of the cache
+            elif backend is not None and not any(isinstance(chunk, ErrorResponse) for chunk in chunks):
+                await self._off_loop(self._cache_store, cache_key, backend, ''.join(chunks), user_input, chat_history)
+            
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.error("Error streaming response: %s", e)
+            if not started:
+                yield "I'm sorry, I encountered an error. Let's try a different topic."
+    
+    def get_nltk_response(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None,
+                          context: Optional[ContextState] = None) -> str:
         """Get a response using the NLTK rule-based approach."""
         try:
             # Preprocess the user input
-            processed_input = self._preprocess_text(user_input)
+            with timed("preprocess", "nltk"):
+                processed_input = self._preprocess_text(user_input)
             
-            # Check for context in chat history
-            context_response = self._check_context(user_input, chat_history)
-            if context_response:
-                return context_response
+            with timed("intent_match", "nltk"):
+                responses = self.intent_matcher.match(processed_input)
             
-            # Check for pattern matches
-            for pattern, responses in self.patterns_responses.items():
-                if re.search(pattern, processed_input, re.IGNORECASE):
-                    return random.choice(responses)
+            return self._rule_response(user_input, chat_history, responses, context)
             
-            # If no patterns match, return a default response
-            return random.choice(self.default_responses)
+        except Exception as e:
+            logger.error("Error in NLTK response: %s", e)
+            return ErrorResponse("I'm sorry, I encountered an error with the rule-based system.")
+    
+    def _rule_response(self, user_input: str, chat_history: Optional[List[Dict[str, str]]],
+                       responses: Optional[List[str]], context: Optional[ContextState] = None) -> str:
+        """
+        Pick the rule-based response for a message.
+        
+        Args:
+            user_input: The user's message
+            chat_history: List of previous exchanges in the conversation
+            responses: Responses of the intent the preprocessed message matched, or None
+            context: Context state of the conversation; derived from the last exchange if omitted
             
+        Returns:
+            The chatbot's response
+        """
+        # Check for context in chat history
+        with timed("context_check", "nltk"):
+            context_response = self._check_context(user_input, chat_history, context)
+        if context_response:
+            return context_response
+        
+        # Check for pattern matches, falling back to a default response
+        response = random.choice(responses or self.default_responses)
+        if '{models}' in response:
+            response = response.replace('{models}', ', '.join(self.available_models))
+        return response
+    
+    def _group_batch(self, batch: List[Tuple[str, str]], histories: Optional[Dict[str, List[Dict[str, str]]]]):
+        """Group batch item indexes by conversation and copy each conversation's starting history."""
+        conversations: Dict[str, List[int]] = {}
+        for index, (conversation, _) in enumerate(batch):
+            conversations.setdefault(conversation, []).append(index)
+        histories = histories or {}
+        return conversations, {conversation: list(histories.get(conversation) or []) for conversation in conversations}
+    
+    def _get_rule_responses(self, batch: List[Tuple[str, str]], conversations: Dict[str, List[int]],
+                            histories: Dict[str, List[Dict[str, str]]]) -> List[str]:
+        """Answer a whole batch from the rule-based backend, preprocessing and matching it in bulk."""
+        messages = [message for _, message in batch]
+        try:
+            with timed("preprocess", "nltk"):
+                processed = self.preprocessor.preprocess_many(messages)
+            with timed("intent_match", "nltk"):
+                matches = self.intent_matcher.match_many(processed)
         except Exception as e:
-            logger.error(f"Error in NLTK response: {str(e)}")
-            return "I'm sorry, I encountered an error with the rule-based system."
+            logger.error("Error in NLTK batch: %s", e)
+            return [ErrorResponse("I'm sorry, I encountered an error with the rule-based system.")] * len(batch)
+        
+        responses = [None] * len(batch)
+        for conversation, indexes in conversations.items():
+            history = histories[conversation]
+            context = ContextState.from_history(history)
+            for index in indexes:
+                message = messages[index]
+                if not message or not message.strip():
+                    responses[index] = "Please type a message to start the conversation."
+                    continue
+                responses[index] = self._rule_response(message, history, matches[index], context)
+                history.append(Exchange(message, responses[index]))
+                context.update(message, responses[index])
+        return responses
+    
+    def get_responses(self, batch: List[Tuple[str, str]], histories: Optional[Dict[str, List[Dict[str, str]]]] = None,
+                      max_workers: int = 8) -> List[str]:
+        """
+        Get responses for many (conversation, message) pairs at once.
+        
+        Messages of one conversation are answered in order, each seeing the
+        exchanges before it. With only the rule-based backend, the whole batch
+        is preprocessed and matched in bulk; otherwise conversations run
+        concurrently on a bounded thread pool through get_response.
+        
+        Args:
+            batch: (conversation id, message) pairs
+            histories: Conversation id -> previous exchanges; conversations not listed start empty
+            max_workers: Maximum conversations answered concurrently
+            
+        Returns:
+            The responses, in batch order
+
+        Raises:
+            Overloaded: If an API model call was refused for lack of capacity
+        """
+        if not batch:
+            return []
+        conversations, histories = self._group_batch(batch, histories)
+        
+        if self._backend_order() == ["nltk"]:
+            return self._get_rule_responses(batch, conversations, histories)
+        
+        responses = [None] * len(batch)
+        
+        def answer(conversation: str):
+            history = histories[conversation]
+            for index in conversations[conversation]:
+                message = batch[index][1]
+                responses[index] = self.get_response(message, history)
+                if message and message.strip():
+                    history.append(Exchange(message, responses[index]))
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(conversations)))) as pool:
+            list(pool.map(answer, conversations))
+        return responses
+    
+    async def get_responses_async(self, batch: List[Tuple[str, str]],
+                                  histories: Optional[Dict[str, List[Dict[str, str]]]] = None,
+                                  max_concurrency: int = 32) -> List[str]:
+        """
+        Get responses for many (conversation, message) pairs without blocking the event loop.
+        
+        Args:
+            batch: (conversation id, message) pairs
+            histories: Conversation id -> previous exchanges; conversations not listed start empty
+            max_concurrency: Maximum conversations answered concurrently
+            
+        Returns:
+            The responses, in batch order
+
+        Raises:
+            Overloaded: If an API model call was refused for lack of capacity
+        """
+        if not batch:
+            return []
+        conversations, histories = self._group_batch(batch, histories)
+        
+        if self._backend_order() == ["nltk"]:
+            return self._get_rule_responses(batch, conversations, histories)
+        
+        responses = [None] * len(batch)
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def answer(conversation: str):
+            async with semaphore:
+                history = histories[conversation]
+                for index in conversations[conversation]:
+                    message = batch[index][1]
+                    responses[index] = await self.get_response_async(message, history)
+                    if message and message.strip():
+                        history.append(Exchange(message, responses[index]))
+        
+        await asyncio.gather(*(answer(conversation) for conversation in conversations))
+        return responses
     
     def _preprocess_text(self, text: str) -> str:
         """
@@ -240,50 +614,57 @@ class Chatbot:
         if not nltk_available:
             return text.lower()  # Simple fallback if NLTK is not available
             
-        try:
-            # Convert to lowercase
-            text = text.lower()
-            
-            # Tokenize
-            tokens = word_tokenize(text)
-            
-            # Remove stopwords and lemmatize
-            stop_words = set(stopwords.words('english'))
-            filtered_tokens = [self.lemmatizer.lemmatize(word) for word in tokens if word not in stop_words]
-            
-            # Join back into a string
-            return ' '.join(filtered_tokens)
-        except Exception as e:
-            logger.warning(f"Error preprocessing text: {str(e)}")
-            return text  # Return original text if preprocessing fails
+        return self.preprocessor.preprocess(text)
     
-    def _check_context(self, user_input: str, chat_history: Optional[List[Dict[str, str]]]) -> Optional[str]:
+    def _check_context(self, user_input: str, chat_history: Optional[List[Dict[str, str]]],
+                       context: Optional[ContextState] = None) -> Optional[str]:
         """
         Check conversation context to provide more relevant responses.
         
         Args:
             user_input: The user's message
             chat_history: List of previous exchanges in the conversation
+            context: Context state of the conversation; derived from the last exchange if omitted
             
         Returns:
             A context-based response or None if no context found
         """
-        if not chat_history or len(chat_history) == 0:
-            return None
-            
-        # Check last few exchanges for context
-        recent_history = chat_history[-3:] if len(chat_history) >= 3 else chat_history
+        if context is None:
+            if not chat_history:
+                return None
+            # The follow-up rules only depend on the previous exchange
+            context = ContextState.from_history(chat_history[-1:])
         
-        # Simple context handling for follow-up questions
-        if any(word in user_input.lower() for word in ['why', 'how', 'what about', 'tell me more']):
-            last_exchange = recent_history[-1]
-            if 'weather' in last_exchange.get('user', '').lower():
+        # Simple context handling for follow-up questions about the previous topic
+        if context.topic is not None and is_follow_up(user_input):
+            if context.topic == 'weather':
                 return "I can't provide real-time weather information, but you might want to check a weather app for accurate forecasts."
-            elif 'joke' in last_exchange.get('user', '').lower():
+            elif context.topic == 'joke':
                 return "Here's another one: Why did the bicycle fall over? Because it was two-tired!"
                 
         return None
     
+    def update_context(self, context: ContextState, user_input: str, response: str):
+        """
+        Fold a finished exchange into a conversation's context state.
+        
+        The detected intent comes from the rule-based matcher, so it is
+        recorded whichever backend answered.
+        
+        Args:
+            context: Context state to update in place
+            user_input: The user's message
+            response: The chatbot's response
+        """
+        with timed("context_update"):
+            intent = None
+            if nltk_available and self.intent_catalog is not None:
+                matcher = self.intent_matcher
+                intent_index = matcher.match_index(self._preprocess_text(user_input))
+                if intent_index is not None:
+                    intent = matcher.patterns[intent_index]
+            context.update(user_input, response, intent)
+    
     def get_command_line_response(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None) -> str:
         """
         Special version of get_response for command-line interface that includes
@@ -300,17 +681,75 @@ class Chatbot:
             response = self.get_response(user_input, chat_history)
             return response
         except Exception as e:
-            logger.error(f"Error in command line response: {str(e)}")
+            logger.error("Error in command line response: %s", e)
             return f"Error: {str(e)}"
 
+def default_model_preference() -> str:
+    """
+    Decide on model preference based on available API keys.
+    
+    Returns:
+        "openai" if an OpenAI key is set, else "gemini" if a Gemini key is set, else "nltk"
+    """
+    if os.environ.get("OPENAI_API_KEY"):
+        logger.info("Using OpenAI as primary model")
+        return "openai"
+    if os.environ.get("GEMINI_API_KEY"):
+        logger.info("Using Gemini as primary model")
+        return "gemini"
+    logger.info("No API keys found, using NLTK rule-based fallback only")
+    return "nltk"
+
+def run_batch_command(args: argparse.Namespace):
+    """Replay a JSONL file (or stdin) through the chatbot and print the summary to stderr."""
+    from batch_runner import run_batch
+    
+    source = sys.stdin if args.batch == '-' else open(args.batch, encoding='utf-8')
+    sink = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    try:
+        summary = run_batch(source, sink, workers=args.workers, model=args.model,
+                            message_field=args.message_field, conversation_field=args.conversation_field)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    
+    latency = summary['latency_ms']
+    print(f"{summary['items']} items ({summary['errors']} errors, {summary['invalid_lines']} invalid lines) "
+          f"in {summary['wall_s']:.1f}s on {summary['workers']} workers: {summary['items_per_s']} items/s, "
+          f"p50 {latency['p50']} ms, p99 {latency['p99']} ms", file=sys.stderr)
+
 # Command-line interface for the chatbot
 def main():
-    """Run the chatbot in command-line mode."""
+    """Run the chatbot in command-line mode, interactively or over a JSONL batch."""
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING").upper())
+    
+    parser = argparse.ArgumentParser(description="Chat with the AI chatbot, or replay a batch of messages")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="answer the JSON lines of FILE ('-' for stdin) instead of chatting")
+    parser.add_argument("--output", metavar="FILE", default="-",
+                        help="where batch responses are written as JSON lines (default: stdout)")
+    parser.add_argument("--workers", type=int, help="batch worker processes (default: one per CPU)")
+    parser.add_argument("--model", choices=["auto", "openai", "gemini", "nltk"],
+                        help="model preference (default: picked from the API keys)")
+    parser.add_argument("--message-field", default="message", help="key of the message in batch lines")
+    parser.add_argument("--conversation-field", default="conversation",
+                        help="key of the conversation id in batch lines; lines without one stand alone")
+    args = parser.parse_args()
+    
+    if args.batch:
+        run_batch_command(args)
+        return
+    
     print("Welcome to the AI Chatbot! Type 'exit' or 'quit' to end the conversation.")
     print("Type 'clear' to clear the conversation history.")
     print("-" * 50)
     
-    chatbot = Chatbot()
+    # Load NLTK corpora before the first message (set NLTK_DOWNLOAD=1 to fetch missing ones)
+    prewarm()
+    
+    chatbot = Chatbot(model_preference=args.model or "auto")
     chat_history = []
     
     while True:
@@ -331,10 +770,7 @@ def main():
         response = chatbot.get_command_line_response(user_input, chat_history)
         
         # Update chat history
-        chat_history.append({
-            'user': user_input,
-            'bot': response
-        })
+        chat_history.append(Exchange(user_input, response))
         
         print(f"\nAI: {response}")
         print("-" * 50)
@@ -0,0 +1,260 @@
+"""
+Token-budgeted context windows for the API models.
+This module packs conversation history newest-first into a prompt token budget and can
+replace older turns with a cached summary.
+"""
+import math
+import hashlib
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from typing import List, Dict, Optional, Callable
+
+logger = logging.getLogger(__name__)
+
+# Tokens added by the chat format for every message (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Rough characters per token for English text when no tokenizer is installed
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+# The window built for the current request or task
+_current_window = contextvars.ContextVar('context_window', default=None)
+
+
+def _load_encoding():
+    """Load tiktoken's encoding if it is installed and its data is available locally."""
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                logger.info("tiktoken unavailable, estimating tokens from length: %s", e)
+                _encoding = None
+            _encoding_loaded = True
+    return _encoding
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in a text.
+
+    Args:
+        text: Text to measure
+
+    Returns:
+        The token count from tiktoken when available, otherwise a length-based estimate
+    """
+    if not text:
+        return 0
+    encoding = _encoding if _encoding_loaded else _load_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def summarize_exchange(exchange: Dict[str, str], max_chars: int = 160) -> str:
+    """
+    Default summarizer: keep the first sentence of the user's message.
+
+    Args:
+        exchange: Dictionary with 'user' and 'bot' messages
+        max_chars: Maximum length of the summary line
+
+    Returns:
+        A one-line summary of the exchange
+    """
+    text = ' '.join(exchange.get('user', '').split())
+    for separator in ('. ', '? ', '! '):
+        index = text.find(separator)
+        if index != -1:
+            text = text[:index + 1]
+    if len(text) > max_chars:
+        text = text[:max_chars - 3] + '...'
+    return f"- The user said: {text}"
+
+
+class ContextWindow:
+    """The messages sent for one request and what they cost."""
+
+    def __init__(self, messages: List[Dict[str, str]], tokens: int, turns: int, summarized_turns: int):
+        """
+        Args:
+            messages: Chat messages to send, system prompt first
+            tokens: Estimated prompt tokens of the messages
+            turns: Number of history exchanges included verbatim
+            summarized_turns: Number of older exchanges folded into the summary
+        """
+        self.messages = messages
+        self.tokens = tokens
+        self.turns = turns
+        self.summarized_turns = summarized_turns
+
+    def to_dict(self) -> Dict[str, int]:
+        """Get the window's statistics."""
+        return {
+            'tokens': self.tokens,
+            'turns': self.turns,
+            'summarized_turns': self.summarized_turns
+        }
+
+
+class ContextBuilder:
+    """
+    Pack conversation history into a prompt token budget.
+
+    Exchanges are added newest first until the next one would not fit.
+    With summaries enabled, the exchanges left out are replaced by a short
+    summary; each exchange's summary line is cached, so a long conversation
+    is only summarized once per exchange.
+    """
+
+    def __init__(self, system_prompt: str, token_budget: int = 3000, summarize: bool = False,
+                 summary_budget: int = 300, summarizer: Optional[Callable[[Dict[str, str]], str]] = None,
+                 summary_cache_size: int = 4096):
+        """
+        Initialize the context builder.
+
+        Args:
+            system_prompt: Instructions sent as the first message
+            token_budget: Maximum estimated prompt tokens per request
+            summarize: Replace exchanges that do not fit with a summary
+            summary_budget: Maximum tokens spent on the summary, taken from the budget
+            summarizer: Callable turning one exchange into a summary line
+            summary_cache_size: Number of summary lines kept in the cache
+        """
+        self.system_prompt = system_prompt
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.summary_budget = summary_budget
+        self.summarizer = summarizer or summarize_exchange
+        self.summary_cache_size = summary_cache_size
+
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._total_tokens = 0
+
+    def build(self, user_input: str, chat_history: Optional[List[Dict[str, str]]] = None) -> ContextWindow:
+        """
+        Build the messages for a request.
+
+        Args:
+            user_input: The user's message
+            chat_history: List of previous exchanges in the conversation, oldest first
+
+        Returns:
+            The context window to send
+        """
+        chat_history = chat_history or []
+        system_tokens = estimate_tokens(self.system_prompt) + MESSAGE_OVERHEAD_TOKENS
+        user_tokens = estimate_tokens(user_input) + MESSAGE_OVERHEAD_TOKENS
+
+        # Leave room for the summary only if there is history to summarize
+        reserved = self.summary_budget if self.summarize and chat_history else 0
+        remaining = self.token_budget - system_tokens - user_tokens - reserved
+
+        # Pack exchanges newest first
+        included = []
+        for exchange in reversed(chat_history):
+            cost = (estimate_tokens(exchange.get('user', '')) + estimate_tokens(exchange.get('bot', ''))
+                    + 2 * MESSAGE_OVERHEAD_TOKENS)
+            if cost > remaining:
+                break
+            included.append(exchange)
+            remaining -= cost
+        included.reverse()
+
+        dropped = chat_history[:len(chat_history) - len(included)]
+        tokens = self.token_budget - remaining - reserved
+
+        messages = [{"role": "system", "content": self.system_prompt}]
+
+        summarized_turns = 0
+        if self.summarize and dropped:
+            summary, summarized_turns = self._summary(dropped)
+            if summary:
+                messages.append({"role": "system", "content": summary})
+                tokens += estimate_tokens(summary) + MESSAGE_OVERHEAD_TOKENS
+
+        for exchange in included:
+            messages.append({"role": "user", "content": exchange.get("user", "")})
+            messages.append({"role": "assistant", "content": exchange.get("bot", "")})
+
+        messages.append({"role": "user", "content": user_input})
+
+        window = ContextWindow(messages, tokens, len(included), summarized_turns)
+        with self._lock:
+            self._requests += 1
+            self._total_tokens += tokens
+        _current_window.set(window)
+        return window
+
+    def _summary_line(self, exchange: Dict[str, str]) -> str:
+        """Get the cached summary line of an exchange."""
+        key = hashlib.sha1(f"{exchange.get('user', '')}\x00{exchange.get('bot', '')}".encode()).hexdigest()
+        with self._lock:
+            line = self._summaries.get(key)
+            if line is not None:
+                self._summaries.move_to_end(key)
+                return line
+
+        line = self.summarizer(exchange)
+
+        with self._lock:
+            self._summaries[key] = line
+            while len(self._summaries) > self.summary_cache_size:
+                self._summaries.popitem(last=False)
+        return line
+
+    def _summary(self, dropped: List[Dict[str, str]]):
+        """Summarize the exchanges left out of the window, newest kept first within the summary budget."""
+        header = "Summary of the earlier conversation:"
+        remaining = self.summary_budget - estimate_tokens(header) - MESSAGE_OVERHEAD_TOKENS
+        lines = []
+        for exchange in reversed(dropped):
+            line = self._summary_line(exchange)
+            cost = estimate_tokens(line) + 1
+            if cost > remaining:
+                break
+            lines.append(line)
+            remaining -= cost
+
+        if not lines:
+            return None, 0
+        lines.reverse()
+        return header + "\n" + "\n".join(lines), len(lines)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get aggregate statistics over every window built.
+
+        Returns:
+            Dictionary with the request count, total and average prompt tokens
+        """
+        with self._lock:
+            requests = self._requests
+            total = self._total_tokens
+        return {
+            'requests': requests,
+            'total_tokens': total,
+            'average_tokens': total / requests if requests else 0.0,
+            'token_budget': self.token_budget
+        }
+
+
+def current_window() -> Optional[ContextWindow]:
+    """Get the context window built for the current request, if any."""
+    return _current_window.get()
+
+
+def reset_current_window():
+    """Forget the current request's context window; call at the start of a request."""
+    _current_window.set(None)
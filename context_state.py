@@ -0,0 +1,132 @@
+"""
+Incremental conversation context for the rule-based fallback.
+This module keeps a small per-conversation summary (topics, recent intents, entity slots)
+that is updated as each exchange is appended, so context rules never rescan the history.
+"""
+import re
+from typing import List, Dict, Optional, Any, Iterable
+
+# Topic -> words that put a user message on that topic; the first topic listed wins
+TOPIC_KEYWORDS = {
+    'weather': ('weather',),
+    'joke': ('joke',)
+}
+
+# Words that mark a message as a follow-up to the previous exchange
+FOLLOW_UP_WORDS = ('why', 'how', 'what about', 'tell me more')
+
+# Slot name -> pattern whose first non-empty group is the slot value, matched on the user's message
+SLOT_PATTERNS = {
+    'name': re.compile(r"\b(?:my name is|call me)\s+([A-Za-z][\w'-]*)", re.IGNORECASE),
+    'location': re.compile(r"\b(?:in|at|from)\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)")
+}
+
+# Number of recent intents kept
+MAX_INTENTS = 5
+
+
+def detect_topic(text: str) -> Optional[str]:
+    """
+    Find the topic of a message.
+
+    Args:
+        text: The user's message
+
+    Returns:
+        The first topic of TOPIC_KEYWORDS the message mentions, or None
+    """
+    lowered = text.lower()
+    for topic, keywords in TOPIC_KEYWORDS.items():
+        if any(keyword in lowered for keyword in keywords):
+            return topic
+    return None
+
+
+def is_follow_up(text: str) -> bool:
+    """Check whether a message asks a follow-up question."""
+    lowered = text.lower()
+    return any(word in lowered for word in FOLLOW_UP_WORDS)
+
+
+class ContextState:
+    """
+    Summary of a conversation, updated once per exchange.
+
+    `topic` is the topic of the latest user message (None if it had none),
+    `last_topic` the most recent topic mentioned at any point, `intents` the
+    intent patterns matched by the latest messages (None where nothing
+    matched) and `slots` the latest value of each entity slot. Updating
+    only looks at the new exchange, so the cost per message does not grow
+    with the length of the conversation.
+    """
+
+    __slots__ = ('turns', 'topic', 'last_topic', 'intents', 'slots')
+
+    def __init__(self, turns: int = 0, topic: Optional[str] = None, last_topic: Optional[str] = None,
+                 intents: Optional[List[Optional[str]]] = None, slots: Optional[Dict[str, str]] = None):
+        self.turns = turns
+        self.topic = topic
+        self.last_topic = last_topic
+        self.intents = intents if intents is not None else []
+        self.slots = slots if slots is not None else {}
+
+    def update(self, user_input: str, response: str, intent: Optional[str] = None):
+        """
+        Fold a new exchange into the state.
+
+        Args:
+            user_input: The user's message
+            response: The chatbot's response
+            intent: Pattern of the intent the message matched, or None
+        """
+        self.turns += 1
+        self.topic = detect_topic(user_input)
+        if self.topic is not None:
+            self.last_topic = self.topic
+
+        self.intents.append(intent)
+        if len(self.intents) > MAX_INTENTS:
+            del self.intents[:-MAX_INTENTS]
+
+        for slot, pattern in SLOT_PATTERNS.items():
+            match = pattern.search(user_input)
+            if match:
+                self.slots[slot] = match.group(1)
+
+    @classmethod
+    def from_history(cls, chat_history: Optional[Iterable[Dict[str, str]]]) -> 'ContextState':
+        """
+        Rebuild the state of a conversation that has none stored, e.g. one started before states were kept.
+
+        Args:
+            chat_history: Previous exchanges, oldest first
+
+        Returns:
+            The state after those exchanges; intents are unknown and left empty
+        """
+        state = cls()
+        for exchange in chat_history or ():
+            state.update(exchange.get('user', ''), exchange.get('bot', ''))
+        state.intents.clear()
+        return state
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get a JSON-serializable copy of the state."""
+        return {
+            'turns': self.turns,
+            'topic': self.topic,
+            'last_topic': self.last_topic,
+            'intents': list(self.intents),
+            'slots': dict(self.slots)
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ContextState':
+        """Restore a state saved with to_dict()."""
+        return cls(
+            turns=data.get('turns', 0),
+            topic=data.get('topic'),
+            last_topic=data.get('last_topic'),
+            intents=list(data.get('intents') or []),
+            slots=dict(data.get('slots') or {})
+        )
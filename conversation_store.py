@@ -0,0 +1,274 @@
+"""
+Server-side storage for conversation history.
+This module contains the store interface, an in-memory backend for tests and a SQLite default,
+so sessions only need to carry a conversation id.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from collections import defaultdict
+from typing import List, Dict, Optional, Any, Iterable, Union
+
+from exchange import Exchange
+
+logger = logging.getLogger(__name__)
+
+class ConversationStore:
+    """
+    Interface for conversation history backends.
+
+    Exchanges are returned as Exchange records, oldest first; they are
+    appended as exchanges or dictionaries with 'user' and 'bot' keys.
+    Each conversation can also keep a context state (a JSON-serializable
+    dictionary), saved together with the exchange that produced it.
+    """
+
+    def create(self) -> str:
+        """Create a new conversation id."""
+        return uuid.uuid4().hex
+
+    def append(self, conversation_id: str, exchange: Union[Exchange, Dict[str, str]],
+               context: Optional[Dict[str, Any]] = None):
+        """
+        Add an exchange to the end of a conversation.
+
+        Args:
+            conversation_id: The conversation to extend
+            exchange: Exchange or dictionary with 'user' and 'bot' messages
+            context: Context state after the exchange, replacing the stored one; None keeps it
+        """
+        raise NotImplementedError
+
+    def extend(self, conversation_id: str, exchanges: Iterable[Union[Exchange, Dict[str, str]]]):
+        """
+        Add several exchanges to the end of a conversation, keeping its context state.
+
+        Args:
+            conversation_id: The conversation to extend
+            exchanges: Exchanges or dictionaries with 'user' and 'bot' messages, oldest first
+        """
+        for exchange in exchanges:
+            self.append(conversation_id, exchange)
+
+    def context(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the context state saved with a conversation's latest exchange.
+
+        Args:
+            conversation_id: The conversation to read
+
+        Returns:
+            The state, or None if none was saved
+        """
+        raise NotImplementedError
+
+    def page(self, conversation_id: str, offset: int = 0, limit: int = 50) -> List[Exchange]:
+        """
+        Get a slice of a conversation, oldest first.
+
+        Args:
+            conversation_id: The conversation to read
+            offset: Number of exchanges to skip from the start
+            limit: Maximum number of exchanges to return
+
+        Returns:
+            The exchanges in the requested range
+        """
+        raise NotImplementedError
+
+    def recent(self, conversation_id: str, limit: int) -> List[Exchange]:
+        """
+        Get the last exchanges of a conversation, oldest first.
+
+        Args:
+            conversation_id: The conversation to read
+            limit: Maximum number of exchanges to return
+
+        Returns:
+            Up to `limit` of the most recent exchanges
+        """
+        total = self.count(conversation_id)
+        return self.page(conversation_id, max(total - limit, 0), limit)
+
+    def count(self, conversation_id: str) -> int:
+        """Get the number of exchanges in a conversation."""
+        raise NotImplementedError
+
+    def clear(self, conversation_id: str):
+        """Delete every exchange of a conversation."""
+        raise NotImplementedError
+
+
+class InMemoryConversationStore(ConversationStore):
+    """Keep conversations in a process-local dictionary; intended for tests and development."""
+
+    def __init__(self):
+        self._conversations: Dict[str, List[Exchange]] = defaultdict(list)
+        self._contexts: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def append(self, conversation_id: str, exchange: Union[Exchange, Dict[str, str]],
+               context: Optional[Dict[str, Any]] = None):
+        with self._lock:
+            # Exchanges are never modified in place, so the stored record can be shared with readers
+            self._conversations[conversation_id].append(Exchange.from_dict(exchange))
+            if context is not None:
+                self._contexts[conversation_id] = json.loads(json.dumps(context))
+
+    def context(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            context = self._contexts.get(conversation_id)
+            return json.loads(json.dumps(context)) if context is not None else None
+
+    def extend(self, conversation_id: str, exchanges: Iterable[Union[Exchange, Dict[str, str]]]):
+        exchanges = [Exchange.from_dict(exchange) for exchange in exchanges]
+        with self._lock:
+            self._conversations[conversation_id].extend(exchanges)
+
+    def page(self, conversation_id: str, offset: int = 0, limit: int = 50) -> List[Exchange]:
+        with self._lock:
+            exchanges = self._conversations.get(conversation_id, [])
+            return exchanges[offset:offset + limit]
+
+    def count(self, conversation_id: str) -> int:
+        with self._lock:
+            return len(self._conversations.get(conversation_id, []))
+
+    def clear(self, conversation_id: str):
+        with self._lock:
+            self._conversations.pop(conversation_id, None)
+            self._contexts.pop(conversation_id, None)
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    Keep conversations in a SQLite database.
+
+    Each thread gets its own connection, and the database runs in WAL mode so
+    several worker processes can share one file.
+    """
+
+    def __init__(self, path: str = "conversations.db"):
+        """
+        Open (and if needed create) the database.
+
+        Args:
+            path: Database file path
+        """
+        self.path = path
+        self._local = threading.local()
+
+        # The schema is set up on a connection of its own, so none is left open when a preloading server forks
+        connection = sqlite3.connect(path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS exchanges (
+                conversation_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                user TEXT NOT NULL,
+                bot TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (conversation_id, seq)
+            )
+        """)
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS contexts (
+                conversation_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL
+            )
+        """)
+        connection.commit()
+        connection.close()
+        logger.info("Conversation store opened at %s", path)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def append(self, conversation_id: str, exchange: Union[Exchange, Dict[str, str]],
+               context: Optional[Dict[str, Any]] = None):
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                """
+                INSERT INTO exchanges (conversation_id, seq, user, bot, created_at)
+                SELECT ?, COALESCE(MAX(seq) + 1, 0), ?, ?, ?
+                FROM exchanges WHERE conversation_id = ?
+                """,
+                (conversation_id, exchange.get('user', ''), exchange.get('bot', ''), time.time(), conversation_id)
+            )
+            if context is not None:
+                connection.execute(
+                    "INSERT OR REPLACE INTO contexts (conversation_id, state) VALUES (?, ?)",
+                    (conversation_id, json.dumps(context))
+                )
+
+    def context(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            "SELECT state FROM contexts WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def extend(self, conversation_id: str, exchanges: Iterable[Union[Exchange, Dict[str, str]]]):
+        connection = self._connection()
+        with connection:
+            row = connection.execute(
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM exchanges WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+            now = time.time()
+            connection.executemany(
+                "INSERT INTO exchanges (conversation_id, seq, user, bot, created_at) VALUES (?, ?, ?, ?, ?)",
+                ((conversation_id, seq, exchange.get('user', ''), exchange.get('bot', ''), now)
+                 for seq, exchange in enumerate(exchanges, row[0]))
+            )
+
+    def page(self, conversation_id: str, offset: int = 0, limit: int = 50) -> List[Exchange]:
+        rows = self._connection().execute(
+            "SELECT user, bot FROM exchanges WHERE conversation_id = ? ORDER BY seq LIMIT ? OFFSET ?",
+            (conversation_id, limit, offset)
+        ).fetchall()
+        return [Exchange(user, bot) for user, bot in rows]
+
+    def recent(self, conversation_id: str, limit: int) -> List[Exchange]:
+        rows = self._connection().execute(
+            "SELECT user, bot FROM exchanges WHERE conversation_id = ? ORDER BY seq DESC LIMIT ?",
+            (conversation_id, limit)
+        ).fetchall()
+        return [Exchange(user, bot) for user, bot in reversed(rows)]
+
+    def count(self, conversation_id: str) -> int:
+        row = self._connection().execute(
+            "SELECT COUNT(*) FROM exchanges WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        return row[0]
+
+    def clear(self, conversation_id: str):
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM exchanges WHERE conversation_id = ?", (conversation_id,))
+            connection.execute("DELETE FROM contexts WHERE conversation_id = ?", (conversation_id,))
+
+
+def create_store(location: Optional[str] = None) -> ConversationStore:
+    """
+    Create the conversation store configured by the CONVERSATION_STORE environment variable.
+
+    Args:
+        location: "memory" for the in-memory backend, otherwise a SQLite file path
+
+    Returns:
+        The conversation store
+    """
+    location = location or os.environ.get("CONVERSATION_STORE", "conversations.db")
+    if location == "memory":
+        return InMemoryConversationStore()
+    return SQLiteConversationStore(location)
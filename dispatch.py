@@ -0,0 +1,797 @@
+"""
+Deadline-bounded dispatch across the model backends.
+This module contains a circuit breaker per backend and a dispatcher that falls back on errors,
+error responses and missed deadlines, optionally hedging a slow request onto the next backend.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Dict, Optional, Callable, Iterable, Iterator, AsyncIterator, Awaitable, Tuple, Any
+
+from response_cache import ErrorResponse
+from instrumentation import observe_stage
+from rate_limit import AdmissionGate, Overloaded, create_admission_gates
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def _adopt(context: contextvars.Context):
+    """Copy the context variables a finished call set (e.g. its context window) into the caller's context."""
+    for variable, value in context.items():
+        if variable.get(None) is not value:
+            variable.set(value)
+
+
+def _close(chunks: Optional[Iterator[str]], release: Callable[..., None]):
+    """Close a backend's stream, so it drops its connection, and free its admission slot."""
+    try:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+    except Exception as e:
+        logger.debug("Error closing an abandoned stream: %s", e)
+    finally:
+        release()
+
+
+async def _aclose(chunks: Optional[AsyncIterator[str]], release: Callable[..., None]):
+    """Close a backend's async stream and free its admission slot."""
+    try:
+        aclose = getattr(chunks, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+    except Exception as e:
+        logger.debug("Error closing an abandoned stream: %s", e)
+    finally:
+        release()
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests to a backend that keeps failing or is too slow.
+
+    Outcomes of the last `window` calls are kept. Once at least `min_calls`
+    are recorded, the circuit opens when the share of failures (errors,
+    error responses and timeouts) or of calls slower than `slow_call_s`
+    reaches `failure_rate`. An open circuit rejects calls for `cooldown`
+    seconds, then lets a single probe through; its outcome closes or
+    reopens the circuit.
+    """
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 5, failure_rate: float = 0.5,
+                 slow_call_s: Optional[float] = None, cooldown: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the circuit breaker.
+
+        Args:
+            name: Backend name, used in logs
+            window: Number of recent calls considered
+            min_calls: Calls needed before the circuit can open
+            failure_rate: Share of failed or slow calls that opens the circuit
+            slow_call_s: Latency above which a successful call counts as slow, or None to ignore latency
+            cooldown: Seconds the circuit stays open before a probe is allowed
+            clock: Monotonic time source
+        """
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_s = slow_call_s
+        self.cooldown = cooldown
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)  # (succeeded, latency)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._calls = 0
+        self._failures = 0
+        self._rejected = 0
+        self._opened = 0
+
+    @property
+    def state(self) -> str:
+        """Get the circuit state, moving an expired open circuit to half-open."""
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        """Get the circuit state; the caller holds the lock."""
+        if self._state == OPEN and self.clock() - self._opened_at >= self.cooldown:
+            self._state = HALF_OPEN
+            self._probing = False
+        return self._state
+
+    def allow(self) -> bool:
+        """
+        Check whether a call may be sent to the backend.
+
+        Returns:
+            True if the circuit is closed, or half-open and no probe is in flight
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record(self, succeeded: bool, latency: float):
+        """
+        Record the outcome of a call.
+
+        Args:
+            succeeded: Whether the backend returned a usable response in time
+            latency: Seconds the call took
+        """
+        with self._lock:
+            self._calls += 1
+            if not succeeded:
+                self._failures += 1
+
+            if self._state == HALF_OPEN:
+                self._probing = False
+                if succeeded:
+                    logger.info("Circuit for %s closed after a successful probe", self.name)
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._trip()
+                    return
+
+            self._outcomes.append((succeeded, latency))
+            if self._state == CLOSED and len(self._outcomes) >= self.min_calls:
+                failed = sum(1 for ok, elapsed in self._outcomes if not ok or self._is_slow(elapsed))
+                if failed / len(self._outcomes) >= self.failure_rate:
+                    self._trip()
+
+    def _is_slow(self, latency: float) -> bool:
+        """Check whether a latency counts as a slow call."""
+        return self.slow_call_s is not None and latency > self.slow_call_s
+
+    def _trip(self):
+        """Open the circuit; the caller holds the lock."""
+        logger.warning("Circuit for %s opened, skipping it for %.0fs", self.name, self.cooldown)
+        self._state = OPEN
+        self._opened_at = self.clock()
+        self._opened += 1
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        """
+        Get a latency percentile of the recent successful calls.
+
+        Args:
+            percentile: Percentile between 0 and 100
+
+        Returns:
+            Latency in seconds, or None with fewer than `min_calls` successful calls
+        """
+        with self._lock:
+            latencies = sorted(elapsed for ok, elapsed in self._outcomes if ok)
+        if len(latencies) < self.min_calls:
+            return None
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        return latencies[index]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the breaker's statistics.
+
+        Returns:
+            Dictionary with the state, counters, recent failure rate and p95 latency
+        """
+        p95 = self.latency_percentile(95)
+        with self._lock:
+            recent = len(self._outcomes)
+            recent_failures = sum(1 for ok, _ in self._outcomes if not ok)
+            return {
+                'state': self._current_state(),
+                'calls': self._calls,
+                'failures': self._failures,
+                'rejected': self._rejected,
+                'opened': self._opened,
+                'recent_failure_rate': recent_failures / recent if recent else 0.0,
+                'p95_latency_s': p95
+            }
+
+
+class Dispatcher:
+    """
+    Send a request to the backends in fallback order, within deadlines.
+
+    A backend fails over when it raises, returns an ErrorResponse, misses
+    its deadline, has an open circuit or has no free admission slot. Local
+    backends (the knowledge base and the rule-based fallback) run inline
+    without a deadline, breaker or gate, and may decline a message by
+    returning None. If every remote backend was skipped for lack of a
+    slot, Overloaded is raised rather than answering from a local backend,
+    unless `shed_to_local` is set. A slot is held until the upstream call
+    ends, even if the dispatcher stopped waiting for it. In hedged mode,
+    once the first backend has been running for its recent p95 latency the
+    next backend is started too, and whichever succeeds first answers.
+    Blocking calls run on a shared thread pool so the caller can stop
+    waiting; a call that misses its deadline is abandoned, not interrupted.
+    """
+
+    def __init__(self, deadlines: Optional[Dict[str, float]] = None, default_deadline: float = 20.0,
+                 hedge: bool = False, local_backends: Iterable[str] = ('kb', 'nltk'), max_workers: int = 32,
+                 cooldown: float = 30.0, breaker_factory: Optional[Callable[[str], CircuitBreaker]] = None,
+                 gates: Optional[Dict[str, AdmissionGate]] = None, shed_to_local: bool = False):
+        """
+        Initialize the dispatcher.
+
+        Args:
+            deadlines: Backend name -> seconds allowed for a response (or the first streamed chunk)
+            default_deadline: Deadline of backends missing from `deadlines`
+            hedge: Start the next backend when the first one exceeds its p95 latency
+            local_backends: Backends run inline, without deadline or circuit breaker; they may return None to decline
+            max_workers: Threads running blocking backend calls
+            cooldown: Seconds a tripped circuit stays open
+            breaker_factory: Callable building the breaker of a backend; by default calls slower
+                than half the deadline count as slow
+            gates: Backend name -> admission gate bounding its calls in flight; others are unbounded
+            shed_to_local: Answer from a local backend instead of raising Overloaded when every
+                remote backend is at capacity
+        """
+        self.deadlines = dict(deadlines or {})
+        self.default_deadline = default_deadline
+        self.hedge = hedge
+        self.local_backends = frozenset(local_backends)
+        self.max_workers = max_workers
+        self.cooldown = cooldown
+        self.breaker_factory = breaker_factory or self._default_breaker
+        self.gates = dict(gates or {})
+        self.shed_to_local = shed_to_local
+
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._timeouts = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+
+    def _default_breaker(self, backend: str) -> CircuitBreaker:
+        """Build a breaker treating calls slower than half the deadline as slow."""
+        return CircuitBreaker(backend, slow_call_s=self.deadline(backend) / 2, cooldown=self.cooldown)
+
+    def deadline(self, backend: str) -> float:
+        """Get the deadline of a backend in seconds."""
+        return self.deadlines.get(backend, self.default_deadline)
+
+    def breaker(self, backend: str) -> CircuitBreaker:
+        """Get the circuit breaker of a backend, building it on first use."""
+        breaker = self._breakers.get(backend)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(backend, self.breaker_factory(backend))
+        return breaker
+
+    def _pool(self) -> ThreadPoolExecutor:
+        """Get the thread pool for blocking calls, creating it on first use."""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='dispatch')
+        return self._executor
+
+    def _count(self, counter: str):
+        """Increment one of the dispatch counters."""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _hedge_at(self, backend: str, started: float) -> Optional[float]:
+        """Get the time to start a hedged request next to a backend's call, if hedging applies."""
+        if not self.hedge:
+            return None
+        p95 = self.breaker(backend).latency_percentile(95)
+        return None if p95 is None else started + p95
+
+    def _next_remote(self, pending: List[str], refused: List[str], wait: bool = True) -> Optional[str]:
+        """
+        Pop the next remote backend whose circuit allows a call and take one of its admission slots.
+
+        Args:
+            pending: Backends not tried yet, in fallback order
+            refused: Collects the backends skipped for lack of a slot
+            wait: Queue for a slot if the gate allows it; the asyncio paths never wait
+
+        Returns:
+            The backend, or None if the next backend is local or none is left
+        """
+        while pending and pending[0] not in self.local_backends:
+            backend = pending.pop(0)
+            breaker = self.breaker(backend)
+            if breaker.state == OPEN:
+                logger.info("Circuit for %s is open, skipping it", backend)
+                continue
+            gate = self.gates.get(backend)
+            if gate is not None and not gate.acquire(wait):
+                logger.info("%s is at capacity, skipping it", backend)
+                refused.append(backend)
+                continue
+            if breaker.allow():
+                return backend
+            if gate is not None:
+                gate.release()
+            logger.info("Circuit for %s is open, skipping it", backend)
+        return None
+
+    def _slot(self, backend: str) -> Callable[..., None]:
+        """Get a callable freeing the admission slot of a backend's call; calls after the first do nothing."""
+        gate = self.gates.get(backend)
+        if gate is None:
+            return lambda *args: None
+        once = threading.Lock()
+
+        def release(*args):
+            if once.acquire(blocking=False):
+                gate.release()
+        return release
+
+    def _check_capacity(self, refused: List[str], attempted: bool):
+        """Raise Overloaded before falling back locally if every remote backend was refused a slot."""
+        if not refused or attempted or self.shed_to_local:
+            return
+        latencies = [self.breaker(backend).latency_percentile(50) for backend in refused]
+        known = [latency for latency in latencies if latency is not None]
+        raise Overloaded(min(known) if known else 1.0)
+
+    def _record(self, backend: str, succeeded: bool, started: float, stage: str = 'backend_call'):
+        """Record a call's latency, and its outcome in the backend's breaker; local backends have none."""
+        latency = time.monotonic() - started
+        observe_stage(stage, latency, backend)
+        if backend not in self.local_backends:
+            self.breaker(backend).record(succeeded, latency)
+
+    def _settle(self, backend: str, started: float, outcome: Callable[[], str]) -> Tuple[bool, Optional[str]]:
+        """Record a finished call in its breaker; return whether it succeeded and its response."""
+        try:
+            response = outcome()
+        except Exception as e:
+            logger.error("Error with %s model: %s, falling back to alternative", backend, e)
+            self._record(backend, False, started)
+            return False, None
+        if response is None and backend in self.local_backends:
+            logger.debug("%s has no answer, trying the next backend", backend)
+            self._record(backend, False, started)
+            return False, None
+        if isinstance(response, ErrorResponse):
+            logger.warning("%s model returned an error, falling back to alternative", backend)
+            self._record(backend, False, started)
+            return False, response
+        self._record(backend, True, started)
+        return True, response
+
+    def _submit(self, contexts: Dict[Any, contextvars.Context], invoke: Callable[[str], str], backend: str):
+        """Run a blocking call on the pool in a copy of the caller's context."""
+        context = contextvars.copy_context()
+        future = self._pool().submit(context.run, invoke, backend)
+        future.add_done_callback(self._slot(backend))
+        contexts[future] = context
+        return future
+
+    def _create_task(self, contexts: Dict[Any, contextvars.Context], invoke: Callable[[str], Awaitable[str]],
+                     backend: str) -> 'asyncio.Task':
+        """Start a coroutine call as a task in a copy of the caller's context."""
+        context = contextvars.copy_context()
+        task = asyncio.get_running_loop().create_task(invoke(backend), context=context)
+        task.add_done_callback(self._slot(backend))
+        contexts[task] = context
+        return task
+
+    def _record_late(self, backend: str, started: float, future):
+        """Record the outcome of a call abandoned after another backend answered."""
+        self._settle(backend, started, future.result)
+
+    def call(self, order: List[str], invoke: Callable[[str], str]) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Get a response from the first backend that answers in time.
+
+        Args:
+            order: Backend names in fallback order
+            invoke: Callable sending the request to a backend and returning its response
+
+        Returns:
+            Tuple of the backend that answered and its response; if every backend
+            failed, None and the last error response (None if there was none)
+
+        Raises:
+            Overloaded: If every remote backend was at capacity
+        """
+        pending = list(order)
+        in_flight = {}  # future -> (backend, started, deadline_at)
+        contexts = {}  # future -> context the call runs in
+        last_error = None
+        hedged = None  # backend started as a hedge, False once hedging was considered
+        refused = []  # remote backends without a free admission slot
+        attempted = False
+
+        while True:
+            if not in_flight:
+                if not pending:
+                    self._check_capacity(refused, attempted)
+                    return None, last_error
+                if pending[0] in self.local_backends:
+                    self._check_capacity(refused, attempted)
+                    backend = pending.pop(0)
+                    succeeded, response = self._settle(backend, time.monotonic(), lambda: invoke(backend))
+                    if succeeded:
+                        return backend, response
+                    last_error = response or last_error
+                    continue
+                backend = self._next_remote(pending, refused)
+                if backend is None:
+                    continue
+                attempted = True
+                started = time.monotonic()
+                in_flight[self._submit(contexts, invoke, backend)] = (backend, started, started + self.deadline(backend))
+
+            now = time.monotonic()
+            wake_at = min(deadline_at for _, _, deadline_at in in_flight.values())
+            hedge_at = None
+            if hedged is None and len(in_flight) == 1 and pending:
+                backend, started, _ = next(iter(in_flight.values()))
+                hedge_at = self._hedge_at(backend, started)
+                if hedge_at is not None:
+                    wake_at = min(wake_at, hedge_at)
+
+            done, _ = wait(list(in_flight), timeout=max(0.0, wake_at - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                backend, started, _ = in_flight.pop(future)
+                succeeded, response = self._settle(backend, started, future.result)
+                if succeeded:
+                    _adopt(contexts[future])
+                    if backend == hedged:
+                        self._count('_hedge_wins')
+                    for other, (other_backend, other_started, _) in in_flight.items():
+                        other.add_done_callback(
+                            lambda f, b=other_backend, s=other_started: self._record_late(b, s, f))
+                    return backend, response
+                last_error = response or last_error
+
+            now = time.monotonic()
+            for future, (backend, started, deadline_at) in list(in_flight.items()):
+                if now >= deadline_at:
+                    logger.warning("%s model missed its %.1fs deadline, falling back to alternative",
+                                   backend, self.deadline(backend))
+                    del in_flight[future]
+                    future.cancel()
+                    self._record(backend, False, started)
+                    self._count('_timeouts')
+
+            if hedge_at is not None and now >= hedge_at and len(in_flight) == 1:
+                # A hedge is optional, so it never waits for a slot
+                backend = self._next_remote(pending, [], wait=False)
+                hedged = backend or False
+                if backend is not None:
+                    logger.info("Hedging slow request onto %s", backend)
+                    self._count('_hedges')
+                    started = time.monotonic()
+                    in_flight[self._submit(contexts, invoke, backend)] = (backend, started, started + self.deadline(backend))
+
+    async def call_async(self, order: List[str], invoke: Callable[[str], Awaitable[str]],
+                         invoke_local: Callable[[str], str]) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Get a response from the first backend that answers in time, without blocking the event loop.
+
+        Args:
+            order: Backend names in fallback order
+            invoke: Coroutine function sending the request to a remote backend
+            invoke_local: Callable answering from a local backend
+
+        Returns:
+            Tuple of the backend that answered and its response; if every backend
+            failed, None and the last error response (None if there was none)
+
+        Raises:
+            Overloaded: If every remote backend was at capacity
+        """
+        pending = list(order)
+        in_flight = {}  # task -> (backend, started, deadline_at)
+        contexts = {}  # task -> context the call runs in
+        last_error = None
+        hedged = None  # backend started as a hedge, False once hedging was considered
+        refused = []  # remote backends without a free admission slot
+        attempted = False
+
+        try:
+            while True:
+                if not in_flight:
+                    if not pending:
+                        self._check_capacity(refused, attempted)
+                        return None, last_error
+                    if pending[0] in self.local_backends:
+                        self._check_capacity(refused, attempted)
+                        backend = pending.pop(0)
+                        succeeded, response = self._settle(backend, time.monotonic(), lambda: invoke_local(backend))
+                        if succeeded:
+                            return backend, response
+                        last_error = response or last_error
+                        continue
+                    # Waiting for a slot would block the event loop, so a full backend is skipped at once
+                    backend = self._next_remote(pending, refused, wait=False)
+                    if backend is None:
+                        continue
+                    attempted = True
+                    started = time.monotonic()
+                    in_flight[self._create_task(contexts, invoke, backend)] = (backend, started, started + self.deadline(backend))
+
+                now = time.monotonic()
+                wake_at = min(deadline_at for _, _, deadline_at in in_flight.values())
+                hedge_at = None
+                if hedged is None and len(in_flight) == 1 and pending:
+                    backend, started, _ = next(iter(in_flight.values()))
+                    hedge_at = self._hedge_at(backend, started)
+                    if hedge_at is not None:
+                        wake_at = min(wake_at, hedge_at)
+
+                done, _ = await asyncio.wait(list(in_flight), timeout=max(0.0, wake_at - now),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    backend, started, _ = in_flight.pop(task)
+                    succeeded, response = self._settle(backend, started, task.result)
+                    if succeeded:
+                        _adopt(contexts[task])
+                        if backend == hedged:
+                            self._count('_hedge_wins')
+                        return backend, response
+                    last_error = response or last_error
+
+                now = time.monotonic()
+                for task, (backend, started, deadline_at) in list(in_flight.items()):
+                    if now >= deadline_at:
+                        logger.warning("%s model missed its %.1fs deadline, falling back to alternative",
+                                       backend, self.deadline(backend))
+                        del in_flight[task]
+                        task.cancel()
+                        self._record(backend, False, started)
+                        self._count('_timeouts')
+
+                if hedge_at is not None and now >= hedge_at and len(in_flight) == 1:
+                    backend = self._next_remote(pending, [], wait=False)
+                    hedged = backend or False
+                    if backend is not None:
+                        logger.info("Hedging slow request onto %s", backend)
+                        self._count('_hedges')
+                        started = time.monotonic()
+                        in_flight[self._create_task(contexts, invoke, backend)] = (backend, started, started + self.deadline(backend))
+        finally:
+            # Coroutines can be cancelled, so the losers of a hedge stop here
+            for task in in_flight:
+                task.cancel()
+
+    def stream(self, order: List[str], open_stream: Callable[[str], Iterator[str]]) -> Iterator[Tuple[str, str]]:
+        """
+        Stream a response from the first backend whose first chunk arrives in time.
+
+        Backends fail over until one produces a first chunk that is not an
+        ErrorResponse; after that, chunks are passed through as they come.
+
+        Args:
+            order: Backend names in fallback order
+            open_stream: Callable starting a backend's stream
+
+        Yields:
+            Tuples of the backend and a chunk of its response
+
+        Raises:
+            Overloaded: If every remote backend was at capacity
+        """
+        last_error = None
+        pending = list(order)
+        refused = []  # remote backends without a free admission slot
+        attempted = False
+        while pending:
+            if pending[0] in self.local_backends:
+                self._check_capacity(refused, attempted)
+                backend = pending.pop(0)
+                timeout = None
+            else:
+                backend = self._next_remote(pending, refused)
+                if backend is None:
+                    continue
+                attempted = True
+                timeout = self.deadline(backend)
+
+            # The admission slot is held until the stream ends or is abandoned
+            release = self._slot(backend)
+            started = time.monotonic()
+            chunks = future = None
+            try:
+                chunks = iter(open_stream(backend))
+                if timeout is None:
+                    first = next(chunks, None)
+                else:
+                    # The generator is advanced on a pool thread only for its first chunk
+                    context = contextvars.copy_context()
+                    future = self._pool().submit(context.run, next, chunks, None)
+                    first = future.result(timeout=timeout)
+                    _adopt(context)
+            except Exception as e:
+                if future is not None and not future.done():
+                    logger.warning("%s model missed its %.1fs deadline, falling back to alternative",
+                                   backend, timeout)
+                    self._count('_timeouts')
+                else:
+                    # Includes socket timeouts raised by the backend itself
+                    logger.error("Error with %s model: %s, falling back to alternative", backend, e)
+                if future is None:
+                    _close(chunks, release)
+                else:
+                    # The abandoned stream still holds its connection until its first chunk arrives
+                    future.add_done_callback(lambda _, chunks=chunks, release=release: _close(chunks, release))
+                self._record(backend, False, started, 'backend_first_chunk')
+                continue
+
+            if first is None and timeout is None:
+                logger.debug("%s has no answer, trying the next backend", backend)
+                self._record(backend, False, started, 'backend_first_chunk')
+                continue
+
+            if first is None or isinstance(first, ErrorResponse):
+                _close(chunks, release)
+                last_error = first or last_error
+                self._record(backend, False, started, 'backend_first_chunk')
+                logger.warning("%s model returned an error, falling back to alternative", backend)
+                continue
+
+            self._record(backend, True, started, 'backend_first_chunk')
+            try:
+                yield backend, first
+                for chunk in chunks:
+                    yield backend, chunk
+            finally:
+                # A consumer that stops early leaves the stream open until it is closed here
+                _close(chunks, release)
+            return
+
+        self._check_capacity(refused, attempted)
+
+        if last_error is not None:
+            yield None, last_error
+
+    async def stream_async(self, order: List[str], open_stream: Callable[[str], AsyncIterator[str]],
+                           invoke_local: Callable[[str], str]) -> AsyncIterator[Tuple[str, str]]:
+        """
+        Stream a response from the first backend whose first chunk arrives in time, without blocking.
+
+        Args:
+            order: Backend names in fallback order
+            open_stream: Callable starting a remote backend's async stream
+            invoke_local: Callable answering from a local backend
+
+        Yields:
+            Tuples of the backend and a chunk of its response
+
+        Raises:
+            Overloaded: If every remote backend was at capacity
+        """
+        last_error = None
+        pending = list(order)
+        refused = []  # remote backends without a free admission slot
+        attempted = False
+        while pending:
+            if pending[0] in self.local_backends:
+                self._check_capacity(refused, attempted)
+                backend = pending.pop(0)
+                succeeded, response = self._settle(backend, time.monotonic(), lambda: invoke_local(backend))
+                if succeeded:
+                    yield backend, response
+                    return
+                last_error = response or last_error
+                continue
+
+            backend = self._next_remote(pending, refused, wait=False)
+            if backend is None:
+                continue
+            attempted = True
+
+            # The admission slot is held until the stream ends or is cancelled
+            release = self._slot(backend)
+            started = time.monotonic()
+            chunks = None
+            try:
+                chunks = open_stream(backend).__aiter__()
+                context = contextvars.copy_context()
+                first = await asyncio.wait_for(asyncio.get_running_loop().create_task(chunks.__anext__(), context=context),
+                                               self.deadline(backend))
+                _adopt(context)
+            except StopAsyncIteration:
+                first = None
+            except asyncio.TimeoutError:
+                await _aclose(chunks, release)
+                logger.warning("%s model missed its %.1fs deadline, falling back to alternative",
+                               backend, self.deadline(backend))
+                self._count('_timeouts')
+                self._record(backend, False, started, 'backend_first_chunk')
+                continue
+            except Exception as e:
+                await _aclose(chunks, release)
+                logger.error("Error with %s model: %s, falling back to alternative", backend, e)
+                self._record(backend, False, started, 'backend_first_chunk')
+                continue
+
+            if first is None or isinstance(first, ErrorResponse):
+                await _aclose(chunks, release)
+                last_error = first or last_error
+                self._record(backend, False, started, 'backend_first_chunk')
+                logger.warning("%s model returned an error, falling back to alternative", backend)
+                continue
+
+            self._record(backend, True, started, 'backend_first_chunk')
+            try:
+                yield backend, first
+                async for chunk in chunks:
+                    yield backend, chunk
+            finally:
+                await _aclose(chunks, release)
+            return
+
+        self._check_capacity(refused, attempted)
+        if last_error is not None:
+            yield None, last_error
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get dispatch statistics.
+
+        Returns:
+            Dictionary with timeout and hedge counters and each backend's breaker statistics
+        """
+        with self._lock:
+            breakers = dict(self._breakers)
+            stats = {
+                'timeouts': self._timeouts,
+                'hedge': self.hedge,
+                'hedges': self._hedges,
+                'hedge_wins': self._hedge_wins
+            }
+        stats['backends'] = {name: dict(breaker.stats(), deadline_s=self.deadline(name))
+                             for name, breaker in breakers.items()}
+        stats['admission'] = {name: gate.stats() for name, gate in self.gates.items()}
+        return stats
+
+
+def create_dispatcher() -> Dispatcher:
+    """
+    Create the dispatcher configured by environment variables.
+
+    BACKEND_TIMEOUT sets the deadline of every API backend and
+    BACKEND_TIMEOUT_OPENAI / BACKEND_TIMEOUT_GEMINI override it per backend;
+    DISPATCH_HEDGE=1 enables hedged requests and CIRCUIT_COOLDOWN sets how
+    long a tripped circuit stays open. Admission gates are configured as
+    described in create_admission_gates(); ADMISSION_FALLBACK=1 answers
+    from the rule-based fallback instead of rejecting when they are full.
+
+    Returns:
+        The dispatcher
+    """
+    default_deadline = float(os.environ.get("BACKEND_TIMEOUT", "20"))
+    deadlines = {}
+    for backend in ('openai', 'gemini'):
+        value = os.environ.get(f"BACKEND_TIMEOUT_{backend.upper()}")
+        if value:
+            deadlines[backend] = float(value)
+
+    return Dispatcher(
+        deadlines=deadlines,
+        default_deadline=default_deadline,
+        hedge=os.environ.get("DISPATCH_HEDGE", "").lower() in ("1", "true", "yes"),
+        cooldown=float(os.environ.get("CIRCUIT_COOLDOWN", "30")),
+        gates=create_admission_gates(),
+        shed_to_local=os.environ.get("ADMISSION_FALLBACK", "").lower() in ("1", "true", "yes")
+    )
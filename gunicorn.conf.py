@@ -0,0 +1,77 @@
+"""
+Production serving profile for the Flask app.
+Run `gunicorn` from the project directory: this file is picked up automatically. The app is
+loaded once in the master, the NLTK corpora, intent catalog and knowledge base are warmed there,
+and workers fork from it so they share those tables copy-on-write instead of each loading its own.
+
+Environment overrides: PORT, WEB_CONCURRENCY (workers), GUNICORN_THREADS, GUNICORN_PRELOAD=0,
+GUNICORN_TIMEOUT and GUNICORN_MAX_REQUESTS.
+"""
+import os
+import gc
+import random
+
+
+def _cpu_count() -> int:
+    """Count the CPUs this process may run on, which respects container CPU sets."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+wsgi_app = "app:app"
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# One process per CPU runs the rule-based path (which holds the GIL) in parallel;
+# threads cover the time requests spend waiting on OpenAI or Gemini
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY") or _cpu_count())
+# Exported so the app sees the worker count, e.g. to keep per-process caches off shared files
+os.environ["WEB_CONCURRENCY"] = str(workers)
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1").lower() not in ("0", "false", "no")
+
+# Backends get BACKEND_TIMEOUT (20s by default) each, so allow for a fallback after a slow first try
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers after this many requests to bound the growth of per-process caches; 0 disables
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+
+def _prewarm():
+    """Load the NLTK corpora, the intent catalog and the knowledge base so no request pays for them."""
+    from nltk_resources import prewarm
+    from intent_catalog import shared_catalog
+    from knowledge_base import shared_knowledge_base
+
+    prewarm()
+    shared_catalog()
+    shared_knowledge_base()
+
+
+def on_starting(server):
+    """Warm the shared tables in the master, after the preloaded app was imported and before any fork."""
+    if not preload_app:
+        return
+    _prewarm()
+    # Move everything loaded so far out of the collector's reach, so collections in the
+    # workers do not write to (and so copy) the pages they share with the master
+    gc.collect()
+    gc.freeze()
+    server.log.info("Preloaded app and NLTK data in the master")
+
+
+def post_fork(server, worker):
+    """Give every worker its own random sequence for picking responses."""
+    random.seed()
+
+
+def post_worker_init(worker):
+    """Warm each worker on its own when the app is not preloaded."""
+    if not preload_app:
+        _prewarm()
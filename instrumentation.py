@@ -0,0 +1,244 @@
+"""
+Latency instrumentation for the request path.
+This module times named stages (preprocessing, intent matching, backend calls, ...) tagged by
+backend, aggregates them into histograms and renders them in the Prometheus text format.
+The stages of the current request are also kept, so they can be reported per response.
+"""
+import math
+import time
+import bisect
+import threading
+import contextvars
+from typing import List, Dict, Optional, Tuple
+
+# Histogram bucket upper bounds in seconds, from cheap local stages to slow API calls
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stage name -> accumulated seconds for the current request, or None outside a request
+_request_stages = contextvars.ContextVar('request_stages', default=None)
+
+
+class Histogram:
+    """Cumulative latency histogram with fixed buckets, as exposed by Prometheus."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """Add one observation; the caller holds the registry lock."""
+        # Values above the last bound are only counted in the implicit +Inf bucket
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: 'Histogram'):
+        """Add the observations of a histogram with the same buckets."""
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate a quantile from the bucket counts.
+
+        Args:
+            q: Quantile between 0 and 1, e.g. 0.99
+
+        Returns:
+            Upper bound of the bucket holding the quantile (inf past the last bucket), or None without observations
+        """
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        for bound, total in zip(self.buckets, self.cumulative()):
+            if total >= rank:
+                return bound
+        return math.inf
+
+    def cumulative(self) -> List[int]:
+        """Get the number of observations at or below each bucket bound."""
+        total = 0
+        cumulative = []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+
+class Metrics:
+    """
+    Registry of stage and request latency histograms and counters.
+
+    Observations take one short lock, so recording a stage costs about a
+    microsecond. Label values are kept as given; callers use a small fixed
+    set (stage names, backend names, endpoints).
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Initialize the registry.
+
+        Args:
+            buckets: Histogram bucket upper bounds in seconds
+        """
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._stages: Dict[Tuple[str, str], Histogram] = {}
+        self._requests: Dict[str, Histogram] = {}
+        self._responses: Dict[Tuple[str, str], int] = {}
+
+    def observe_stage(self, stage: str, seconds: float, backend: str = ''):
+        """
+        Record the duration of a stage.
+
+        Args:
+            stage: Stage name, e.g. "intent_match"
+            seconds: Time the stage took
+            backend: Backend the stage ran for, if any
+        """
+        key = (stage, backend)
+        with self._lock:
+            histogram = self._stages.get(key)
+            if histogram is None:
+                histogram = self._stages[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+        stages = _request_stages.get()
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    def observe_request(self, endpoint: str, status: int, seconds: float):
+        """
+        Record a finished request.
+
+        Args:
+            endpoint: Endpoint name
+            status: HTTP status code
+            seconds: Time until the response was ready
+        """
+        with self._lock:
+            histogram = self._requests.get(endpoint)
+            if histogram is None:
+                histogram = self._requests[endpoint] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            key = (endpoint, str(status))
+            self._responses[key] = self._responses.get(key, 0) + 1
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Returns:
+            The metrics page
+        """
+        with self._lock:
+            stages = [(key, list(h.cumulative()), h.sum, h.count) for key, h in sorted(self._stages.items())]
+            requests = [(key, list(h.cumulative()), h.sum, h.count) for key, h in sorted(self._requests.items())]
+            responses = sorted(self._responses.items())
+
+        lines = [
+            '# HELP chatbot_stage_seconds Time spent in each stage of answering a message.',
+            '# TYPE chatbot_stage_seconds histogram'
+        ]
+        for (stage, backend), cumulative, total, count in stages:
+            labels = f'stage="{_escape(stage)}",backend="{_escape(backend)}"'
+            lines.extend(self._histogram_lines('chatbot_stage_seconds', labels, cumulative, total, count))
+
+        lines.extend([
+            '# HELP chatbot_request_seconds Time until the response of an HTTP request was ready.',
+            '# TYPE chatbot_request_seconds histogram'
+        ])
+        for endpoint, cumulative, total, count in requests:
+            labels = f'endpoint="{_escape(endpoint)}"'
+            lines.extend(self._histogram_lines('chatbot_request_seconds', labels, cumulative, total, count))
+
+        lines.extend([
+            '# HELP chatbot_responses_total HTTP responses by endpoint and status code.',
+            '# TYPE chatbot_responses_total counter'
+        ])
+        for (endpoint, status), count in responses:
+            lines.append(f'chatbot_responses_total{{endpoint="{_escape(endpoint)}",status="{status}"}} {count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _histogram_lines(self, name: str, labels: str, cumulative: List[int], total: float, count: int) -> List[str]:
+        """Render the bucket, sum and count samples of one histogram."""
+        lines = [f'{name}_bucket{{{labels},le="{bound:g}"}} {value}' for bound, value in zip(self.buckets, cumulative)]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f'{name}_sum{{{labels}}} {total:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {count}')
+        return lines
+
+    def clear(self):
+        """Drop every observation."""
+        with self._lock:
+            self._stages.clear()
+            self._requests.clear()
+            self._responses.clear()
+
+
+def _escape(value: str) -> str:
+    """Escape a Prometheus label value."""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Process-wide registry used by the request path
+metrics = Metrics()
+
+
+class timed:
+    """
+    Context manager recording how long its block takes as a stage.
+
+    Usage: with timed("intent_match", "nltk"): ...
+    """
+
+    __slots__ = ('stage', 'backend', 'started')
+
+    def __init__(self, stage: str, backend: str = ''):
+        self.stage = stage
+        self.backend = backend
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        metrics.observe_stage(self.stage, time.perf_counter() - self.started, self.backend)
+        return False
+
+
+def observe_stage(stage: str, seconds: float, backend: str = ''):
+    """Record the duration of a stage measured by the caller."""
+    metrics.observe_stage(stage, seconds, backend)
+
+
+def begin_request():
+    """Start collecting the stages of the current request; call at the start of a request."""
+    _request_stages.set({})
+
+
+def request_stages() -> Optional[Dict[str, float]]:
+    """Get the seconds spent per stage in the current request, or None outside a request."""
+    return _request_stages.get()
+
+
+def server_timing(stages: Dict[str, float]) -> str:
+    """
+    Format stage timings as a Server-Timing header value.
+
+    Args:
+        stages: Stage name -> seconds
+
+    Returns:
+        The header value, with durations in milliseconds
+    """
+    return ', '.join(f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in stages.items())
@@ -0,0 +1,428 @@
+"""
+Data-driven intent catalog for the rule-based fallback.
+This module loads intents from JSON or YAML files, compiles them to a versioned binary artifact
+that workers memory-map at startup, and swaps in a new catalog when the file changes.
+"""
+import os
+import re
+import sys
+import mmap
+import json
+import time
+import struct
+import marshal
+import hashlib
+import logging
+import argparse
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+try:
+    import yaml
+    yaml_available = True
+except ImportError:
+    yaml_available = False
+
+from intent_matcher import IntentMatcher
+
+logger = logging.getLogger(__name__)
+
+# Catalog shipped with the chatbot, used when INTENT_CATALOG is not set
+DEFAULT_CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intents.json')
+
+# Suffix of the compiled artifact written next to a source file
+COMPILED_SUFFIX = '.bin'
+
+# Bump when the layout of the compiled payload changes
+FORMAT_VERSION = 1
+
+# Magic, format version, Python major/minor, SHA-256 of the source, payload length
+_MAGIC = b'INTENTC\x00'
+_HEADER = struct.Struct('<8sHBB32sQ')
+
+
+class IntentCatalog:
+    """
+    An immutable set of intents with their matcher and default responses.
+
+    A catalog is never modified after it is built; a reload builds a new one,
+    so requests holding the old catalog finish with a consistent view.
+    """
+
+    def __init__(self, matcher: IntentMatcher, default_responses: List[str], digest: bytes = b''):
+        """
+        Initialize the catalog.
+
+        Args:
+            matcher: Matcher over the intent patterns
+            default_responses: Responses used when no intent matches
+            digest: SHA-256 of the source the catalog was built from
+        """
+        self.matcher = matcher
+        self.default_responses = default_responses
+        self.digest = digest
+
+    @property
+    def patterns_responses(self) -> Dict[str, List[str]]:
+        """Get the ordered mapping of pattern to responses."""
+        return dict(zip(self.matcher.patterns, self.matcher.responses))
+
+    def current(self) -> 'IntentCatalog':
+        """Get the catalog to answer a request with; a static catalog is always itself."""
+        return self
+
+    def __len__(self) -> int:
+        return len(self.matcher)
+
+
+def parse_catalog(data: Any, digest: bytes = b'') -> IntentCatalog:
+    """
+    Build a catalog from decoded JSON or YAML.
+
+    The document holds "intents", either a list of {"pattern": regex,
+    "responses": [...]} in priority order or a mapping of pattern to
+    responses, and "defaults", the responses used when nothing matches.
+    Responses may contain "{models}", replaced with the available models.
+
+    Args:
+        data: The decoded document
+        digest: SHA-256 of the source bytes
+
+    Returns:
+        The catalog
+
+    Raises:
+        ValueError: If the document is malformed or a pattern does not compile
+    """
+    if not isinstance(data, dict):
+        raise ValueError("An intent catalog must be a mapping with 'intents' and 'defaults'")
+
+    intents = data.get('intents')
+    if isinstance(intents, dict):
+        intents = [{'pattern': pattern, 'responses': responses} for pattern, responses in intents.items()]
+    if not isinstance(intents, list) or not intents:
+        raise ValueError("'intents' must be a non-empty list or mapping")
+
+    patterns_responses: Dict[str, List[str]] = {}
+    for intent in intents:
+        if not isinstance(intent, dict) or not isinstance(intent.get('pattern'), str):
+            raise ValueError("Every intent needs a 'pattern' string")
+        pattern = intent['pattern']
+        responses = intent.get('responses')
+        if not isinstance(responses, list) or not responses or not all(isinstance(r, str) for r in responses):
+            raise ValueError(f"Intent {pattern!r} needs a non-empty list of response strings")
+        if pattern in patterns_responses:
+            logger.warning("Duplicate intent pattern %r, keeping the first", pattern)
+            continue
+        patterns_responses[pattern] = responses
+
+    defaults = data.get('defaults')
+    if not isinstance(defaults, list) or not defaults or not all(isinstance(r, str) for r in defaults):
+        raise ValueError("'defaults' must be a non-empty list of response strings")
+
+    try:
+        matcher = IntentMatcher(patterns_responses)
+    except re.error as e:
+        raise ValueError(f"Intent pattern {e.pattern!r} does not compile: {e}") from e
+    return IntentCatalog(matcher, defaults, digest)
+
+
+def load_source(path: str) -> IntentCatalog:
+    """
+    Load a catalog from a JSON or YAML (.yaml/.yml) file.
+
+    Args:
+        path: Path of the source file
+
+    Returns:
+        The catalog
+
+    Raises:
+        OSError: If the file cannot be read
+        ValueError: If the file is malformed
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+
+    if path.endswith(('.yaml', '.yml')):
+        if not yaml_available:
+            raise ValueError(f"Loading {path} requires the PyYAML package")
+        try:
+            data = yaml.safe_load(raw)
+        except yaml.YAMLError as e:
+            raise ValueError(f"Invalid YAML in {path}: {e}") from e
+    else:
+        try:
+            data = json.loads(raw)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON in {path}: {e}") from e
+
+    return parse_catalog(data, hashlib.sha256(raw).digest())
+
+
+def compile_catalog(catalog: IntentCatalog, path: str):
+    """
+    Write a catalog as a compiled artifact.
+
+    The payload is the matcher's anchor index, patterns and responses in
+    marshal format, so loading it skips parsing every regex. marshal is tied
+    to the Python version, which is recorded in the header with the source
+    digest; an artifact built by another Python version is ignored.
+
+    Args:
+        catalog: The catalog to write
+        path: Path of the artifact
+    """
+    payload = marshal.dumps({'matcher': catalog.matcher.state(), 'defaults': catalog.default_responses})
+    header = _HEADER.pack(_MAGIC, FORMAT_VERSION, sys.version_info[0], sys.version_info[1],
+                          catalog.digest.ljust(32, b'\x00'), len(payload))
+
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(header)
+        f.write(payload)
+    os.replace(temporary, path)
+
+
+def _read_header(view) -> Tuple[bytes, int]:
+    """Check an artifact's header; returns the source digest and payload length."""
+    if len(view) < _HEADER.size:
+        raise ValueError("Compiled intent catalog is truncated")
+    magic, version, major, minor, digest, length = _HEADER.unpack_from(view)
+    if magic != _MAGIC:
+        raise ValueError("Not a compiled intent catalog")
+    if version != FORMAT_VERSION or (major, minor) != sys.version_info[:2]:
+        raise ValueError(f"Compiled intent catalog has format {version} for Python {major}.{minor}")
+    if len(view) < _HEADER.size + length:
+        raise ValueError("Compiled intent catalog is truncated")
+    return digest, length
+
+
+def load_compiled(path: str, expected_digest: Optional[bytes] = None) -> IntentCatalog:
+    """
+    Load a compiled artifact through a read-only memory map.
+
+    Patterns are compiled the first time they are a match candidate, so
+    loading takes milliseconds even for large catalogs.
+
+    Args:
+        path: Path of the artifact
+        expected_digest: Source digest the artifact must have been built from, or None to accept any
+
+    Returns:
+        The catalog
+
+    Raises:
+        OSError: If the file cannot be read
+        ValueError: If the artifact is invalid, built by another version or stale
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as view:
+            digest, length = _read_header(view)
+            if expected_digest is not None and digest != expected_digest:
+                raise ValueError("Compiled intent catalog is older than its source")
+            try:
+                payload = marshal.loads(view[_HEADER.size:_HEADER.size + length])
+            except (EOFError, ValueError, TypeError) as e:
+                raise ValueError(f"Compiled intent catalog is corrupt: {e}") from e
+
+    return IntentCatalog(IntentMatcher.from_state(payload['matcher']), payload['defaults'], digest)
+
+
+def load_catalog(path: str) -> IntentCatalog:
+    """
+    Load a catalog, preferring an up-to-date compiled artifact.
+
+    A path ending in COMPILED_SUFFIX is loaded as an artifact. For a source
+    file, the artifact next to it is used if it was built from the same bytes;
+    otherwise the source is parsed.
+
+    Args:
+        path: Path of a source file or compiled artifact
+
+    Returns:
+        The catalog
+
+    Raises:
+        OSError: If the file cannot be read
+        ValueError: If the file is malformed
+    """
+    if path.endswith(COMPILED_SUFFIX):
+        return load_compiled(path)
+
+    compiled_path = path + COMPILED_SUFFIX
+    if os.path.exists(compiled_path):
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).digest()
+        try:
+            return load_compiled(compiled_path, digest)
+        except (OSError, ValueError) as e:
+            logger.info("Not using %s: %s", compiled_path, e)
+
+    return load_source(path)
+
+
+def _signature(path: str) -> Tuple:
+    """Get the modification time and size of a catalog and of its compiled artifact."""
+    signature = []
+    for candidate in (path, path + COMPILED_SUFFIX):
+        try:
+            stat = os.stat(candidate)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class ReloadingCatalog:
+    """
+    Serve a catalog file and swap in a new catalog when the file changes.
+
+    current() compares the file's modification time and size at most once
+    per poll interval. A change is loaded on a background thread while
+    requests keep using the previous catalog; the new one replaces it with a
+    single reference assignment. A file that fails to load is logged and the
+    previous catalog stays in use. Replace catalog files atomically (write
+    a temporary file, then rename it) so a half-written file is never read.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 5.0, clock=time.monotonic):
+        """
+        Load the catalog.
+
+        Args:
+            path: Path of a source file or compiled artifact
+            poll_interval: Seconds between checks for changes
+            clock: Time source, for tests
+
+        Raises:
+            OSError: If the file cannot be read
+            ValueError: If the file is malformed
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+        self._clock = clock
+        self._signature = _signature(path)
+        self._catalog = load_catalog(path)
+        self._next_check = clock() + poll_interval
+        self._reloading = threading.Lock()
+        self.reloads = 0
+
+    def current(self) -> IntentCatalog:
+        """
+        Get the catalog to answer a request with.
+
+        Returns:
+            The latest catalog that loaded successfully
+        """
+        if self._clock() >= self._next_check:
+            self._check()
+        return self._catalog
+
+    def _check(self):
+        """Start a reload on a background thread if the file changed; never blocks."""
+        if not self._reloading.acquire(blocking=False):
+            return
+        self._next_check = self._clock() + self.poll_interval
+
+        signature = _signature(self.path)
+        if signature == self._signature:
+            self._reloading.release()
+            return
+
+        threading.Thread(target=self._reload, args=(signature,), name='intent-catalog-reload', daemon=True).start()
+
+    def _reload(self, signature: Tuple):
+        """Load the changed file and swap it in; runs with the reload lock held."""
+        try:
+            self.reload()
+        finally:
+            self._signature = signature
+            self._reloading.release()
+
+    def reload(self) -> bool:
+        """
+        Load the file now and swap it in.
+
+        Returns:
+            True if the new catalog is in use, False if it failed to load
+        """
+        started = time.perf_counter()
+        try:
+            catalog = load_catalog(self.path)
+        except (OSError, ValueError) as e:
+            logger.error("Intent catalog %s not reloaded, keeping the previous one: %s", self.path, e)
+            return False
+
+        self._catalog = catalog
+        self.reloads += 1
+        logger.info("Reloaded intent catalog %s: %s intents in %.1fms", self.path, len(catalog),
+                    (time.perf_counter() - started) * 1000)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._catalog)
+
+
+_lock = threading.Lock()
+_catalogs: Dict[str, Any] = {}
+
+
+def shared_catalog() -> Any:
+    """
+    Get the process-wide intent catalog, loaded on first use.
+
+    INTENT_CATALOG names a JSON, YAML or compiled catalog (defaults to the
+    bundled intents.json), and INTENT_CATALOG_RELOAD the seconds between
+    checks for changes (defaults to 5, 0 disables reloading). If the
+    configured catalog cannot be loaded, the bundled one is used.
+
+    Returns:
+        An IntentCatalog, or a ReloadingCatalog when reloading is enabled
+    """
+    path = os.environ.get("INTENT_CATALOG") or DEFAULT_CATALOG
+    interval = float(os.environ.get("INTENT_CATALOG_RELOAD", "5"))
+
+    catalog = _catalogs.get(path)
+    if catalog is not None:
+        return catalog
+
+    with _lock:
+        if path not in _catalogs:
+            started = time.perf_counter()
+            try:
+                catalog = ReloadingCatalog(path, interval) if interval > 0 else load_catalog(path)
+            except (OSError, ValueError) as e:
+                if path == DEFAULT_CATALOG:
+                    raise
+                logger.error("Intent catalog %s not loaded, using the bundled one: %s", path, e)
+                catalog = load_catalog(DEFAULT_CATALOG)
+            logger.info("Loaded intent catalog %s: %s intents in %.1fms", path, len(catalog),
+                        (time.perf_counter() - started) * 1000)
+            _catalogs[path] = catalog
+        return _catalogs[path]
+
+
+def main():
+    """Compile an intent catalog source file into an artifact workers load at startup."""
+    parser = argparse.ArgumentParser(description="Compile an intent catalog")
+    parser.add_argument("source", help="JSON or YAML catalog")
+    parser.add_argument("-o", "--output", help=f"artifact path (defaults to SOURCE{COMPILED_SUFFIX})")
+    args = parser.parse_args()
+
+    try:
+        catalog = load_source(args.source)
+    except (OSError, ValueError) as e:
+        parser.exit(1, f"{e}\n")
+
+    output = args.output or args.source + COMPILED_SUFFIX
+    compile_catalog(catalog, output)
+
+    started = time.perf_counter()
+    load_compiled(output)
+    print(f"Compiled {len(catalog)} intents to {output} ({os.path.getsize(output)} bytes, "
+          f"loads in {(time.perf_counter() - started) * 1000:.1f}ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""
+Compiled intent matching for the rule-based fallback.
+This module contains the matcher that maps preprocessed user input to an intent pattern.
+"""
+import re
+import logging
+from typing import List, Dict, Optional, Set, Any, Pattern
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+logger = logging.getLogger(__name__)
+
+# Longest anchor kept per intent; any substring of a required literal is still required
+MAX_ANCHOR_LENGTH = 12
+
+# Largest set of alternative strings expanded when looking for anchors
+MAX_EXPANSION = 64
+
+# Characters that case-insensitive regexes treat as ASCII letters but str.lower() does not map to one;
+# 'İ' is folded before lowercasing, which would turn it into 'i' and a combining dot
+_ASCII_FOLDS = str.maketrans({'ı': 'i', 'ſ': 's', 'İ': 'i'})
+
+_WORD_RUN = re.compile(r'\w+')
+_ASCII_WORD_CHARS = frozenset('abcdefghijklmnopqrstuvwxyz0123456789_')
+
+
+def _word_runs(literal: str) -> List[str]:
+    """Split a literal into its runs of ASCII word characters."""
+    runs = []
+    current = []
+    for char in literal.lower():
+        if char in _ASCII_WORD_CHARS:
+            current.append(char)
+        elif current:
+            runs.append(''.join(current))
+            current = []
+    if current:
+        runs.append(''.join(current))
+    return runs
+
+
+def _exact_strings(item) -> Optional[Set[str]]:
+    """
+    Get every string a parsed regex item can match, if that set is small and finite.
+
+    Args:
+        item: An (opcode, argument) pair from the regex parser
+
+    Returns:
+        The set of strings, or None if the item is not a small finite alternation
+    """
+    op, av = item
+    if op is sre_constants.LITERAL:
+        return {chr(av)}
+    if op is sre_constants.IN:
+        if all(child_op is sre_constants.LITERAL for child_op, _ in av):
+            return {chr(child_av) for _, child_av in av}
+        return None
+    if op is sre_constants.SUBPATTERN:
+        return _exact_sequence(av[-1])
+    if op is sre_constants.BRANCH:
+        strings = set()
+        for branch in av[1]:
+            branch_strings = _exact_sequence(branch)
+            if branch_strings is None:
+                return None
+            strings |= branch_strings
+            if len(strings) > MAX_EXPANSION:
+                return None
+        return strings
+    return None
+
+
+def _exact_sequence(items) -> Optional[Set[str]]:
+    """Get every string a parsed regex sequence can match, if that set is small and finite."""
+    strings = {''}
+    for item in items:
+        item_strings = _exact_strings(item)
+        if item_strings is None or len(strings) * len(item_strings) > MAX_EXPANSION:
+            return None
+        strings = {prefix + suffix for prefix in strings for suffix in item_strings}
+    return strings
+
+
+def _anchors_from_strings(strings: Set[str]) -> Optional[Set[str]]:
+    """Pick the longest word run of each alternative string."""
+    anchors = set()
+    for string in strings:
+        runs = _word_runs(string)
+        if not runs:
+            return None
+        anchors.add(max(runs, key=len)[:MAX_ANCHOR_LENGTH])
+    return anchors
+
+
+def _better(candidate: Optional[Set[str]], best: Optional[Set[str]]) -> bool:
+    """Prefer anchor sets whose shortest anchor is longest, then smaller sets."""
+    if candidate is None:
+        return False
+    if best is None:
+        return True
+    candidate_key = (min(map(len, candidate)), -len(candidate))
+    best_key = (min(map(len, best)), -len(best))
+    return candidate_key > best_key
+
+
+def _required_anchors(items) -> Optional[Set[str]]:
+    """
+    Find word literals of which at least one must appear in any match of a sequence.
+
+    Args:
+        items: A parsed regex sequence
+
+    Returns:
+        A set of lowercase anchors, or None if no such set could be derived
+    """
+    best = None
+    run = {''}
+
+    def close_run():
+        nonlocal best, run
+        if run != {''}:
+            anchors = _anchors_from_strings(run)
+            if _better(anchors, best):
+                best = anchors
+        run = {''}
+
+    for item in items:
+        op, av = item
+        item_strings = _exact_strings(item)
+        if item_strings is not None and len(run) * len(item_strings) <= MAX_EXPANSION:
+            run = {prefix + suffix for prefix in run for suffix in item_strings}
+            continue
+
+        close_run()
+        if item_strings is not None:
+            run = item_strings
+            continue
+
+        # Items that are not exact may still require an anchor of their own
+        anchors = None
+        if op is sre_constants.SUBPATTERN:
+            anchors = _required_anchors(av[-1])
+        elif op is sre_constants.BRANCH:
+            anchors = set()
+            for branch in av[1]:
+                branch_anchors = _required_anchors(branch)
+                if branch_anchors is None:
+                    anchors = None
+                    break
+                anchors |= branch_anchors
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+            anchors = _required_anchors(av[2])
+        if _better(anchors, best):
+            best = anchors
+
+    close_run()
+    return best
+
+
+def pattern_anchors(pattern: str, flags: int = 0) -> Optional[Set[str]]:
+    """
+    Derive the word literals of which at least one appears in every match of a pattern.
+
+    Args:
+        pattern: The regex pattern
+        flags: Regex flags the pattern is compiled with
+
+    Returns:
+        A set of lowercase anchors, or None if the pattern has to be checked on every input
+    """
+    try:
+        return _required_anchors(sre_parse.parse(pattern, flags))
+    except Exception as e:
+        logger.debug("Cannot derive anchors for pattern %r: %s", pattern, e)
+        return None
+
+
+class IntentMatcher:
+    """
+    Match text against many intent patterns through a token-keyed inverted index.
+
+    Every pattern is compiled once and reduced to a set of anchor literals,
+    at least one of which occurs in any text the pattern matches. At match
+    time the word runs of the text are looked up in the anchor index, and
+    only the candidate intents it returns (plus the few patterns without
+    anchors) are searched, in their original order. This gives the same
+    first-match result as calling ``re.search`` on every pattern in dict
+    order while the work per message stays flat as intents are added.
+    """
+
+    def __init__(self, patterns_responses: Dict[str, List[str]], flags: int = re.IGNORECASE):
+        """
+        Compile the intent patterns and build the anchor index.
+
+        Args:
+            patterns_responses: Ordered mapping of regex pattern to candidate responses
+            flags: Regex flags applied to every pattern
+        """
+        self.patterns: List[str] = list(patterns_responses.keys())
+        self.responses: List[List[str]] = list(patterns_responses.values())
+        self.flags = flags
+
+        self._compiled: List[Optional[Pattern]] = [re.compile(pattern, flags) for pattern in self.patterns]
+
+        # Anchor literal -> indexes of the intents that require it
+        self._index: Dict[str, List[int]] = {}
+        # Intents without anchors are searched for every input
+        self._unanchored: List[int] = []
+
+        for intent_index, pattern in enumerate(self.patterns):
+            anchors = pattern_anchors(pattern, flags)
+            if not anchors:
+                self._unanchored.append(intent_index)
+                continue
+            for anchor in anchors:
+                self._index.setdefault(anchor, []).append(intent_index)
+
+        self._anchor_lengths = sorted({len(anchor) for anchor in self._index})
+
+        logger.debug("Intent matcher built with %s intents, %s anchors, %s unanchored",
+                     len(self.patterns), len(self._index), len(self._unanchored))
+
+    def state(self) -> Dict[str, Any]:
+        """
+        Export everything needed to rebuild the matcher without parsing its patterns.
+
+        Compiled regexes are left out; from_state() compiles each one the first
+        time it is a candidate.
+
+        Returns:
+            Dictionary of plain lists, dicts and strings
+        """
+        return {
+            'patterns': self.patterns,
+            'responses': self.responses,
+            'flags': int(self.flags),
+            'index': self._index,
+            'unanchored': self._unanchored,
+            'anchor_lengths': self._anchor_lengths
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> 'IntentMatcher':
+        """
+        Rebuild a matcher exported with state().
+
+        Args:
+            state: The exported state
+
+        Returns:
+            A matcher giving the same results as the exported one
+        """
+        matcher = cls.__new__(cls)
+        matcher.patterns = state['patterns']
+        matcher.responses = state['responses']
+        matcher.flags = state['flags']
+        matcher._compiled = [None] * len(matcher.patterns)
+        matcher._index = state['index']
+        matcher._unanchored = state['unanchored']
+        matcher._anchor_lengths = state['anchor_lengths']
+        return matcher
+
+    def _compile(self, intent_index: int) -> Pattern:
+        """Compile an intent's pattern on first use."""
+        compiled = re.compile(self.patterns[intent_index], self.flags)
+        self._compiled[intent_index] = compiled
+        return compiled
+
+    def _candidates(self, text: str) -> List[int]:
+        """Get the intents that can possibly match the text, in priority order."""
+        candidates = set(self._unanchored)
+        folded = text.translate(_ASCII_FOLDS).lower()
+        index = self._index
+        lengths = self._anchor_lengths
+
+        for word in _WORD_RUN.finditer(folded):
+            word_start, word_end = word.span()
+            for start in range(word_start, word_end):
+                for length in lengths:
+                    end = start + length
+                    if end > word_end:
+                        break
+                    intents = index.get(folded[start:end])
+                    if intents:
+                        candidates.update(intents)
+
+        return sorted(candidates)
+
+    def match_index(self, text: str) -> Optional[int]:
+        """
+        Find the first intent matching the text.
+
+        Args:
+            text: Text to match, usually the preprocessed user input
+
+        Returns:
+            The index of the first matching intent, or None if nothing matches
+        """
+        compiled = self._compiled
+        for intent_index in self._candidates(text):
+            pattern = compiled[intent_index] or self._compile(intent_index)
+            if pattern.search(text):
+                return intent_index
+        return None
+
+    def match(self, text: str) -> Optional[List[str]]:
+        """
+        Get the candidate responses of the first intent matching the text.
+
+        Args:
+            text: Text to match, usually the preprocessed user input
+
+        Returns:
+            The list of responses for the matching intent, or None if nothing matches
+        """
+        intent_index = self.match_index(text)
+        if intent_index is None:
+            return None
+        return self.responses[intent_index]
+
+    def match_many(self, texts: List[str]) -> List[Optional[List[str]]]:
+        """
+        Match a batch of texts.
+
+        Args:
+            texts: Texts to match, usually preprocessed user inputs
+
+        Returns:
+            The responses of each text's first matching intent (None where nothing matches), in order
+        """
+        # Each distinct text is matched once
+        matches: Dict[str, Optional[int]] = {}
+        results = []
+        for text in texts:
+            if text not in matches:
+                matches[text] = self.match_index(text)
+            intent_index = matches[text]
+            results.append(None if intent_index is None else self.responses[intent_index])
+        return results
+
+    def __len__(self) -> int:
+        return len(self.patterns)
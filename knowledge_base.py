@@ -0,0 +1,660 @@
+"""
+Local knowledge base answering from a document corpus.
+This module keeps an incrementally built inverted index over FAQ entries or document passages,
+ranks them with BM25 and persists the index, so workers load it instead of re-tokenizing the corpus.
+"""
+import os
+import re
+import sys
+import math
+import mmap
+import json
+import time
+import heapq
+import struct
+import marshal
+import hashlib
+import logging
+import argparse
+import threading
+from array import array
+from collections import Counter
+from typing import List, Dict, Optional, Callable, Iterable, Iterator, Tuple, Any
+
+try:
+    import numpy as np
+    numpy_available = True
+except ImportError:
+    numpy_available = False
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r'\w+')
+
+# Suffix of the index file written next to a corpus
+INDEX_SUFFIX = '.index'
+
+# Bump when the layout of the index payload changes
+FORMAT_VERSION = 1
+
+# Magic, format version, Python major/minor, payload length
+_MAGIC = b'KBINDEX\x00'
+_HEADER = struct.Struct('<8sHBBQ')
+
+# Text whose preprocessed form identifies the tokenizer an index was built with
+_PROBE = "The runners were running past the geese and the cats, asking questions"
+
+# Characters of a passage sent to an API model as context
+MAX_PASSAGE_CHARS = 1000
+
+# Fraction of removed documents past which update() rebuilds the postings without them
+COMPACT_RATIO = 0.25
+
+
+def terms(preprocessed: str) -> List[str]:
+    """Split preprocessed text into index terms, dropping punctuation tokens."""
+    return _WORD.findall(preprocessed)
+
+
+def default_preprocess() -> Callable[[str], str]:
+    """Get the preprocessing the chatbot applies to messages (Chatbot._preprocess_text)."""
+    from preprocessing import TextPreprocessor
+    return TextPreprocessor().preprocess
+
+
+class Document:
+    """A FAQ entry or passage: its id, an optional title (e.g. the question) and its text."""
+
+    __slots__ = ('id', 'title', 'text', 'digest')
+
+    def __init__(self, id: str, title: str, text: str, digest: bytes):
+        self.id = id
+        self.title = title
+        self.text = text
+        self.digest = digest
+
+    def to_dict(self) -> Dict[str, str]:
+        """Get a JSON-serializable copy of the document."""
+        return {'id': self.id, 'title': self.title, 'text': self.text}
+
+
+class Hit:
+    """
+    A document matching a query.
+
+    `confidence` is the score relative to that of a document of average
+    length holding each query term once, so 1.0 means every query term
+    matched; it is comparable across queries, unlike the raw BM25 score.
+    A short document holding a query's only term scores 1.0 or more as
+    well, so `matched` counts the distinct query terms the document holds.
+    """
+
+    __slots__ = ('document', 'score', 'confidence', 'matched')
+
+    def __init__(self, document: Document, score: float, confidence: float, matched: int = 0):
+        self.document = document
+        self.score = score
+        self.confidence = confidence
+        self.matched = matched
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get a JSON-serializable copy of the hit."""
+        return dict(self.document.to_dict(), score=self.score, confidence=self.confidence, matched=self.matched)
+
+
+def _array(typecode: str, data: bytes) -> array:
+    """Rebuild an array saved with tobytes()."""
+    values = array(typecode)
+    values.frombytes(data)
+    return values
+
+
+def _digest(title: str, text: str) -> bytes:
+    """Fingerprint a document's content, to skip unchanged documents on update."""
+    return hashlib.sha1(f"{title}\x00{text}".encode('utf-8')).digest()
+
+
+class KnowledgeBase:
+    """
+    BM25-ranked inverted index over documents.
+
+    Documents can be added, replaced and removed one at a time; only changed
+    documents are tokenized again. Postings are compact arrays of document
+    numbers and term frequencies. Removed documents are skipped at query
+    time until compact() drops their postings. Queries are read-only, so
+    any number of threads may search while no update runs.
+    """
+
+    def __init__(self, preprocess: Optional[Callable[[str], str]] = None, k1: float = 1.2, b: float = 0.75,
+                 answer_threshold: float = 0.8, context_threshold: float = 0.2, context_passages: int = 3,
+                 answer_min_terms: int = 2, answer_min_score: float = 3.0):
+        """
+        Initialize an empty knowledge base.
+
+        Args:
+            preprocess: Text -> preprocessed text; defaults to the chatbot's message preprocessing
+            k1: BM25 term frequency saturation
+            b: BM25 document length normalization
+            answer_threshold: Confidence above which the best document answers a message directly
+            context_threshold: Confidence above which a document is passed to the API models as context
+            context_passages: Documents passed to the API models at most
+            answer_min_terms: Distinct query terms the best document must hold to answer directly
+            answer_min_score: BM25 score the best document must reach to answer directly
+        """
+        self.preprocess = preprocess or default_preprocess()
+        self.k1 = k1
+        self.b = b
+        self.answer_threshold = answer_threshold
+        self.context_threshold = context_threshold
+        self.context_passages = context_passages
+        self.answer_min_terms = answer_min_terms
+        self.answer_min_score = answer_min_score
+
+        self._documents: List[Optional[Document]] = []  # document number -> document, None once removed
+        self._numbers: Dict[str, int] = {}  # document id -> document number
+        self._lengths = array('I')  # document number -> terms
+        self._postings: Dict[str, Tuple[array, array]] = {}  # term -> (document numbers, term frequencies)
+        self._total_length = 0
+        self._removed = 0
+        self._norms = None  # per-document length normalization, rebuilt when the average length changes
+        self._norms_key = None
+
+    def __len__(self) -> int:
+        return len(self._numbers)
+
+    def tokenizer_signature(self) -> str:
+        """Get the terms of a probe text, which differ between tokenizers (e.g. with and without lemmatization)."""
+        return ' '.join(terms(self.preprocess(_PROBE)))
+
+    def add(self, doc_id: str, text: str, title: str = '') -> bool:
+        """
+        Add or replace a document.
+
+        Args:
+            doc_id: Document id; a document with the same id is replaced
+            text: Document text, returned as the answer
+            title: Optional title, e.g. the FAQ question; it is indexed with the text
+
+        Returns:
+            False if the document was already indexed with the same content
+        """
+        digest = _digest(title, text)
+        number = self._numbers.get(doc_id)
+        if number is not None:
+            if self._documents[number].digest == digest:
+                return False
+            self.remove(doc_id)
+
+        document_terms = terms(self.preprocess(f"{title}\n{text}" if title else text))
+        number = len(self._documents)
+        self._documents.append(Document(doc_id, title, text, digest))
+        self._numbers[doc_id] = number
+        self._lengths.append(len(document_terms))
+        self._total_length += len(document_terms)
+        for term, frequency in Counter(document_terms).items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array('I'), array('H'))
+            postings[0].append(number)
+            postings[1].append(min(frequency, 65535))
+        return True
+
+    def remove(self, doc_id: str) -> bool:
+        """
+        Remove a document; its postings are dropped by the next compact().
+
+        Returns:
+            False if no document has this id
+        """
+        number = self._numbers.pop(doc_id, None)
+        if number is None:
+            return False
+        self._documents[number] = None
+        self._total_length -= self._lengths[number]
+        self._removed += 1
+        return True
+
+    def update(self, documents: Iterable[Tuple[str, str, str]]) -> Dict[str, int]:
+        """
+        Make the index hold exactly the given documents, tokenizing only new and changed ones.
+
+        Args:
+            documents: (id, title, text) of every document of the corpus
+
+        Returns:
+            Counts of added, changed, unchanged and removed documents
+        """
+        counts = {'added': 0, 'changed': 0, 'unchanged': 0, 'removed': 0}
+        seen = set()
+        for doc_id, title, text in documents:
+            if doc_id in seen:
+                logger.warning("Duplicate knowledge base document id %s, keeping the last one", doc_id)
+            seen.add(doc_id)
+            existed = doc_id in self._numbers
+            if not self.add(doc_id, text, title):
+                counts['unchanged'] += 1
+            else:
+                counts['changed' if existed else 'added'] += 1
+
+        for doc_id in [doc_id for doc_id in self._numbers if doc_id not in seen]:
+            self.remove(doc_id)
+            counts['removed'] += 1
+
+        if self._removed > COMPACT_RATIO * max(1, len(self._documents)):
+            self.compact()
+        return counts
+
+    def compact(self):
+        """Renumber the documents without the removed ones and drop their postings."""
+        if not self._removed:
+            return
+        renumber = {}
+        documents = []
+        lengths = array('I')
+        for number, document in enumerate(self._documents):
+            if document is not None:
+                renumber[number] = len(documents)
+                documents.append(document)
+                lengths.append(self._lengths[number])
+
+        postings = {}
+        for term, (numbers, frequencies) in self._postings.items():
+            kept_numbers, kept_frequencies = array('I'), array('H')
+            for number, frequency in zip(numbers, frequencies):
+                new_number = renumber.get(number)
+                if new_number is not None:
+                    kept_numbers.append(new_number)
+                    kept_frequencies.append(frequency)
+            if kept_numbers:
+                postings[term] = (kept_numbers, kept_frequencies)
+
+        self._documents = documents
+        self._numbers = {document.id: number for number, document in enumerate(documents)}
+        self._lengths = lengths
+        self._postings = postings
+        self._removed = 0
+        self._norms = None
+
+    def _length_norms(self):
+        """Get k1 * (1 - b + b * length / average length) per document, cached until the corpus changes."""
+        key = (len(self._documents), self._total_length, len(self))
+        if self._norms_key != key:
+            average = self._total_length / max(1, len(self))
+            k1, b = self.k1, self.b
+            if numpy_available:
+                lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float64)
+                self._norms = k1 * (1 - b + b * lengths / average)
+            else:
+                self._norms = array('d', (k1 * (1 - b + b * length / average) for length in self._lengths))
+            self._norms_key = key
+        return self._norms
+
+    def search_terms(self, query_terms: Iterable[str], k: int = 5) -> List[Hit]:
+        """
+        Rank the documents for preprocessed query terms.
+
+        Args:
+            query_terms: Terms of the preprocessed query; repeats count once
+            k: Number of hits returned at most
+
+        Returns:
+            The best hits, best first
+        """
+        query_terms = set(query_terms)
+        live = len(self)
+        if not live or not query_terms:
+            return []
+
+        norms = self._length_norms()
+        k1 = self.k1
+        attainable = 0.0
+        weighted = []
+        for term in query_terms:
+            postings = self._postings.get(term)
+            frequency = min(len(postings[0]), live) if postings else 0
+            idf = math.log(1 + (live - frequency + 0.5) / (frequency + 0.5))
+            # A term found once in a document of average length scores its idf
+            attainable += idf
+            if postings:
+                weighted.append((idf * (k1 + 1), postings))
+        if not weighted:
+            return []
+
+        if numpy_available:
+            ranked = self._score_numpy(weighted, norms, k)
+        else:
+            ranked = self._score_python(weighted, norms, k)
+        return [Hit(self._documents[number], score, score / attainable, matched)
+                for number, score, matched in ranked]
+
+    def _score_python(self, weighted, norms, k: int) -> List[Tuple[int, float, int]]:
+        """Accumulate BM25 scores and matched terms in dictionaries."""
+        scores: Dict[int, float] = {}
+        matches: Dict[int, int] = {}
+        for weight, (numbers, frequencies) in weighted:
+            for number, frequency in zip(numbers, frequencies):
+                scores[number] = scores.get(number, 0.0) + weight * frequency / (frequency + norms[number])
+                matches[number] = matches.get(number, 0) + 1
+        documents = self._documents
+        return heapq.nlargest(k, ((number, score, matches[number]) for number, score in scores.items()
+                                  if documents[number] is not None), key=lambda item: item[1])
+
+    def _score_numpy(self, weighted, norms, k: int) -> List[Tuple[int, float, int]]:
+        """Accumulate BM25 scores and matched terms with vectorized postings."""
+        scores = np.zeros(len(self._documents))
+        matches = np.zeros(len(self._documents), dtype=np.int32)
+        for weight, (numbers, frequencies) in weighted:
+            numbers = np.frombuffer(numbers, dtype=np.uint32)
+            frequencies = np.frombuffer(frequencies, dtype=np.uint16).astype(np.float64)
+            # Document numbers are unique within a posting list, so plain fancy-index addition is safe
+            scores[numbers] += weight * frequencies / (frequencies + norms[numbers])
+            matches[numbers] += 1
+
+        documents = self._documents
+        ranked = []
+        candidates = min(len(scores), k + self._removed)
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        for number in top[np.argsort(-scores[top])]:
+            score = float(scores[number])
+            if score <= 0:
+                break
+            if documents[number] is not None:
+                ranked.append((int(number), score, int(matches[number])))
+                if len(ranked) == k:
+                    break
+        return ranked
+
+    def search(self, query: str, k: int = 5) -> List[Hit]:
+        """Rank the documents for a query, preprocessing it like the documents."""
+        return self.search_terms(terms(self.preprocess(query)), k)
+
+    def answer(self, hits: List[Hit]) -> Optional[str]:
+        """
+        Get the text of the best hit if it is confident enough to answer on its own, else None.
+
+        Confidence alone is not enough: a one-word message such as a
+        greeting matches any short document holding that word with full
+        confidence, so the best hit must also hold answer_min_terms of the
+        query's terms and reach answer_min_score.
+        """
+        if not hits:
+            return None
+        best = hits[0]
+        if (best.confidence >= self.answer_threshold and best.matched >= self.answer_min_terms
+                and best.score >= self.answer_min_score):
+            return best.document.text
+        return None
+
+    def passages(self, hits: List[Hit]) -> List[Document]:
+        """Get the documents relevant enough to pass to an API model as context."""
+        return [hit.document for hit in hits[:self.context_passages] if hit.confidence >= self.context_threshold]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get index statistics.
+
+        Returns:
+            Dictionary with the document, term and posting counts and the thresholds
+        """
+        return {
+            'documents': len(self),
+            'removed': self._removed,
+            'terms': len(self._postings),
+            'postings': sum(len(numbers) for numbers, _ in self._postings.values()),
+            'average_length': self._total_length / max(1, len(self)),
+            'answer_threshold': self.answer_threshold,
+            'answer_min_terms': self.answer_min_terms,
+            'answer_min_score': self.answer_min_score,
+            'context_threshold': self.context_threshold
+        }
+
+    def save(self, path: str):
+        """
+        Write the index, compacted, to a file.
+
+        The payload is in marshal format, tied to the Python version recorded
+        in the header, and holds the tokenizer signature so an index built
+        with different preprocessing is not used.
+
+        Args:
+            path: Path of the index file
+        """
+        self.compact()
+        documents = self._documents
+        payload = marshal.dumps({
+            'tokenizer': self.tokenizer_signature(),
+            'k1': self.k1,
+            'b': self.b,
+            'ids': [document.id for document in documents],
+            'titles': [document.title for document in documents],
+            'texts': [document.text for document in documents],
+            'digests': b''.join(document.digest for document in documents),
+            'lengths': self._lengths.tobytes(),
+            'postings': {term: (numbers.tobytes(), frequencies.tobytes())
+                         for term, (numbers, frequencies) in self._postings.items()}
+        })
+        header = _HEADER.pack(_MAGIC, FORMAT_VERSION, sys.version_info[0], sys.version_info[1], len(payload))
+
+        temporary = f"{path}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(header)
+            f.write(payload)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path: str, preprocess: Optional[Callable[[str], str]] = None, **options) -> 'KnowledgeBase':
+        """
+        Load an index written by save().
+
+        Args:
+            path: Path of the index file
+            preprocess: Preprocessing of queries and new documents; must match the index's
+            **options: Thresholds, as for the constructor
+
+        Returns:
+            The knowledge base
+
+        Raises:
+            ValueError: If the file is not a usable index for this Python version and tokenizer
+        """
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                if len(view) < _HEADER.size:
+                    raise ValueError("Knowledge base index is truncated")
+                magic, version, major, minor, length = _HEADER.unpack_from(view)
+                if magic != _MAGIC:
+                    raise ValueError("Not a knowledge base index")
+                if version != FORMAT_VERSION or (major, minor) != sys.version_info[:2]:
+                    raise ValueError(f"Knowledge base index has format {version} for Python {major}.{minor}")
+                if len(view) < _HEADER.size + length:
+                    raise ValueError("Knowledge base index is truncated")
+                data = marshal.loads(view[_HEADER.size:_HEADER.size + length])
+            finally:
+                view.release()
+
+        knowledge_base = cls(preprocess, k1=data['k1'], b=data['b'], **options)
+        if data['tokenizer'] != knowledge_base.tokenizer_signature():
+            raise ValueError("Knowledge base index was built with different text preprocessing")
+
+        digests = data['digests']
+        knowledge_base._documents = [
+            Document(doc_id, title, text, digests[20 * number:20 * (number + 1)])
+            for number, (doc_id, title, text) in enumerate(zip(data['ids'], data['titles'], data['texts']))
+        ]
+        knowledge_base._numbers = {document.id: number for number, document in enumerate(knowledge_base._documents)}
+        knowledge_base._lengths = _array('I', data['lengths'])
+        knowledge_base._total_length = sum(knowledge_base._lengths)
+        knowledge_base._postings = {term: (_array('I', numbers), _array('H', frequencies))
+                                    for term, (numbers, frequencies) in data['postings'].items()}
+        return knowledge_base
+
+
+def _entry(item: Any, default_id: str) -> Tuple[str, str, str]:
+    """Read a corpus entry: {"id", "title" or "question", "text" or "answer"}."""
+    if not isinstance(item, dict):
+        raise ValueError(f"Knowledge base entry {default_id} is not an object")
+    text = item.get('text', item.get('answer'))
+    if not isinstance(text, str):
+        raise ValueError(f"Knowledge base entry {default_id} has no 'text' or 'answer' string")
+    title = item.get('title', item.get('question')) or ''
+    return str(item.get('id', default_id)), str(title), text
+
+
+def read_corpus(path: str) -> Iterator[Tuple[str, str, str]]:
+    """
+    Read the documents of a corpus.
+
+    A .jsonl file holds one entry per line and a .json file a list of
+    entries (or {"documents": [...]}); an entry is {"id", "title" or
+    "question", "text" or "answer"}, and the id defaults to its position.
+    A directory is read as .txt and .md files split into passages at blank
+    lines, with the file path as title.
+
+    Args:
+        path: Corpus file or directory
+
+    Yields:
+        (id, title, text) of each document
+
+    Raises:
+        ValueError: If an entry is malformed
+    """
+    if os.path.isdir(path):
+        for root, directories, files in os.walk(path):
+            directories.sort()
+            for name in sorted(files):
+                if not name.endswith(('.txt', '.md')):
+                    continue
+                relative = os.path.relpath(os.path.join(root, name), path)
+                with open(os.path.join(root, name), encoding='utf-8') as f:
+                    passages = [passage.strip() for passage in re.split(r'\n\s*\n', f.read())]
+                for number, passage in enumerate(passage for passage in passages if passage):
+                    yield f"{relative}#{number}", relative, passage
+        return
+
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    yield _entry(json.loads(line), str(number))
+            return
+        data = json.load(f)
+    entries = data.get('documents') if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        raise ValueError("Expected a list of knowledge base entries")
+    for number, item in enumerate(entries, 1):
+        yield _entry(item, str(number))
+
+
+def default_index_path(corpus: str) -> str:
+    """Get the index file kept next to a corpus file or directory."""
+    return corpus.rstrip(os.sep) + INDEX_SUFFIX
+
+
+def build_index(corpus: str, index_path: Optional[str] = None, preprocess: Optional[Callable[[str], str]] = None,
+                **options) -> KnowledgeBase:
+    """
+    Bring the index of a corpus up to date and save it if anything changed.
+
+    An existing index is loaded and only new and changed documents are
+    tokenized; an index that cannot be used (other Python version or
+    preprocessing) is rebuilt from scratch.
+
+    Args:
+        corpus: Corpus file or directory, as read by read_corpus()
+        index_path: Index file; defaults to the corpus path with INDEX_SUFFIX
+        preprocess: Text preprocessing; defaults to the chatbot's
+        **options: Thresholds, as for the KnowledgeBase constructor
+
+    Returns:
+        The up-to-date knowledge base
+
+    Raises:
+        OSError, ValueError: If the corpus cannot be read
+    """
+    index_path = index_path or default_index_path(corpus)
+    started = time.perf_counter()
+    knowledge_base = None
+    if os.path.exists(index_path):
+        try:
+            knowledge_base = KnowledgeBase.load(index_path, preprocess, **options)
+        except (OSError, ValueError, EOFError, KeyError) as e:
+            logger.warning("Rebuilding knowledge base index %s: %s", index_path, e)
+    if knowledge_base is None:
+        knowledge_base = KnowledgeBase(preprocess, **options)
+
+    counts = knowledge_base.update(read_corpus(corpus))
+    if counts['added'] or counts['changed'] or counts['removed'] or not os.path.exists(index_path):
+        knowledge_base.save(index_path)
+    logger.info("Knowledge base %s: %s documents (%s added, %s changed, %s removed) in %.1fms",
+                corpus, len(knowledge_base), counts['added'], counts['changed'], counts['removed'],
+                (time.perf_counter() - started) * 1000)
+    return knowledge_base
+
+
+_lock = threading.Lock()
+_knowledge_bases: Dict[str, Optional[KnowledgeBase]] = {}
+
+
+def shared_knowledge_base() -> Optional[KnowledgeBase]:
+    """
+    Get the process-wide knowledge base, built or loaded on first use.
+
+    KNOWLEDGE_BASE names the corpus (unset disables the knowledge base) and
+    KNOWLEDGE_BASE_INDEX its index file. KB_ANSWER_THRESHOLD and
+    KB_CONTEXT_THRESHOLD set the confidence needed to answer directly and
+    to pass a passage to the API models, KB_ANSWER_MIN_TERMS and
+    KB_ANSWER_MIN_SCORE the matched query terms and BM25 score also needed
+    to answer directly, KB_CONTEXT_PASSAGES how many passages are passed
+    at most.
+
+    Returns:
+        The knowledge base, or None if none is configured or it cannot be loaded
+    """
+    corpus = os.environ.get("KNOWLEDGE_BASE")
+    if not corpus:
+        return None
+    if corpus in _knowledge_bases:
+        return _knowledge_bases[corpus]
+
+    with _lock:
+        if corpus not in _knowledge_bases:
+            try:
+                _knowledge_bases[corpus] = build_index(
+                    corpus,
+                    os.environ.get("KNOWLEDGE_BASE_INDEX") or None,
+                    answer_threshold=float(os.environ.get("KB_ANSWER_THRESHOLD", "0.8")),
+                    context_threshold=float(os.environ.get("KB_CONTEXT_THRESHOLD", "0.2")),
+                    context_passages=int(os.environ.get("KB_CONTEXT_PASSAGES", "3")),
+                    answer_min_terms=int(os.environ.get("KB_ANSWER_MIN_TERMS", "2")),
+                    answer_min_score=float(os.environ.get("KB_ANSWER_MIN_SCORE", "3.0"))
+                )
+            except (OSError, ValueError) as e:
+                logger.error("Knowledge base %s not loaded: %s", corpus, e)
+                _knowledge_bases[corpus] = None
+        return _knowledge_bases[corpus]
+
+
+def main():
+    """Build or update the index of a corpus, optionally running a query against it."""
+    parser = argparse.ArgumentParser(description="Build a knowledge base index")
+    parser.add_argument("corpus", help="JSON or JSONL file of entries, or a directory of .txt/.md files")
+    parser.add_argument("-o", "--output", help=f"index path (defaults to CORPUS{INDEX_SUFFIX})")
+    parser.add_argument("-q", "--query", help="print the best hits for this query")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    try:
+        knowledge_base = build_index(args.corpus, args.output)
+    except (OSError, ValueError) as e:
+        parser.exit(1, f"{e}\n")
+    print(f"Indexed {len(knowledge_base)} documents in {time.perf_counter() - started:.2f}s")
+
+    if args.query:
+        for hit in knowledge_base.search(args.query):
+            print(f"{hit.confidence:.2f}  {hit.matched}  {hit.score:.2f}  {hit.document.id}  {(hit.document.title or hit.document.text)[:80]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from app import app
 
+# Development server with the reloader; production runs `gunicorn` with gunicorn.conf.py
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
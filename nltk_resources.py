@@ -0,0 +1,171 @@
+"""
+Startup handling for the NLTK corpora used by the rule-based fallback.
+This module checks which corpora are installed without downloading anything,
+loads them lazily on first use, and offers an explicit prewarm step.
+"""
+import os
+import logging
+import threading
+import importlib.util
+from functools import lru_cache
+from typing import List, Dict, Optional, Callable
+
+logger = logging.getLogger(__name__)
+
+# nltk is only imported when a corpus is actually needed
+nltk_available = importlib.util.find_spec("nltk") is not None
+
+# Download name -> resource path looked up by nltk.data.find
+RESOURCES = {
+    'punkt': 'tokenizers/punkt',
+    'punkt_tab': 'tokenizers/punkt_tab',  # Needed by word_tokenize in nltk >= 3.8.2
+    'wordnet': 'corpora/wordnet',
+    'stopwords': 'corpora/stopwords',
+    'omw-1.4': 'corpora/omw-1.4',  # Open Multilingual WordNet data
+}
+
+_lock = threading.Lock()
+_status: Dict[str, bool] = {}
+
+
+def is_installed(name: str) -> bool:
+    """
+    Check whether a corpus is on disk, without downloading it.
+
+    Args:
+        name: Download name of the resource, e.g. "wordnet"
+
+    Returns:
+        True if nltk can find the resource locally
+    """
+    if not nltk_available:
+        return False
+
+    with _lock:
+        if name in _status:
+            return _status[name]
+
+    import nltk.data
+    try:
+        nltk.data.find(RESOURCES.get(name, name))
+        found = True
+    except LookupError:
+        found = False
+
+    with _lock:
+        _status[name] = found
+    return found
+
+
+def missing_resources(names: Optional[List[str]] = None) -> List[str]:
+    """
+    List the corpora that are not installed locally.
+
+    Args:
+        names: Resources to check, defaults to all of RESOURCES
+
+    Returns:
+        Download names of the missing resources
+    """
+    return [name for name in (names or RESOURCES) if not is_installed(name)]
+
+
+def download_missing(names: Optional[List[str]] = None, quiet: bool = True) -> List[str]:
+    """
+    Download the corpora that are not installed. This is the only function that uses the network.
+
+    Args:
+        names: Resources to download, defaults to all missing ones
+        quiet: Suppress nltk's download progress output
+
+    Returns:
+        Download names of the resources that are still missing afterwards
+    """
+    if not nltk_available:
+        return list(names or RESOURCES)
+
+    import nltk
+    for name in missing_resources(names):
+        try:
+            nltk.download(name, quiet=quiet)
+        except Exception as e:
+            logger.warning("Error downloading NLTK resource %s: %s", name, e)
+
+    with _lock:
+        _status.clear()
+    return missing_resources(names)
+
+
+@lru_cache(maxsize=None)
+def get_stop_words(language: str = 'english') -> frozenset:
+    """Load a stopword list once; empty if the corpus is not installed."""
+    if not is_installed('stopwords'):
+        return frozenset()
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words(language))
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer() -> Optional[Callable[[str], List[str]]]:
+    """Get nltk's word tokenizer, or None if its punkt data is not installed."""
+    if not nltk_available:
+        return None
+    from nltk.tokenize import word_tokenize
+    try:
+        word_tokenize("warm up")
+    except LookupError:
+        logger.warning("NLTK punkt tokenizer data not installed, tokenization disabled")
+        return None
+    return word_tokenize
+
+
+@lru_cache(maxsize=None)
+def get_lemmatizer():
+    """Get a WordNet lemmatizer, or None if WordNet is not installed. WordNet loads on first lemmatize."""
+    if not is_installed('wordnet'):
+        logger.warning("NLTK WordNet data not installed, lemmatization disabled")
+        return None
+    from nltk.stem import WordNetLemmatizer
+    return WordNetLemmatizer()
+
+
+def prewarm(download: Optional[bool] = None, language: str = 'english') -> Dict[str, bool]:
+    """
+    Load the tokenizer, stopwords and WordNet up front instead of on the first message.
+
+    gunicorn.conf.py calls this in the master before workers fork; the command-line entry point calls it too.
+
+    Args:
+        download: Fetch missing corpora first; defaults to the NLTK_DOWNLOAD environment variable
+        language: Stopword list to load
+
+    Returns:
+        Mapping of component name to whether it is ready
+    """
+    if download is None:
+        download = os.environ.get("NLTK_DOWNLOAD", "").lower() in ("1", "true", "yes")
+
+    if not nltk_available:
+        logger.warning("NLTK not available, nothing to prewarm")
+        return {'tokenizer': False, 'stopwords': False, 'wordnet': False}
+
+    if download:
+        missing = download_missing()
+        if missing:
+            logger.warning("NLTK resources still missing after download: %s", ', '.join(missing))
+        # Loaders may have cached a negative result before the download
+        get_stop_words.cache_clear()
+        get_tokenizer.cache_clear()
+        get_lemmatizer.cache_clear()
+
+    lemmatizer = get_lemmatizer()
+    if lemmatizer is not None:
+        lemmatizer.lemmatize("warming")  # Forces the WordNet corpus to load
+
+    status = {
+        'tokenizer': get_tokenizer() is not None,
+        'stopwords': bool(get_stop_words(language)),
+        'wordnet': lemmatizer is not None,
+    }
+    logger.info("NLTK prewarm finished: %s", status)
+    return status
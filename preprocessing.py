@@ -0,0 +1,137 @@
+"""
+Text preprocessing pipeline for the rule-based fallback.
+This module contains the tokenize / stopword / lemmatize pipeline shared by the chatbot.
+"""
+import logging
+import threading
+from functools import lru_cache
+from typing import List, Dict, Iterable
+
+import nltk_resources
+from nltk_resources import nltk_available
+
+logger = logging.getLogger(__name__)
+
+class TextPreprocessor:
+    """
+    Tokenize, remove stopwords from, and lemmatize text.
+
+    The stopword set is loaded once per pipeline and lemmas are kept in a
+    bounded LRU cache keyed by token, since chat messages reuse a small
+    vocabulary and WordNet lookups are the expensive step. NLTK itself is
+    only loaded on the first call; steps whose corpus is not installed are
+    skipped, so the pipeline also works offline.
+    """
+
+    def __init__(self, cache_size: int = 8192, language: str = 'english'):
+        """
+        Initialize the preprocessing pipeline.
+
+        Args:
+            cache_size: Maximum number of distinct tokens kept in the lemma cache
+            language: Stopword list to load
+        """
+        self.cache_size = cache_size
+        self.language = language
+        self._loaded = False
+        self._load_lock = threading.Lock()
+
+        self._tokenize = None
+        self.stop_words = frozenset()
+        self.lemmatizer = None
+        self._lemmatize = None
+
+    def _load(self):
+        """Load the tokenizer, stopwords and lemmatizer on first use."""
+        with self._load_lock:
+            if self._loaded:
+                return
+            self._tokenize = nltk_resources.get_tokenizer()
+            self.stop_words = nltk_resources.get_stop_words(self.language)
+            self.lemmatizer = nltk_resources.get_lemmatizer()
+            if self.lemmatizer is not None:
+                self._lemmatize = lru_cache(maxsize=self.cache_size)(self.lemmatizer.lemmatize)
+            self._loaded = True
+
+    def preprocess(self, text: str) -> str:
+        """
+        Preprocess text by tokenizing, removing stopwords, and lemmatizing.
+
+        Args:
+            text: Text to preprocess
+
+        Returns:
+            Preprocessed text
+        """
+        if not nltk_available:
+            return text.lower()  # Simple fallback if NLTK is not available
+
+        if not self._loaded:
+            self._load()
+
+        try:
+            # Convert to lowercase
+            text = text.lower()
+
+            # Without tokenizer data there is nothing more to do
+            if self._tokenize is None:
+                return text
+
+            # Tokenize
+            tokens = self._tokenize(text)
+
+            # Remove stopwords and lemmatize
+            stop_words = self.stop_words
+            lemmatize = self._lemmatize
+            if lemmatize is None:
+                filtered_tokens = [word for word in tokens if word not in stop_words]
+            else:
+                filtered_tokens = [lemmatize(word) for word in tokens if word not in stop_words]
+
+            # Join back into a string
+            return ' '.join(filtered_tokens)
+        except Exception as e:
+            logger.warning("Error preprocessing text: %s", e)
+            return text  # Return original text if preprocessing fails
+
+    def preprocess_many(self, texts: Iterable[str]) -> List[str]:
+        """
+        Preprocess a batch of texts.
+
+        Args:
+            texts: Texts to preprocess
+
+        Returns:
+            Preprocessed texts, in the same order
+        """
+        # Replayed traffic repeats messages, so each distinct text is processed once
+        results = {}
+        processed = []
+        for text in texts:
+            if text not in results:
+                results[text] = self.preprocess(text)
+            processed.append(results[text])
+        return processed
+
+    def cache_info(self) -> Dict[str, int]:
+        """
+        Get lemma cache statistics.
+
+        Returns:
+            Dictionary with hits, misses, current size and maximum size of the cache
+        """
+        if self._lemmatize is None:
+            return {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': self.cache_size}
+
+        info = self._lemmatize.cache_info()
+        return {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'maxsize': info.maxsize
+        }
+
+    def clear_cache(self):
+        """Empty the lemma cache and reset its counters."""
+        if self._lemmatize is not None:
+            self._lemmatize.cache_clear()
@@ -0,0 +1,297 @@
+"""
+On-demand request profiling.
+This module runs selected requests under cProfile and keeps the most recent captures in a bounded
+ring, so a slow request can be inspected as a pstats file or as collapsed stacks for a flame graph.
+"""
+import os
+import io
+import hmac
+import time
+import pstats
+import random
+import marshal
+import cProfile
+import logging
+import threading
+from collections import deque
+from typing import List, Dict, Optional, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Request header carrying PROFILE_TOKEN, both to profile a request and to read the captures
+PROFILE_HEADER = 'X-Profile-Token'
+
+# Stack depth and smallest frame weight (microseconds) followed when deriving collapsed stacks
+MAX_STACK_DEPTH = 64
+MIN_FRAME_US = 1.0
+
+
+def _label(function: Tuple[str, int, str]) -> str:
+    """Format a pstats function key as directory/module:line(name), without the semicolons collapsed stacks split on."""
+    filename, line, name = function
+    if filename == '~':
+        return name.replace(';', ',')
+    directory, module = os.path.split(os.path.splitext(filename)[0])
+    return f"{os.path.basename(directory)}/{module}:{line}({name})".replace(';', ',')
+
+
+class _Snapshot:
+    """Stand-in for a finished profile, which is what pstats.Stats loads data from besides files."""
+
+    def __init__(self, stats: Dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class Capture:
+    """One profiled request and its pstats data."""
+
+    __slots__ = ('id', 'endpoint', 'method', 'path', 'reason', 'started', 'duration', 'status',
+                 '_profile', '_started_clock', 'stats')
+
+    def __init__(self, capture_id: int, endpoint: str, method: str, path: str, reason: str):
+        self.id = capture_id
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.started = time.time()
+        self.duration: Optional[float] = None
+        self.status: Optional[int] = None
+        self._profile = cProfile.Profile()
+        self._started_clock = time.perf_counter()
+        self.stats: Dict[Tuple[str, int, str], Tuple] = {}
+
+    def summary(self, functions: int = 10) -> Dict[str, Any]:
+        """
+        Describe the capture.
+
+        Args:
+            functions: Number of functions listed, by cumulative time
+
+        Returns:
+            Dictionary with the request, its duration and the functions it spent the most time in
+        """
+        ranked = sorted(self.stats.items(), key=lambda item: item[1][3], reverse=True)[:functions]
+        return {
+            'id': self.id,
+            'endpoint': self.endpoint,
+            'method': self.method,
+            'path': self.path,
+            'reason': self.reason,
+            'status': self.status,
+            'started': self.started,
+            'duration_ms': None if self.duration is None else round(self.duration * 1000, 3),
+            'top_cumulative': [
+                {'function': _label(function), 'calls': calls, 'own_ms': round(own * 1000, 3),
+                 'cumulative_ms': round(cumulative * 1000, 3)}
+                for function, (_, calls, own, cumulative, _) in ranked
+            ]
+        }
+
+    def pstats_bytes(self) -> bytes:
+        """Get the capture in the file format read by pstats.Stats, snakeviz and similar tools."""
+        return marshal.dumps(self.stats)
+
+    def report(self, sort: str = 'cumulative', limit: int = 50) -> str:
+        """
+        Get the capture as a pstats text table.
+
+        Args:
+            sort: pstats sort key, e.g. "cumulative", "tottime" or "calls"
+            limit: Number of functions listed
+
+        Returns:
+            The table
+
+        Raises:
+            ValueError: If the sort key is unknown
+        """
+        if sort not in pstats.Stats.sort_arg_dict_default:
+            raise ValueError(f"Unknown sort key '{sort}'")
+        out = io.StringIO()
+        stats = pstats.Stats(_Snapshot(dict(self.stats)), stream=out)
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def collapsed(self) -> str:
+        """
+        Get the capture as collapsed stacks ("a;b;c microseconds" lines), e.g. for flamegraph.pl or speedscope.
+
+        cProfile records time per caller and callee pair rather than whole
+        stacks, so a function's time below each caller is split in proportion
+        to the time spent in it from that caller. The stacks are therefore an
+        approximation where one function is reached along several paths.
+        """
+        stats = self.stats
+        callees: Dict[Tuple, List[Tuple[Tuple, float, float]]] = {}
+        for function, (_, _, _, _, callers) in stats.items():
+            for caller, (_, _, own, cumulative) in callers.items():
+                callees.setdefault(caller, []).append((function, own, cumulative))
+
+        weights: Dict[str, float] = {}
+
+        def walk(function: Tuple, stack: List[str], scale: float):
+            for callee, own, cumulative in callees.get(function, ()):
+                label = _label(callee)
+                if label in stack or cumulative * scale * 1e6 < MIN_FRAME_US:
+                    continue
+                path = stack + [label]
+                key = ';'.join(path)
+                weights[key] = weights.get(key, 0.0) + own * scale * 1e6
+                total = stats[callee][3]
+                if len(path) < MAX_STACK_DEPTH and total > 0:
+                    walk(callee, path, scale * cumulative / total)
+
+        roots = [function for function, entry in stats.items()
+                 if not any(caller in stats for caller in entry[4])]
+        for root in roots:
+            label = _label(root)
+            weights[label] = weights.get(label, 0.0) + stats[root][2] * 1e6
+            walk(root, [label], 1.0)
+
+        return ''.join(f"{stack} {round(weight)}\n" for stack, weight in weights.items() if round(weight) > 0)
+
+
+class Profiler:
+    """
+    Profile requests asked for by header or picked by sampling, keeping the last captures.
+
+    One request is profiled at a time per process: a request asking for a
+    profile while another one is captured runs unprofiled. The profiler only
+    sees the thread it was started on, so calls the dispatcher runs on its
+    worker threads appear as time spent waiting for them.
+    """
+
+    def __init__(self, token: str, sample_rate: float = 0.0, capacity: int = 20):
+        """
+        Initialize the profiler.
+
+        Args:
+            token: Secret a request presents to be profiled and to read captures
+            sample_rate: Fraction of requests profiled without asking
+            capacity: Number of captures kept; the oldest is dropped past this
+        """
+        self.token = token
+        self.sample_rate = sample_rate
+        self.capacity = capacity
+
+        self._captures: 'deque[Capture]' = deque(maxlen=capacity)
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._captured = 0
+        self._skipped = 0
+
+    def authorized(self, token: Optional[str]) -> bool:
+        """Check a presented token against the profiling token in constant time."""
+        return bool(token) and hmac.compare_digest(token.encode(), self.token.encode())
+
+    def wants(self, token: Optional[str]) -> Optional[str]:
+        """
+        Decide whether to profile a request.
+
+        Args:
+            token: Value of the request's PROFILE_HEADER, if any
+
+        Returns:
+            "requested" or "sampled" if the request should be profiled, else None
+        """
+        if token is not None and self.authorized(token):
+            return 'requested'
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return 'sampled'
+        return None
+
+    def start(self, endpoint: str, method: str, path: str, reason: str) -> Optional[Capture]:
+        """
+        Start profiling the current thread for a request.
+
+        Returns:
+            The capture to pass to finish() on the same thread, or None if another request is being profiled
+        """
+        if not self._active.acquire(blocking=False):
+            with self._lock:
+                self._skipped += 1
+            logger.debug("Not profiling %s %s: another request is being profiled", method, path)
+            return None
+        try:
+            with self._lock:
+                capture = Capture(self._next_id, endpoint, method, path, reason)
+                self._next_id += 1
+            capture._profile.enable()
+        except BaseException:
+            self._active.release()
+            raise
+        return capture
+
+    def finish(self, capture: Capture, status: Optional[int] = None):
+        """Stop profiling a request and keep its capture."""
+        try:
+            capture._profile.disable()
+            capture.duration = time.perf_counter() - capture._started_clock
+            capture._profile.create_stats()
+            capture.stats = capture._profile.stats
+            capture._profile = None
+            capture.status = status
+        finally:
+            self._active.release()
+        with self._lock:
+            self._captures.append(capture)
+            self._captured += 1
+        logger.info("Profiled %s %s (%s) in %.1fms as capture %s", capture.method, capture.path,
+                    capture.reason, capture.duration * 1000, capture.id)
+
+    def captures(self) -> List[Capture]:
+        """Get the kept captures, newest first."""
+        with self._lock:
+            return list(reversed(self._captures))
+
+    def get(self, capture_id: int) -> Optional[Capture]:
+        """Get a kept capture by id."""
+        with self._lock:
+            for capture in self._captures:
+                if capture.id == capture_id:
+                    return capture
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get profiler statistics.
+
+        Returns:
+            Dictionary with the settings and the captured and skipped request counts
+        """
+        with self._lock:
+            return {
+                'sample_rate': self.sample_rate,
+                'capacity': self.capacity,
+                'kept': len(self._captures),
+                'captured': self._captured,
+                'skipped_busy': self._skipped
+            }
+
+
+def create_profiler() -> Optional[Profiler]:
+    """
+    Create the request profiler configured by environment variables.
+
+    PROFILE_TOKEN enables profiling: requests presenting it in the
+    X-Profile-Token header are profiled, and the same header authorizes
+    reading the captures. PROFILE_SAMPLE_RATE additionally profiles that
+    fraction of requests, and PROFILE_CAPACITY sets how many captures are
+    kept.
+
+    Returns:
+        The profiler, or None if profiling is disabled
+    """
+    token = os.environ.get("PROFILE_TOKEN")
+    if not token:
+        if float(os.environ.get("PROFILE_SAMPLE_RATE", "0")) > 0:
+            logger.warning("PROFILE_SAMPLE_RATE is set without PROFILE_TOKEN; profiling stays disabled")
+        return None
+    return Profiler(token,
+                    sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", "0")),
+                    capacity=max(1, int(os.environ.get("PROFILE_CAPACITY", "20"))))
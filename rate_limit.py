@@ -0,0 +1,358 @@
+"""
+Per-client rate limiting and per-backend admission control.
+This module contains a token-bucket rate limiter with an in-process store and a SQLite store
+shared by worker processes, and admission gates bounding the calls in flight to each backend.
+"""
+import os
+import math
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, Any
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """Raised when no backend can take another call; the request should be retried later."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"All backends are at capacity, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def retry_after_header(seconds: float) -> str:
+    """Format a delay as a Retry-After header value (whole seconds, at least 1)."""
+    return str(max(1, math.ceil(seconds)))
+
+
+class RateLimitStore:
+    """
+    Interface for token bucket storage.
+
+    consume() refills a bucket for the time since it was last used and takes
+    tokens from it in one atomic step.
+    """
+
+    def consume(self, key: str, rate: float, burst: float, cost: float, now: float) -> Tuple[bool, float]:
+        """
+        Take tokens from a bucket.
+
+        Args:
+            key: Bucket key, e.g. a client id
+            rate: Tokens added per second
+            burst: Bucket capacity; a new bucket starts full
+            cost: Tokens the request needs
+            now: Current time in seconds (wall clock, so processes agree)
+
+        Returns:
+            Tuple of whether the tokens were taken and the tokens left afterwards
+        """
+        raise NotImplementedError
+
+
+def _refill(tokens: float, updated: float, rate: float, burst: float, now: float) -> float:
+    """Get a bucket's tokens after refilling it up to the current time."""
+    return min(burst, tokens + max(0.0, now - updated) * rate)
+
+
+class InMemoryRateLimitStore(RateLimitStore):
+    """
+    Keep buckets in a process-local dictionary.
+
+    Only the `max_keys` most recently used buckets are kept. An evicted bucket
+    starts full again, which is what an idle client's bucket would have
+    refilled to anyway.
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def consume(self, key: str, rate: float, burst: float, cost: float, now: float) -> Tuple[bool, float]:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            tokens = burst if bucket is None else _refill(bucket[0], bucket[1], rate, burst, now)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed, tokens
+
+
+class SQLiteRateLimitStore(RateLimitStore):
+    """
+    Keep buckets in a SQLite database shared by every worker process.
+
+    Each consume() runs in an immediate transaction, so concurrent workers
+    never spend the same tokens twice. Buckets idle long enough to be full
+    again are pruned now and then.
+    """
+
+    # Number of consume() calls between prunes
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: str):
+        """
+        Open (and if needed create) the database.
+
+        Args:
+            path: Database file path
+        """
+        self.path = path
+        self._local = threading.local()
+        self._calls = 0
+
+        # The schema is set up on a connection of its own, so none is left open when a preloading server forks
+        connection = sqlite3.connect(path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        connection.commit()
+        connection.close()
+        logger.info("Rate limit store opened at %s", path)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, in autocommit mode so transactions are explicit."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def consume(self, key: str, rate: float, burst: float, cost: float, now: float) -> Tuple[bool, float]:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = burst if row is None else _refill(row[0], row[1], rate, burst, now)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            connection.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                               (key, tokens, now))
+
+            self._calls += 1
+            if self._calls % self.PRUNE_EVERY == 0 and rate > 0:
+                connection.execute("DELETE FROM buckets WHERE updated < ?", (now - burst / rate,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return allowed, tokens
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter keyed by client.
+
+    Each client may send `burst` requests at once and `rate` requests per
+    second on average after that.
+    """
+
+    def __init__(self, rate: float, burst: float, store: Optional[RateLimitStore] = None,
+                 clock=time.time):
+        """
+        Initialize the rate limiter.
+
+        Args:
+            rate: Requests per second allowed on average
+            burst: Requests allowed at once
+            store: Bucket storage; defaults to an in-process store
+            clock: Wall-clock time source
+        """
+        self.rate = rate
+        self.burst = burst
+        self.store = store or InMemoryRateLimitStore()
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._allowed = 0
+        self._limited = 0
+
+    def check(self, key: str, cost: float = 1.0) -> Tuple[bool, float]:
+        """
+        Admit or refuse a client's request.
+
+        Args:
+            key: Client id
+            cost: Tokens the request needs; capped at the burst so it can eventually pass
+
+        Returns:
+            Tuple of whether the request may proceed and, if not, the seconds until it would
+        """
+        cost = min(cost, self.burst)
+        allowed, tokens = self.store.consume(key, self.rate, self.burst, cost, self.clock())
+        with self._lock:
+            if allowed:
+                self._allowed += 1
+            else:
+                self._limited += 1
+        if allowed:
+            return True, 0.0
+        return False, (cost - tokens) / self.rate if self.rate > 0 else 60.0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get rate limiter statistics.
+
+        Returns:
+            Dictionary with the limits and the allowed and limited request counts
+        """
+        with self._lock:
+            return {
+                'rate_per_s': self.rate,
+                'burst': self.burst,
+                'store': type(self.store).__name__,
+                'allowed': self._allowed,
+                'limited': self._limited
+            }
+
+
+class AdmissionGate:
+    """
+    Bound the calls in flight to one backend.
+
+    Up to `limit` calls run at once. Up to `max_queue` more callers may wait
+    up to `queue_timeout` seconds for a slot; any others are refused at once,
+    so excess load is turned away instead of piling up behind the backend.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int = 0, queue_timeout: float = 0.0):
+        """
+        Initialize the gate.
+
+        Args:
+            name: Backend name, used in logs
+            limit: Maximum calls in flight
+            max_queue: Maximum callers waiting for a slot
+            queue_timeout: Seconds a caller waits for a slot
+        """
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._rejected = 0
+
+    def acquire(self, wait: bool = True) -> bool:
+        """
+        Take a slot for a call.
+
+        Args:
+            wait: Queue for a slot if none is free; False refuses at once
+
+        Returns:
+            True if a slot was taken; the caller must release() it when the call ends
+        """
+        with self._condition:
+            if self._in_flight < self.limit:
+                self._in_flight += 1
+                self._admitted += 1
+                return True
+
+            if not wait or self._waiting >= self.max_queue or self.queue_timeout <= 0:
+                self._rejected += 1
+                return False
+
+            self._waiting += 1
+            try:
+                admitted = self._condition.wait_for(lambda: self._in_flight < self.limit, self.queue_timeout)
+            finally:
+                self._waiting -= 1
+            if admitted:
+                self._in_flight += 1
+                self._admitted += 1
+            else:
+                self._rejected += 1
+            return admitted
+
+    def release(self):
+        """Free the slot of a finished call."""
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get gate statistics.
+
+        Returns:
+            Dictionary with the limits, current occupancy and admitted/rejected counts
+        """
+        with self._condition:
+            return {
+                'limit': self.limit,
+                'max_queue': self.max_queue,
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'admitted': self._admitted,
+                'rejected': self._rejected
+            }
+
+
+def create_rate_limiter() -> Optional[RateLimiter]:
+    """
+    Create the rate limiter configured by environment variables.
+
+    Rate limiting is off unless RATE_LIMIT sets the requests per minute
+    allowed per client. RATE_LIMIT_BURST sets the requests allowed at once,
+    and RATE_LIMIT_STORE a SQLite file shared by worker processes; without
+    it each process keeps its own buckets, so N workers allow N times the
+    configured rate.
+
+    Returns:
+        The rate limiter, or None if it is disabled
+    """
+    per_minute = float(os.environ.get("RATE_LIMIT", "0"))
+    if per_minute <= 0:
+        return None
+
+    path = os.environ.get("RATE_LIMIT_STORE")
+    workers = int(os.environ.get("WEB_CONCURRENCY") or "1")
+    if not path and workers > 1:
+        logger.warning("RATE_LIMIT applies per worker process: %s workers allow %s times the rate; "
+                       "set RATE_LIMIT_STORE to share the limit", workers, workers)
+    store = SQLiteRateLimitStore(path) if path else InMemoryRateLimitStore()
+    burst = float(os.environ.get("RATE_LIMIT_BURST", "20"))
+    return RateLimiter(per_minute / 60.0, burst, store)
+
+
+def create_admission_gates() -> Dict[str, AdmissionGate]:
+    """
+    Create the per-backend admission gates configured by environment variables.
+
+    ADMISSION_LIMIT sets the calls in flight per API backend and process
+    (0 disables the gates), ADMISSION_LIMIT_OPENAI / ADMISSION_LIMIT_GEMINI
+    override it per backend, and ADMISSION_QUEUE / ADMISSION_QUEUE_TIMEOUT
+    size the wait queue.
+
+    Returns:
+        Backend name -> gate; backends without a gate are not limited
+    """
+    default_limit = int(os.environ.get("ADMISSION_LIMIT", "32"))
+    max_queue = int(os.environ.get("ADMISSION_QUEUE", "16"))
+    queue_timeout = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "1"))
+
+    gates = {}
+    for backend in ('openai', 'gemini'):
+        limit = int(os.environ.get(f"ADMISSION_LIMIT_{backend.upper()}") or default_limit)
+        if limit > 0:
+            gates[backend] = AdmissionGate(backend, limit, max_queue, queue_timeout)
+    return gates
@@ -0,0 +1,252 @@
+"""
+Response caching in front of backend dispatch.
+This module contains an LRU cache with TTL expiry and an optional SQLite tier, keyed by the
+normalized user input plus a hash of the conversation so far.
+"""
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Iterable
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+_TRAILING_PUNCTUATION = re.compile(r'[\s.!?,;:]+$')
+
+
+class ErrorResponse(str):
+    """A response string produced by a failure; never cached."""
+
+
+def normalize_input(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation so trivial variants share a key."""
+    text = _WHITESPACE.sub(' ', text.strip().lower())
+    return _TRAILING_PUNCTUATION.sub('', text)
+
+
+class ResponseCache:
+    """
+    Cache chatbot responses for repeated prompts.
+
+    The key is the normalized user input, the model preference and a hash of
+    the whole conversation so far, so an opener like "hi" is shared by every
+    new conversation while follow-ups only hit after the same exchanges.
+    The API models see far more history than a few exchanges, so a key over
+    only the recent ones could hand one conversation an answer built from
+    another's earlier messages; requests in conversations longer than
+    context_turns exchanges are not cached at all. Entries expire after a TTL;
+    the in-memory tier evicts least recently used entries and the optional
+    SQLite tier survives restarts and is shared by workers.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600, disk_path: Optional[str] = None,
+                 context_turns: int = 2, disabled_backends: Iterable[str] = ('nltk',)):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of entries kept in memory
+            ttl: Seconds an entry stays valid
+            disk_path: SQLite file for the persistent tier, or None for memory only
+            context_turns: Longest history, in exchanges, whose requests are cached
+            disabled_backends: Backends whose responses are never cached
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self.context_turns = context_turns
+        self.disabled_backends = frozenset(disabled_backends)
+
+        self._entries = OrderedDict()  # key -> (expires_at, response)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._stores = 0
+
+        if disk_path:
+            # The schema is set up on a connection of its own, so none is left open when a preloading server forks
+            connection = sqlite3.connect(disk_path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    backend TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            connection.commit()
+            connection.close()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection to the disk tier."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.disk_path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def make_key(self, user_input: str, chat_history: Optional[List[Dict[str, str]]],
+                 preference: str) -> Optional[str]:
+        """
+        Build the cache key for a request.
+
+        Args:
+            user_input: The user's message
+            chat_history: List of previous exchanges in the conversation
+            preference: The chatbot's model preference
+
+        Returns:
+            A hex digest identifying the request and its whole history, or None
+            if the conversation is too long to cache
+        """
+        context = chat_history or []
+        if len(context) > self.context_turns:
+            return None
+        digest = hashlib.sha256()
+        digest.update(preference.encode())
+        digest.update(b'\x00')
+        digest.update(normalize_input(user_input).encode())
+        for exchange in context:
+            digest.update(b'\x00')
+            digest.update(exchange.get('user', '').encode())
+            digest.update(b'\x01')
+            digest.update(exchange.get('bot', '').encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached response.
+
+        Args:
+            key: Key from make_key
+
+        Returns:
+            The cached response, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        if self.disk_path:
+            try:
+                row = self._connection().execute(
+                    "SELECT response, expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning("Error reading response cache: %s", e)
+                row = None
+            if row is not None:
+                with self._lock:
+                    self._remember(key, row[1], row[0])
+                    self._hits += 1
+                    self._disk_hits += 1
+                return row[0]
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, key: str, response: str, backend: str):
+        """
+        Store a response unless its backend opted out or it reports an error.
+
+        Args:
+            key: Key from make_key
+            response: The chatbot's response
+            backend: Name of the backend that produced it
+        """
+        if backend in self.disabled_backends or isinstance(response, ErrorResponse) or not response:
+            return
+
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, str(response))
+            self._stores += 1
+            purge = self._stores % 1000 == 0
+
+        if self.disk_path:
+            try:
+                connection = self._connection()
+                with connection:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO responses (key, response, backend, expires_at) VALUES (?, ?, ?, ?)",
+                        (key, str(response), backend, expires_at)
+                    )
+                    if purge:
+                        connection.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+            except sqlite3.Error as e:
+                logger.warning("Error writing response cache: %s", e)
+
+    def _remember(self, key: str, expires_at: float, response: str):
+        """Add an entry to the memory tier; the caller holds the lock."""
+        self._entries[key] = (expires_at, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every cached response and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._hits = self._disk_hits = self._misses = self._stores = 0
+        if self.disk_path:
+            connection = self._connection()
+            with connection:
+                connection.execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get cache statistics.
+
+        Returns:
+            Dictionary with hits, disk hits, misses, hit rate and memory size
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'disk_hits': self._disk_hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'disabled_backends': sorted(self.disabled_backends)
+            }
+
+
+def create_response_cache() -> Optional[ResponseCache]:
+    """
+    Create the response cache configured by environment variables.
+
+    RESPONSE_CACHE=0 disables caching; RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_PATH and RESPONSE_CACHE_DISABLED_BACKENDS (comma separated)
+    tune it.
+
+    Returns:
+        The response cache, or None if caching is disabled
+    """
+    if os.environ.get("RESPONSE_CACHE", "1").lower() in ("0", "false", "no"):
+        return None
+
+    disabled = os.environ.get("RESPONSE_CACHE_DISABLED_BACKENDS", "nltk")
+    return ResponseCache(
+        maxsize=int(os.environ.get("RESPONSE_CACHE_SIZE", "1024")),
+        ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "3600")),
+        disk_path=os.environ.get("RESPONSE_CACHE_PATH") or None,
+        disabled_backends=[name.strip() for name in disabled.split(",") if name.strip()]
+    )
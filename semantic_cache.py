@@ -0,0 +1,422 @@
+"""
+Semantic near-duplicate response cache.
+This module embeds user inputs with a hashed TF-IDF vectorizer and keeps them in a NumPy
+index, so paraphrases of a cached prompt can reuse its response.
+"""
+import os
+import json
+import atexit
+import re
+import zlib
+import hashlib
+import logging
+import weakref
+import threading
+from typing import List, Dict, Optional, Callable, Iterable, Tuple
+
+try:
+    import numpy as np
+    numpy_available = True
+except ImportError:
+    numpy_available = False
+
+from response_cache import ErrorResponse
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r'\w+')
+
+# Relative weight of each feature family in the embedding
+WORD_WEIGHT = 1.0
+BIGRAM_WEIGHT = 0.7
+TRIGRAM_WEIGHT = 0.3
+
+# Bump when the layout of the saved vectors or metadata changes
+FORMAT_VERSION = 2
+
+
+class HashingVectorizer:
+    """
+    Embed text as a fixed-size hashed TF-IDF vector.
+
+    Features are words, word bigrams and character trigrams within words, so
+    inflections like "joke" / "jokes" still overlap. Features are hashed
+    with CRC32, which is stable across processes, into `dim` signed buckets.
+    Document frequencies are counted per bucket as texts are added, so the
+    IDF weights change with every text; stored texts are kept as term
+    vectors and weighted with the current IDF when compared.
+    """
+
+    def __init__(self, dim: int = 512, preprocess: Optional[Callable[[str], str]] = None):
+        """
+        Initialize the vectorizer.
+
+        Args:
+            dim: Number of hash buckets
+            preprocess: Callable normalizing text before it is split into words; defaults to lowercasing
+        """
+        self.dim = dim
+        self.preprocess = preprocess or str.lower
+        self.documents = 0
+        self.document_frequency = np.zeros(dim, dtype=np.float32)
+
+    def _features(self, text: str) -> List[Tuple[str, float]]:
+        """List the weighted features of a text."""
+        tokens = _WORD.findall(self.preprocess(text))
+        features = []
+        for token in tokens:
+            features.append(('w:' + token, WORD_WEIGHT))
+            padded = f'#{token}#'
+            for i in range(len(padded) - 2):
+                features.append(('c:' + padded[i:i + 3], TRIGRAM_WEIGHT))
+        for first, second in zip(tokens, tokens[1:]):
+            features.append((f'b:{first} {second}', BIGRAM_WEIGHT))
+        return features
+
+    def term_vector(self, text: str) -> 'np.ndarray':
+        """Get the sublinear term-frequency vector of a text."""
+        counts = np.zeros(self.dim, dtype=np.float32)
+        for feature, weight in self._features(text):
+            hashed = zlib.crc32(feature.encode())
+            sign = 1.0 if hashed & 0x80000000 else -1.0
+            counts[hashed % self.dim] += sign * weight
+        return np.sign(counts) * np.log1p(np.abs(counts))
+
+    def transform(self, text: str) -> 'np.ndarray':
+        """
+        Embed a text.
+
+        Args:
+            text: Text to embed
+
+        Returns:
+            An L2-normalized float32 vector of length `dim`
+        """
+        vector = self.term_vector(text) * self.idf()
+        norm = float(np.linalg.norm(vector))
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def idf(self) -> 'np.ndarray':
+        """Get the current IDF weight of each bucket."""
+        return np.log((1.0 + self.documents) / (1.0 + self.document_frequency)) + 1.0
+
+    def observe(self, term_vector: 'np.ndarray'):
+        """Count the buckets of a text's term vector in the document frequencies."""
+        self.documents += 1
+        self.document_frequency += term_vector != 0
+
+
+class SemanticCache:
+    """
+    Return cached responses for inputs that are near-duplicates of earlier ones.
+
+    Term vectors live in a preallocated float32 matrix searched by brute
+    force (one matrix-vector product), about a millisecond at 10k entries.
+    Both sides are weighted with the current IDF at query time, so scores
+    stay comparable as the corpus grows; the weighted row norms are
+    recomputed on the first lookup after an entry is added.
+
+    Entries are namespaced by model preference and a hash of the whole
+    conversation so far: the API models see far more than the last
+    exchange, so an answer is only reused after the same history, and
+    requests in conversations longer than context_turns exchanges are not
+    cached. When full, the least recently used entry is replaced.
+
+    With a path, the matrix is mapped copy-on-write from a file and metadata
+    is kept next to it: entries added by a process stay private to it until
+    flush() replaces the files. Only one process saves the cache; when the
+    process holding it forks (a preloading server starting its worker), the
+    child takes over and the parent stops saving.
+    """
+
+    def __init__(self, capacity: int = 10000, dim: int = 512, threshold: float = 0.75,
+                 path: Optional[str] = None, context_turns: int = 1,
+                 preprocess: Optional[Callable[[str], str]] = None,
+                 disabled_backends: Iterable[str] = ('nltk',)):
+        """
+        Initialize the semantic cache.
+
+        Args:
+            capacity: Maximum number of entries
+            dim: Embedding dimension
+            threshold: Minimum cosine similarity for a hit
+            path: File prefix for memory-mapped persistence, or None to stay in memory
+            context_turns: Longest history, in exchanges, whose requests are cached
+            preprocess: Callable normalizing text before embedding, e.g. the NLTK preprocessing pipeline
+            disabled_backends: Backends whose responses are never cached
+        """
+        if not numpy_available:
+            raise RuntimeError("The semantic cache requires numpy")
+
+        self.capacity = capacity
+        self.dim = dim
+        self.threshold = threshold
+        self.path = path
+        self.context_turns = context_turns
+        self.disabled_backends = frozenset(disabled_backends)
+        self.vectorizer = HashingVectorizer(dim, preprocess)
+
+        self._reset()
+        self._writer = True
+        if path:
+            self._open()
+            # Registered through a weak reference, as fork handlers cannot be removed
+            reference = weakref.ref(self)
+            os.register_at_fork(after_in_parent=lambda: _on_fork(reference, parent=True),
+                                after_in_child=lambda: _on_fork(reference, parent=False))
+
+    def _reset(self):
+        """Empty the cache in memory."""
+        self._lock = threading.Lock()
+        self._size = 0
+        self._clock = 0
+        self._responses: List[Optional[str]] = [None] * self.capacity
+        self._namespaces = np.zeros(self.capacity, dtype=np.int64)
+        self._last_used = np.zeros(self.capacity, dtype=np.int64)
+        self._hits = 0
+        self._misses = 0
+        self._vectors = np.zeros((self.capacity, self.dim), dtype=np.float32)
+        self._norms = None  # IDF-weighted norm of each row, None once an entry is added
+        self.vectorizer.documents = 0
+        self.vectorizer.document_frequency[:] = 0
+
+    def _open(self):
+        """Map the saved vectors copy-on-write and restore the entries saved with them."""
+        vectors_path = f"{self.path}.vectors"
+        if not os.path.exists(vectors_path):
+            return
+        if os.path.getsize(vectors_path) != self.capacity * self.dim * 4:
+            logger.warning("Semantic cache file has a different shape, starting empty")
+            return
+        # Writes to a copy-on-write mapping stay in this process, so other processes never see them
+        self._vectors = np.memmap(vectors_path, dtype=np.float32, mode='c', shape=(self.capacity, self.dim))
+        self._load_metadata()
+
+    def _after_fork(self, parent: bool):
+        """Hand saving over to a forked child, which resumes from what was last saved."""
+        if parent:
+            self._writer = False
+            return
+        self._reset()
+        self._open()
+        self._writer = True
+
+    def namespace(self, chat_history: Optional[List[Dict[str, str]]], preference: str) -> Optional[int]:
+        """Get the namespace id of a request's model preference and history; None if the conversation is too long."""
+        context = chat_history or []
+        if len(context) > self.context_turns:
+            return None
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(preference.encode())
+        for exchange in context:
+            digest.update(b'\x00' + exchange.get('user', '').encode())
+            digest.update(b'\x01' + exchange.get('bot', '').encode())
+        return int.from_bytes(digest.digest(), 'little', signed=True)
+
+    def search(self, user_input: str, namespace: int) -> Tuple[Optional[str], float]:
+        """
+        Find the most similar cached input in a namespace.
+
+        Args:
+            user_input: The user's message
+            namespace: Id from namespace()
+
+        Returns:
+            Tuple of the cached response (None below the threshold) and the best similarity
+        """
+        query = self.vectorizer.term_vector(user_input)
+        with self._lock:
+            if self._size == 0:
+                self._misses += 1
+                return None, 0.0
+
+            idf = self.vectorizer.idf()
+            query *= idf
+            norm = float(np.linalg.norm(query))
+            if norm > 0:
+                query /= norm
+            if self._norms is None:
+                rows = self._vectors[:self._size]
+                self._norms = np.sqrt((rows * rows) @ (idf * idf))
+                self._norms[self._norms == 0] = 1.0
+            scores = (self._vectors[:self._size] @ (query * idf)) / self._norms
+            scores[self._namespaces[:self._size] != namespace] = -1.0
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+
+            if similarity < self.threshold:
+                self._misses += 1
+                return None, similarity
+
+            self._clock += 1
+            self._last_used[best] = self._clock
+            self._hits += 1
+            return self._responses[best], similarity
+
+    def get(self, user_input: str, chat_history: Optional[List[Dict[str, str]]], preference: str) -> Optional[str]:
+        """Look up a response for a request; None on a miss or if the request is not cacheable."""
+        namespace = self.namespace(chat_history, preference)
+        if namespace is None:
+            return None
+        response, _ = self.search(user_input, namespace)
+        return response
+
+    def add(self, user_input: str, chat_history: Optional[List[Dict[str, str]]], preference: str,
+            response: str, backend: str):
+        """
+        Cache a response unless its backend opted out or it reports an error.
+
+        Args:
+            user_input: The user's message
+            chat_history: List of previous exchanges in the conversation
+            preference: The chatbot's model preference
+            response: The chatbot's response
+            backend: Name of the backend that produced it
+        """
+        if backend in self.disabled_backends or isinstance(response, ErrorResponse) or not response:
+            return
+
+        namespace = self.namespace(chat_history, preference)
+        if namespace is None:
+            return
+        vector = self.vectorizer.term_vector(user_input)
+
+        with self._lock:
+            self.vectorizer.observe(vector)
+            self._norms = None
+            if self._size < self.capacity:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+
+            self._clock += 1
+            self._vectors[slot] = vector
+            self._namespaces[slot] = namespace
+            self._last_used[slot] = self._clock
+            self._responses[slot] = str(response)
+
+    def _load_metadata(self):
+        """Restore entries saved by flush()."""
+        try:
+            with open(f"{self.path}.meta.json") as f:
+                meta = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Semantic cache metadata not loaded, starting empty: %s", e)
+            return
+
+        if meta.get('format', 1) != FORMAT_VERSION:
+            logger.warning("Semantic cache file has an older format, starting empty")
+            return
+        if meta.get('dim') != self.dim or meta.get('capacity') != self.capacity:
+            logger.warning("Semantic cache file has a different shape, starting empty")
+            return
+        if zlib.crc32(self._vectors[:meta['size']].tobytes()) != meta.get('vectors_crc'):
+            logger.warning("Semantic cache vectors do not match their metadata, starting empty")
+            return
+
+        self._size = meta['size']
+        self._clock = meta['clock']
+        self._responses[:self._size] = meta['responses']
+        self._namespaces[:self._size] = meta['namespaces']
+        self._last_used[:self._size] = meta['last_used']
+        self.vectorizer.documents = meta['documents']
+        self.vectorizer.document_frequency[:] = meta['document_frequency']
+
+    def flush(self):
+        """Save the vectors and the metadata, replacing the files; a process that handed saving over does nothing."""
+        if not self.path or not self._writer:
+            return
+
+        with self._lock:
+            vectors = np.array(self._vectors)
+            meta = {
+                'format': FORMAT_VERSION,
+                'dim': self.dim,
+                'capacity': self.capacity,
+                'size': self._size,
+                'vectors_crc': zlib.crc32(vectors[:self._size].tobytes()),
+                'clock': self._clock,
+                'responses': self._responses[:self._size],
+                'namespaces': self._namespaces[:self._size].tolist(),
+                'last_used': self._last_used[:self._size].tolist(),
+                'documents': self.vectorizer.documents,
+                'document_frequency': self.vectorizer.document_frequency.tolist()
+            }
+
+        # Replacing the files leaves the pages mapped by running processes untouched
+        temporary = f"{self.path}.vectors.{os.getpid()}.tmp"
+        vectors.tofile(temporary)
+        os.replace(temporary, f"{self.path}.vectors")
+        temporary = f"{self.path}.meta.json.{os.getpid()}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temporary, f"{self.path}.meta.json")
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get cache statistics.
+
+        Returns:
+            Dictionary with hits, misses, hit rate, size and capacity
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'size': self._size,
+                'capacity': self.capacity,
+                'threshold': self.threshold
+            }
+
+
+def _on_fork(reference: 'weakref.ref[SemanticCache]', parent: bool):
+    """Pass a fork to the cache, if it still exists."""
+    cache = reference()
+    if cache is not None:
+        cache._after_fork(parent)
+
+
+def create_semantic_cache(preprocess: Optional[Callable[[str], str]] = None) -> Optional[SemanticCache]:
+    """
+    Create the semantic cache if SEMANTIC_CACHE=1 and numpy is installed.
+
+    SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_CAPACITY, SEMANTIC_CACHE_PATH and
+    RESPONSE_CACHE_DISABLED_BACKENDS tune it. With a path, the cache is
+    flushed to disk when the process exits. The path is ignored when
+    WEB_CONCURRENCY asks for several worker processes: each worker keeps its
+    own entries, and only one process may save them.
+
+    Args:
+        preprocess: Callable normalizing text before embedding
+
+    Returns:
+        The semantic cache, or None if it is disabled or unavailable
+    """
+    if os.environ.get("SEMANTIC_CACHE", "").lower() not in ("1", "true", "yes"):
+        return None
+    if not numpy_available:
+        logger.warning("SEMANTIC_CACHE is set but numpy is not installed, semantic cache disabled")
+        return None
+
+    path = os.environ.get("SEMANTIC_CACHE_PATH") or None
+    workers = int(os.environ.get("WEB_CONCURRENCY") or "1")
+    if path and workers > 1:
+        logger.warning("SEMANTIC_CACHE_PATH is ignored with %s workers; the semantic cache stays in memory", workers)
+        path = None
+
+    disabled = os.environ.get("RESPONSE_CACHE_DISABLED_BACKENDS", "nltk")
+    cache = SemanticCache(
+        capacity=int(os.environ.get("SEMANTIC_CACHE_CAPACITY", "10000")),
+        threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.75")),
+        path=path,
+        preprocess=preprocess,
+        disabled_backends=[name.strip() for name in disabled.split(",") if name.strip()]
+    )
+    if cache.path:
+        atexit.register(cache.flush)
+    return cache
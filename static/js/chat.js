@@ -108,8 +108,31 @@ document.addEventListener('DOMContentLoaded', function() {
         // Show typing indicator
         showTypingIndicator();
         
-        // Send message to server
-        fetch('/chat', {
+        // Send message to server and render the response as it streams in
+        streamMessage(message);
+    });
+    
+    // Function to parse one Server-Sent Events frame
+    function parseEvent(frame) {
+        let event = 'message';
+        let data = '';
+        
+        frame.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                data += line.slice(5).trim();
+            }
+        });
+        
+        return { event: event, data: data ? JSON.parse(data) : {} };
+    }
+    
+    // Function to stream a chat response from the server
+    function streamMessage(message) {
+        let botText = null;
+        
+        fetch('/chat/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -117,21 +140,57 @@ document.addEventListener('DOMContentLoaded', function() {
             body: JSON.stringify({ message: message })
         })
         .then(response => {
-            if (!response.ok) {
+            if (!response.ok || !response.body) {
                 throw new Error('Network response was not ok');
             }
-            return response.json();
-        })
-        .then(data => {
-            // Hide typing indicator
-            hideTypingIndicator();
             
-            // Add bot response to chat
-            if (data.error) {
-                addMessage(`Error: ${data.error}`, false);
-            } else {
-                addMessage(data.response, false);
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            
+            function handleEvent(frame) {
+                const { event, data } = parseEvent(frame);
+                
+                if (event === 'error') {
+                    hideTypingIndicator();
+                    addMessage(`Error: ${data.error}`, false);
+                    return;
+                }
+                
+                if (event === 'message' && data.token) {
+                    // Replace the typing indicator with the message on the first token
+                    if (botText === null) {
+                        hideTypingIndicator();
+                        addMessage('', false);
+                        botText = chatContainer.lastElementChild.querySelector('.message-text p');
+                    }
+                    botText.textContent += data.token;
+                    chatContainer.scrollTop = chatContainer.scrollHeight;
+                }
             }
+            
+            function read() {
+                return reader.read().then(({ done, value }) => {
+                    if (done) {
+                        hideTypingIndicator();
+                        return;
+                    }
+                    
+                    buffer += decoder.decode(value, { stream: true });
+                    
+                    // Events are separated by a blank line
+                    let boundary = buffer.indexOf('\n\n');
+                    while (boundary !== -1) {
+                        handleEvent(buffer.slice(0, boundary));
+                        buffer = buffer.slice(boundary + 2);
+                        boundary = buffer.indexOf('\n\n');
+                    }
+                    
+                    return read();
+                });
+            }
+            
+            return read();
         })
         .catch(error => {
             // Hide typing indicator
@@ -141,7 +200,7 @@ document.addEventListener('DOMContentLoaded', function() {
             addMessage(`Sorry, there was an error processing your request: ${error.message}`, false);
             console.error('Error:', error);
         });
-    });
+    }
     
     // Function to handle chat reset
     resetButton.addEventListener('click', function() {
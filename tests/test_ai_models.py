@@ -0,0 +1,87 @@
+"""
+Tests for the API model wrappers, run against local fakes of the SDK clients.
+"""
+import asyncio
+from types import SimpleNamespace
+
+from ai_models import GeminiModel
+
+HISTORY = [{'user': f"question {i}", 'bot': f"answer {i}"} for i in range(10)]
+
+
+class FakeGeminiChat:
+    """Stand-in for a Gemini ChatSession that records every message sent upstream."""
+
+    def __init__(self, model, history):
+        self.model = model
+        self.history = history
+
+    def send_message(self, content, stream: bool = False):
+        self.model.sent.append(content)
+        if stream:
+            return iter([SimpleNamespace(text="fake "), SimpleNamespace(text="reply")])
+        return SimpleNamespace(text="fake reply")
+
+    async def send_message_async(self, content, stream: bool = False):
+        self.model.sent.append(content)
+        if stream:
+            return self._stream()
+        return SimpleNamespace(text="fake reply")
+
+    async def _stream(self):
+        for text in ("fake ", "reply"):
+            yield SimpleNamespace(text=text)
+
+
+class FakeGeminiModel:
+    """Stand-in for google.generativeai.GenerativeModel that counts chats and messages."""
+
+    def __init__(self):
+        self.histories = []
+        self.sent = []
+
+    def start_chat(self, history=None):
+        self.histories.append(history)
+        return FakeGeminiChat(self, history)
+
+
+def assert_one_call_with_native_history(fake: FakeGeminiModel, message: str):
+    """Check that one message went upstream, after a chat seeded with alternating user/model turns."""
+    assert fake.sent == [message]
+    assert len(fake.histories) == 1
+    history = fake.histories[0]
+    assert [turn['role'] for turn in history] == ['user', 'model'] * len(HISTORY)
+    assert [turn['parts'] for turn in history[:2]] == [["question 0"], ["answer 0"]]
+    assert [turn['parts'] for turn in history[-2:]] == [["question 9"], ["answer 9"]]
+
+
+def test_get_response_sends_one_message():
+    fake = FakeGeminiModel()
+    response = GeminiModel(model=fake).get_response("hello", HISTORY)
+
+    assert response == "fake reply"
+    assert_one_call_with_native_history(fake, "hello")
+
+
+def test_get_response_async_sends_one_message():
+    fake = FakeGeminiModel()
+    response = asyncio.run(GeminiModel(model=fake).get_response_async("hello", HISTORY))
+
+    assert response == "fake reply"
+    assert_one_call_with_native_history(fake, "hello")
+
+
+def test_stream_response_sends_one_message():
+    fake = FakeGeminiModel()
+    chunks = list(GeminiModel(model=fake).stream_response("hello", HISTORY))
+
+    assert chunks == ["fake ", "reply"]
+    assert_one_call_with_native_history(fake, "hello")
+
+
+def test_build_history_skips_incomplete_exchanges():
+    history = GeminiModel(model=FakeGeminiModel())._build_history(
+        [{'user': "question", 'bot': ""}, {'user': "", 'bot': "answer"}, {'user': "question", 'bot': "answer"}]
+    )
+
+    assert history == [{'role': 'user', 'parts': ["question"]}, {'role': 'model', 'parts': ["answer"]}]
@@ -0,0 +1,30 @@
+"""
+Tests for validating /chat/batch request bodies.
+"""
+import pytest
+
+from backends import parse_batch, MAX_HISTORY_EXCHANGES
+
+ITEMS = [{'conversation': "a", 'message': "hello"}]
+EXCHANGE = {'user': "hi", 'bot': "hello there"}
+
+
+def test_histories_of_exchanges_are_accepted():
+    batch, histories, model = parse_batch({'items': ITEMS, 'histories': {'a': [EXCHANGE] * MAX_HISTORY_EXCHANGES}})
+
+    assert batch == [("a", "hello")]
+    assert histories == {'a': [EXCHANGE] * MAX_HISTORY_EXCHANGES}
+    assert model is None
+
+
+@pytest.mark.parametrize("history", [
+    ["hi"],
+    [None],
+    [{'user': "hi"}],
+    [{'user': "hi", 'bot': 3}],
+    [EXCHANGE, {'user': ["hi"], 'bot': "hello"}],
+    [EXCHANGE] * (MAX_HISTORY_EXCHANGES + 1),
+], ids=["string", "null", "missing-bot", "number", "list", "too-long"])
+def test_malformed_histories_are_rejected(history):
+    with pytest.raises(ValueError):
+        parse_batch({'items': ITEMS, 'histories': {'a': history}})
@@ -0,0 +1,84 @@
+"""
+Tests for the route logic shared by the web apps, run against an in-memory conversation store.
+"""
+import os
+
+import pytest
+
+from chat_service import ChatService
+from exchange import decode_history
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setenv("CONVERSATION_STORE", "memory")
+    for name in ("OPENAI_API_KEY", "GEMINI_API_KEY", "KNOWLEDGE_BASE", "RATE_LIMIT", "PROFILE_TOKEN", "STATS_TOKEN"):
+        monkeypatch.delenv(name, raising=False)
+    service = ChatService(STATIC_FOLDER)
+    # Conversations the store starts are listed in service.created
+    service.created = []
+    create = service.store.create
+
+    def counting_create():
+        service.created.append(create())
+        return service.created[-1]
+    monkeypatch.setattr(service.store, 'create', counting_create)
+    return service
+
+
+def test_reading_history_does_not_start_a_conversation(service):
+    session = {}
+
+    assert service.home_history(session) == []
+    assert service.history_page(session, None, None) == {'history': [], 'offset': 0, 'limit': 50, 'total': 0}
+    data, count = service.export_history(session)
+    assert count == 0 and decode_history(data) == []
+    service.reset(session)
+
+    assert session == {}
+    assert service.created == []
+
+
+def test_history_of_a_started_conversation(service):
+    session = {}
+    chatbot = service.router.chatbot_for(session)
+    conversation, history, context = service.load_conversation(session)
+    service.save_exchange(chatbot, conversation, context, "hello", "hi there")
+
+    assert service.created == [session['conversation_id']]
+    assert service.history_page(session, 0, 10)['history'] == [{'user': "hello", 'bot': "hi there"}]
+    data, count = service.export_history(session)
+    assert count == 1 and decode_history(data) == [{'user': "hello", 'bot': "hi there"}]
+
+    service.reset(session)
+    assert service.history_page(session, 0, 10)['total'] == 0
+
+
+def test_profile_listing_names_its_scope(service, monkeypatch):
+    monkeypatch.setenv("PROFILE_TOKEN", "secret")
+    profiled = ChatService(STATIC_FOLDER)
+
+    assert profiled.profile_listing()['scope'] == 'request'
+    listing = profiled.profile_listing(event_loop=True)
+    assert listing['scope'] == 'event_loop' and 'every coroutine' in listing['note']
+
+
+def test_stats_are_open_without_a_token(service):
+    assert service.stats_authorized(None)
+
+
+@pytest.mark.parametrize("authorization, allowed", [
+    ("Bearer secret", True),
+    ("bearer secret", True),
+    (None, False),
+    ("", False),
+    ("Bearer", False),
+    ("Bearer wrong", False),
+    ("Basic secret", False),
+], ids=["bearer", "lowercase", "missing", "empty", "no-token", "wrong", "basic"])
+def test_stats_token_is_required_when_set(service, monkeypatch, authorization, allowed):
+    monkeypatch.setenv("STATS_TOKEN", "secret")
+
+    assert ChatService(STATIC_FOLDER).stats_authorized(authorization) == allowed
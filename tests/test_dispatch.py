@@ -0,0 +1,310 @@
+"""
+Tests for the dispatcher and circuit breaker, run against fake backends that inject latency and errors.
+"""
+import time
+import asyncio
+
+import pytest
+
+from dispatch import Dispatcher, CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from rate_limit import AdmissionGate, Overloaded
+from response_cache import ErrorResponse
+
+
+class FakeClock:
+    """Monotonic clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class FakeBackend:
+    """Stand-in for an API model that answers after a latency, or fails as configured."""
+
+    def __init__(self, name: str, latency: float = 0.0, error: Exception = None, error_response: bool = False):
+        self.name = name
+        self.latency = latency
+        self.error = error
+        self.error_response = error_response
+        self.calls = 0
+        self.closed = False
+
+    def respond(self) -> str:
+        self.calls += 1
+        time.sleep(self.latency)
+        return self._answer()
+
+    async def respond_async(self) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self._answer()
+
+    def stream(self):
+        self.calls += 1
+        try:
+            time.sleep(self.latency)
+            if self.error is not None:
+                raise self.error
+            yield self._answer()
+            yield " more"
+        finally:
+            self.closed = True
+
+    def _answer(self) -> str:
+        if self.error is not None:
+            raise self.error
+        if self.error_response:
+            return ErrorResponse(f"{self.name} failed")
+        return f"{self.name} answer"
+
+
+def backends(*fakes: FakeBackend):
+    """Get the fallback order and an invoke callable over fake backends, ending with the rule-based fallback."""
+    by_name = {fake.name: fake for fake in fakes}
+
+    def invoke(name: str) -> str:
+        return "nltk answer" if name == 'nltk' else by_name[name].respond()
+    return [fake.name for fake in fakes] + ['nltk'], invoke
+
+
+def test_falls_back_on_error_response():
+    order, invoke = backends(FakeBackend('openai', error_response=True), FakeBackend('gemini'))
+    dispatcher = Dispatcher()
+
+    assert dispatcher.call(order, invoke) == ('gemini', "gemini answer")
+    assert dispatcher.breaker('openai').stats()['failures'] == 1
+
+
+def test_falls_back_on_exception():
+    order, invoke = backends(FakeBackend('openai', error=ConnectionError("down")), FakeBackend('gemini'))
+    dispatcher = Dispatcher()
+
+    assert dispatcher.call(order, invoke) == ('gemini', "gemini answer")
+    assert dispatcher.breaker('openai').stats()['failures'] == 1
+
+
+def test_falls_back_on_missed_deadline():
+    order, invoke = backends(FakeBackend('openai', latency=0.5), FakeBackend('gemini'))
+    dispatcher = Dispatcher(deadlines={'openai': 0.05})
+
+    started = time.monotonic()
+    assert dispatcher.call(order, invoke) == ('gemini', "gemini answer")
+    assert time.monotonic() - started < 0.4
+    assert dispatcher.stats()['timeouts'] == 1
+
+
+def test_returns_last_error_when_every_remote_backend_fails():
+    fakes = FakeBackend('openai', error_response=True), FakeBackend('gemini', error_response=True)
+    dispatcher = Dispatcher()
+
+    backend, response = dispatcher.call([fake.name for fake in fakes], backends(*fakes)[1])
+    assert backend is None
+    assert isinstance(response, ErrorResponse)
+
+
+def test_async_call_falls_back_on_missed_deadline():
+    slow, fast = FakeBackend('openai', latency=0.5), FakeBackend('gemini')
+    by_name = {'openai': slow, 'gemini': fast}
+    dispatcher = Dispatcher(deadlines={'openai': 0.05})
+
+    result = asyncio.run(dispatcher.call_async(['openai', 'gemini', 'nltk'],
+                                               lambda name: by_name[name].respond_async(),
+                                               lambda name: "nltk answer"))
+    assert result == ('gemini', "gemini answer")
+    assert dispatcher.stats()['timeouts'] == 1
+
+
+def test_stream_falls_back_before_the_first_chunk():
+    fakes = {'openai': FakeBackend('openai', error=ConnectionError("down")), 'gemini': FakeBackend('gemini')}
+    dispatcher = Dispatcher()
+
+    chunks = list(dispatcher.stream(['openai', 'gemini'], lambda name: fakes[name].stream()))
+    assert chunks == [('gemini', "gemini answer"), ('gemini', " more")]
+
+
+def test_stream_falls_back_when_opening_a_stream_times_out():
+    gate = AdmissionGate('openai', limit=1)
+    fallback = FakeBackend('gemini')
+    dispatcher = Dispatcher(gates={'openai': gate})
+
+    def open_stream(name):
+        if name == 'openai':
+            # Socket timeouts raised by the client itself are TimeoutErrors too
+            raise TimeoutError("read timed out")
+        return fallback.stream()
+
+    chunks = list(dispatcher.stream(['openai', 'gemini'], open_stream))
+    assert chunks == [('gemini', "gemini answer"), ('gemini', " more")]
+    assert gate.stats()['in_flight'] == 0
+    assert dispatcher.stats()['timeouts'] == 0
+
+
+def test_abandoned_stream_is_closed_and_releases_its_slot():
+    gate = AdmissionGate('openai', limit=1)
+    slow, fast = FakeBackend('openai', latency=0.3), FakeBackend('gemini')
+    fakes = {'openai': slow, 'gemini': fast}
+    dispatcher = Dispatcher(deadlines={'openai': 0.05}, gates={'openai': gate})
+
+    # Streams are kept referenced here, so only an explicit close() ends them
+    opened = []
+
+    def open_stream(name):
+        opened.append(fakes[name].stream())
+        return opened[-1]
+
+    chunks = list(dispatcher.stream(['openai', 'gemini'], open_stream))
+    assert chunks == [('gemini', "gemini answer"), ('gemini', " more")]
+    assert dispatcher.stats()['timeouts'] == 1
+
+    deadline = time.monotonic() + 2
+    while not slow.closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert slow.closed
+    assert gate.stats()['in_flight'] == 0
+
+
+def test_stream_closed_when_the_consumer_stops_early():
+    fake = FakeBackend('openai')
+    dispatcher = Dispatcher()
+
+    stream = fake.stream()
+    chunks = dispatcher.stream(['openai'], lambda name: stream)
+    assert next(chunks) == ('openai', "openai answer")
+    chunks.close()
+    assert fake.closed
+
+
+def test_async_stream_falls_back_when_a_local_backend_raises():
+    dispatcher = Dispatcher()
+
+    def invoke_local(name):
+        if name == 'kb':
+            raise ValueError("index is corrupt")
+        return "nltk answer"
+
+    async def collect():
+        return [chunk async for chunk in dispatcher.stream_async(['kb', 'nltk'], None, invoke_local)]
+    assert asyncio.run(collect()) == [('nltk', "nltk answer")]
+
+
+def test_breaker_opens_half_opens_and_closes():
+    clock = FakeClock()
+    breaker = CircuitBreaker('openai', min_calls=4, failure_rate=0.5, cooldown=30, clock=clock)
+
+    for succeeded in (True, True, False):
+        breaker.record(succeeded, 0.1)
+    assert breaker.state == CLOSED
+    breaker.record(False, 0.1)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+    clock.advance(30)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # a single probe at a time
+
+    breaker.record(True, 0.1)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_the_circuit():
+    clock = FakeClock()
+    breaker = CircuitBreaker('openai', min_calls=1, failure_rate=0.5, cooldown=30, clock=clock)
+    breaker.record(False, 0.1)
+    clock.advance(30)
+    assert breaker.allow()
+
+    breaker.record(False, 0.1)
+    assert breaker.state == OPEN
+    clock.advance(29)
+    assert breaker.state == OPEN
+
+
+def test_slow_calls_open_the_circuit():
+    breaker = CircuitBreaker('openai', min_calls=2, failure_rate=0.5, slow_call_s=1.0, clock=FakeClock())
+    breaker.record(True, 2.0)
+    breaker.record(True, 2.0)
+    assert breaker.state == OPEN
+
+
+def test_open_circuit_skips_the_backend_until_the_cooldown_ends():
+    clock = FakeClock()
+    failing, fallback = FakeBackend('openai', error=ConnectionError("down")), FakeBackend('gemini')
+    order, invoke = backends(failing, fallback)
+    dispatcher = Dispatcher(breaker_factory=lambda name: CircuitBreaker(name, min_calls=2, cooldown=30, clock=clock))
+
+    for _ in range(2):
+        dispatcher.call(order, invoke)
+    assert dispatcher.breaker('openai').state == OPEN
+
+    assert dispatcher.call(order, invoke) == ('gemini', "gemini answer")
+    assert failing.calls == 2
+
+    # The probe after the cooldown succeeds and closes the circuit
+    clock.advance(30)
+    failing.error = None
+    assert dispatcher.call(order, invoke) == ('openai', "openai answer")
+    assert dispatcher.breaker('openai').state == CLOSED
+
+
+def test_hedged_request_wins_against_a_slow_primary():
+    slow, fast = FakeBackend('openai', latency=0.5), FakeBackend('gemini', latency=0.01)
+    order, invoke = backends(slow, fast)
+    dispatcher = Dispatcher(hedge=True)
+    # Recent calls took 20ms, so the hedge starts once the primary has run for that long
+    for _ in range(5):
+        dispatcher.breaker('openai').record(True, 0.02)
+
+    started = time.monotonic()
+    assert dispatcher.call(order, invoke) == ('gemini', "gemini answer")
+    assert time.monotonic() - started < 0.3
+    stats = dispatcher.stats()
+    assert (stats['hedges'], stats['hedge_wins']) == (1, 1)
+
+
+def test_no_hedge_without_latency_history():
+    slow, fast = FakeBackend('openai', latency=0.1), FakeBackend('gemini')
+    order, invoke = backends(slow, fast)
+    dispatcher = Dispatcher(hedge=True)
+
+    assert dispatcher.call(order, invoke) == ('openai', "openai answer")
+    assert fast.calls == 0
+
+
+def test_slot_is_released_when_an_abandoned_call_ends():
+    gate = AdmissionGate('openai', limit=1)
+    slow = FakeBackend('openai', latency=0.3)
+    order, invoke = backends(slow, FakeBackend('gemini'))
+    dispatcher = Dispatcher(deadlines={'openai': 0.05}, gates={'openai': gate})
+
+    assert dispatcher.call(order, invoke) == ('gemini', "gemini answer")
+    # The abandoned call still runs upstream, so it keeps its slot
+    assert gate.stats()['in_flight'] == 1
+
+    deadline = time.monotonic() + 2
+    while gate.stats()['in_flight'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert gate.stats()['in_flight'] == 0
+
+    slow.latency = 0.0
+    assert dispatcher.call(order, invoke) == ('openai', "openai answer")
+    assert gate.stats()['in_flight'] == 0
+
+
+def test_full_backends_raise_overloaded_instead_of_answering_locally():
+    gate = AdmissionGate('openai', limit=0)
+    order, invoke = backends(FakeBackend('openai'))
+    dispatcher = Dispatcher(gates={'openai': gate})
+
+    with pytest.raises(Overloaded):
+        dispatcher.call(order, invoke)
+
+    shedding = Dispatcher(gates={'openai': gate}, shed_to_local=True)
+    assert shedding.call(order, invoke) == ('nltk', "nltk answer")
@@ -0,0 +1,90 @@
+"""
+Tests that the indexed intent matcher agrees with searching every pattern in order.
+"""
+import re
+import random
+
+import pytest
+
+from intent_catalog import load_source, DEFAULT_CATALOG
+from intent_matcher import IntentMatcher, pattern_anchors, MAX_ANCHOR_LENGTH
+
+REAL = load_source(DEFAULT_CATALOG).patterns_responses
+
+# Patterns exercising anchor derivation: alternations, optional and repeated groups,
+# lookarounds, truncated anchors, expansions past the limit and patterns with no anchors
+ADVERSARIAL = {pattern: [pattern] for pattern in [
+    r'HeLLo World', r'colou?r', r'(?:good )?morning', r'sit(s|ting)? down', r'\bkick\b', r'stop|ſtop',
+    r'i like (cats|dogs)+', r'\d+ apples', r'x{2,}', r'(ab)*c', r'what(ever)?', r'ii', r'ss',
+    r'(?:a|b)(?:c|d)(?:e|f)(?:g|h)(?:i|j)(?:k|l)(?:m|n)', r'abcdefghijklmnopqrstuvwxyz', r'un(?!happy)\w+',
+    r'(?<=my )name', r'(?i:MiXeD)', r'k', r'İstanbul', r'café', r'[^a-z]+', r'.*',
+]}
+
+# Characters that match ASCII letters case-insensitively without lowercasing to them, and other non-ASCII text
+ODD_CHARACTERS = ['ı', 'ſ', 'İ', 'K', 'ß', 'ﬁ', 'é', 'σ', 'ς', 'Σ', '̇']
+ALPHABET = list("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 '.-") + ODD_CHARACTERS
+SUBSTITUTIONS = {'i': ['I', 'ı', 'İ'], 's': ['S', 'ſ'], 'k': ['K', 'K']}
+
+
+def linear_match(patterns, text: str):
+    """Get the index of the first pattern re.search finds in the text, the way the matcher is specified."""
+    for index, pattern in enumerate(patterns):
+        if re.search(pattern, text, re.IGNORECASE):
+            return index
+    return None
+
+
+def messages(patterns, count: int, seed: int):
+    """Generate messages built from the patterns' words, with case changes, look-alike letters and noise."""
+    rng = random.Random(seed)
+    words = sorted({word for pattern in patterns for word in re.findall(r'[A-Za-z]+', pattern)})
+    for _ in range(count):
+        parts = []
+        for _ in range(rng.randint(0, 5)):
+            if rng.random() < 0.5:
+                word = ''.join(rng.choice(SUBSTITUTIONS.get(char, [char.upper()])) if rng.random() < 0.3 else char
+                               for char in rng.choice(words).lower())
+            else:
+                word = ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 6)))
+            parts.append(word)
+        yield rng.choice([' ', '', '  ']).join(parts)
+
+
+HANDPICKED = [
+    "", "   ", "Hello there", "HELLO", "hİ", "hı", "ſee you", "thanKs", "tell me a really bad joke",
+    "what time is it", "WHAT CAN YOU DO", "how's it going", "colour", "color", "sitting down", "kicked",
+    "I like dogsdogs", "12 apples", "xx", "abababc", "morning", "mornİng", "unhappy", "unusual", "my name",
+    "name", "ISTANBUL", "İstanbul", "café", "CAFÉ", "bdegikm", "ABCDEFGHIJKLMNOPQRSTUVWXYZ", "ssſ",
+]
+
+
+@pytest.mark.parametrize("catalog", [REAL, ADVERSARIAL], ids=["real", "adversarial"])
+def test_matches_like_a_linear_search(catalog):
+    patterns = list(catalog)
+    matcher = IntentMatcher(catalog)
+    restored = IntentMatcher.from_state(matcher.state())
+
+    for text in HANDPICKED + list(messages(patterns, 3000, seed=1)):
+        expected = linear_match(patterns, text)
+        assert matcher.match_index(text) == expected, text
+        assert restored.match_index(text) == expected, text
+
+
+def test_match_many_agrees_with_match():
+    matcher = IntentMatcher(REAL)
+    texts = HANDPICKED + HANDPICKED[::-1]
+
+    assert matcher.match_many(texts) == [matcher.match(text) for text in texts]
+
+
+@pytest.mark.parametrize("pattern, anchors", [
+    (r'hello|hi|hey|howdy', {'hello', 'hi', 'hey', 'howdy'}),
+    (r'(what|how) (can|do) you do', {'what', 'how'}),
+    (r'colou?r', {'colo'}),
+    (r'sit(s|ting)? down', {'down'}),
+    (r'abcdefghijklmnopqrstuvwxyz', {'abcdefghijklmnopqrstuvwxyz'[:MAX_ANCHOR_LENGTH]}),
+    (r'.*', None),
+    (r'[^a-z]+', None),
+])
+def test_pattern_anchors(pattern, anchors):
+    assert pattern_anchors(pattern, re.IGNORECASE) == anchors
@@ -0,0 +1,70 @@
+"""
+Tests for the knowledge base, built with the chatbot's own preprocessing over a small FAQ corpus.
+"""
+import pytest
+
+from chatbot import Chatbot
+from knowledge_base import KnowledgeBase
+
+FAQ = [
+    ("reset", "How do I reset my password?",
+     "Open Settings, choose Security and click Reset password; a reset link is emailed to you."),
+    ("hours", "What are your opening hours?", "Support is open from 9am to 5pm, Monday to Friday."),
+    ("refund", "How do I get a refund?", "Refunds are issued within 14 days of purchase from the Orders page."),
+    ("delete", "How do I delete my account?",
+     "Go to Settings, then Account, and choose Delete account. This cannot be undone."),
+    ("email", "How do I change my email address?", "Your email address can be changed under Settings, Profile."),
+    ("shipping", "How long does shipping take?",
+     "Orders ship within two business days and arrive in three to five days."),
+    ("welcome", "Welcome", "Hello and welcome to the help center."),
+    ("payment", "Which payment methods do you accept?", "We accept credit cards, PayPal and bank transfers."),
+]
+
+
+def build() -> KnowledgeBase:
+    knowledge_base = KnowledgeBase()
+    for doc_id, title, text in FAQ:
+        knowledge_base.add(doc_id, text, title)
+    return knowledge_base
+
+
+@pytest.fixture(scope="module")
+def knowledge_base():
+    return build()
+
+
+@pytest.mark.parametrize("message", ["hello", "Hello!", "password"])
+def test_single_word_messages_do_not_answer(knowledge_base, message):
+    hits = knowledge_base.search(message)
+
+    # The lone term matches a short document with full confidence, which is not enough
+    assert hits and hits[0].confidence >= knowledge_base.answer_threshold
+    assert knowledge_base.answer(hits) is None
+
+
+@pytest.mark.parametrize("message, doc_id", [
+    ("How do I reset my password?", "reset"),
+    ("what are your opening hours", "hours"),
+    ("change my email address", "email"),
+])
+def test_faq_questions_answer(knowledge_base, message, doc_id):
+    hits = knowledge_base.search(message)
+
+    assert hits[0].document.id == doc_id
+    assert hits[0].matched >= 2
+    assert knowledge_base.answer(hits) == hits[0].document.text
+
+
+def test_python_scoring_counts_the_same_matches(knowledge_base, monkeypatch):
+    expected = [(hit.document.id, hit.matched) for hit in knowledge_base.search("reset my email password")]
+    monkeypatch.setattr("knowledge_base.numpy_available", False)
+
+    assert [(hit.document.id, hit.matched) for hit in build().search("reset my email password")] == expected
+
+
+def test_greeting_reaches_the_rule_based_fallback(knowledge_base):
+    chatbot = Chatbot(model_preference="nltk", knowledge_base=knowledge_base)
+    faq_answers = {text for _, _, text in FAQ}
+
+    assert chatbot.get_response("hello") not in faq_answers
+    assert chatbot.get_response("How do I reset my password?") == FAQ[0][2]
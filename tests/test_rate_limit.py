@@ -0,0 +1,29 @@
+"""
+Tests for rate limiting configuration and client identification.
+"""
+from chat_service import client_address
+from rate_limit import create_rate_limiter
+
+
+def test_rate_limiting_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("RATE_LIMIT", raising=False)
+    assert create_rate_limiter() is None
+
+    monkeypatch.setenv("RATE_LIMIT", "30")
+    assert create_rate_limiter() is not None
+
+
+def test_client_address_uses_the_peer_without_trusted_proxies():
+    assert client_address('10.0.0.1', '203.0.113.7', 0) == '10.0.0.1'
+
+
+def test_client_address_reads_past_trusted_proxies():
+    # The client forged the first entry; the two proxies appended the rest
+    forwarded_for = '198.51.100.1, 203.0.113.7, 10.0.0.2'
+    assert client_address('10.0.0.1', forwarded_for, 1) == '10.0.0.2'
+    assert client_address('10.0.0.1', forwarded_for, 2) == '203.0.113.7'
+
+
+def test_client_address_falls_back_to_the_peer_with_too_few_entries():
+    assert client_address('10.0.0.1', '203.0.113.7', 2) == '10.0.0.1'
+    assert client_address('10.0.0.1', '', 1) == '10.0.0.1'
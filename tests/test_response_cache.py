@@ -0,0 +1,100 @@
+"""
+Tests for the response cache, alone and in front of a chatbot with a fake API model.
+"""
+import asyncio
+import threading
+
+from chatbot import Chatbot
+from response_cache import ResponseCache, ErrorResponse
+
+SHARED = [{'user': "tell me more", 'bot': "sure"}, {'user': "go on", 'bot': "okay"}]
+FIRST = [{'user': "my name is Ann", 'bot': "hi Ann"}] + SHARED
+SECOND = [{'user': "my name is Bob", 'bot': "hi Bob"}] + SHARED
+
+
+class FakeModel:
+    """Stand-in for an API model that answers from the first message of the history it is sent."""
+
+    available = True
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_response(self, user_input, chat_history=None):
+        self.calls += 1
+        first = chat_history[0]['user'] if chat_history else "nothing"
+        return f"you first said: {first}"
+
+    async def get_response_async(self, user_input, chat_history=None):
+        return self.get_response(user_input, chat_history)
+
+
+class ThreadRecordingCache(ResponseCache):
+    """Response cache that records the threads its lookups and stores run on."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.threads = []
+
+    def get(self, key):
+        self.threads.append(threading.get_ident())
+        return super().get(key)
+
+    def put(self, key, response, backend):
+        self.threads.append(threading.get_ident())
+        super().put(key, response, backend)
+
+
+def test_key_covers_the_whole_history():
+    cache = ResponseCache(context_turns=10)
+
+    first = cache.make_key("what did I ask you first?", FIRST, "openai")
+    second = cache.make_key("what did I ask you first?", SECOND, "openai")
+    assert first != second
+    assert first == cache.make_key("What did I ask you first", FIRST, "openai")
+
+
+def test_longer_conversations_are_not_cached():
+    cache = ResponseCache(context_turns=2)
+
+    assert cache.make_key("hello", [], "openai") is not None
+    assert cache.make_key("hello", SHARED, "openai") is not None
+    assert cache.make_key("hello", FIRST, "openai") is None
+
+
+def test_conversations_sharing_recent_exchanges_get_their_own_answers():
+    model = FakeModel()
+    chatbot = Chatbot(model_preference="openai", openai_model=model, response_cache=ResponseCache())
+
+    assert chatbot.get_response("what did I ask you first?", FIRST) == "you first said: my name is Ann"
+    assert chatbot.get_response("what did I ask you first?", SECOND) == "you first said: my name is Bob"
+    assert model.calls == 2
+
+
+def test_openers_are_shared_and_errors_are_not_cached():
+    model = FakeModel()
+    cache = ResponseCache()
+    chatbot = Chatbot(model_preference="openai", openai_model=model, response_cache=cache)
+
+    assert chatbot.get_response("hello", []) == chatbot.get_response("Hello!", [])
+    assert model.calls == 1
+
+    key = cache.make_key("broken", [], "openai")
+    cache.put(key, ErrorResponse("failed"), "openai")
+    assert cache.get(key) is None
+
+
+def test_async_path_moves_a_disk_tier_off_the_event_loop(tmp_path):
+    async def answer(chatbot):
+        return threading.get_ident(), await chatbot.get_response_async("hello", [])
+
+    memory = ThreadRecordingCache()
+    loop_thread, _ = asyncio.run(answer(Chatbot(model_preference="openai", openai_model=FakeModel(),
+                                                response_cache=memory)))
+    assert memory.threads == [loop_thread, loop_thread]
+
+    disk = ThreadRecordingCache(disk_path=str(tmp_path / "responses.db"))
+    loop_thread, response = asyncio.run(answer(Chatbot(model_preference="openai", openai_model=FakeModel(),
+                                                       response_cache=disk)))
+    assert response == "you first said: nothing"
+    assert len(disk.threads) == 2 and loop_thread not in disk.threads
@@ -0,0 +1,119 @@
+"""
+Tests for the semantic cache's scoping, scoring and file persistence.
+"""
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from semantic_cache import SemanticCache, create_semantic_cache
+
+
+def cache_at(path, **kwargs) -> SemanticCache:
+    return SemanticCache(capacity=8, dim=64, threshold=0.9, path=str(path), **kwargs)
+
+
+def test_entries_are_scoped_to_the_whole_history():
+    cache = SemanticCache(capacity=8, dim=64, threshold=0.9, context_turns=3)
+    shared = [{'user': "tell me more", 'bot': "sure"}]
+    first = [{'user': "my name is Ann", 'bot': "hi Ann"}] + shared
+    second = [{'user': "my name is Bob", 'bot': "hi Bob"}] + shared
+    cache.add("what is my name", first, 'openai', "Ann.", 'openai')
+
+    assert cache.get("what is my name?", first, 'openai') == "Ann."
+    assert cache.get("what is my name?", second, 'openai') is None
+
+
+def test_longer_conversations_are_not_cached():
+    cache = SemanticCache(capacity=8, dim=64, threshold=0.9, context_turns=1)
+    history = [{'user': "hello", 'bot': "hi"}, {'user': "tell me more", 'bot': "sure"}]
+    cache.add("what is my name", history, 'openai', "Ann.", 'openai')
+
+    assert cache.stats()['size'] == 0
+    assert cache.get("what is my name", history, 'openai') is None
+
+
+def test_similarity_does_not_depend_on_when_an_entry_was_added():
+    others = [f"question number {i} about topic {i % 7}" for i in range(40)]
+    early = SemanticCache(capacity=64, dim=256, threshold=0.0)
+    late = SemanticCache(capacity=64, dim=256, threshold=0.0)
+
+    early.add("tell me a joke about cats", None, 'openai', "A joke.", 'openai')
+    for i, prompt in enumerate(others):
+        early.add(prompt, None, 'openai', f"answer {i}", 'openai')
+        late.add(prompt, None, 'openai', f"answer {i}", 'openai')
+    late.add("tell me a joke about cats", None, 'openai', "A joke.", 'openai')
+
+    namespace = early.namespace(None, 'openai')
+    # Both caches hold the same texts, so the entry is weighted with the same IDF in both
+    assert early.search("tell me a joke about dogs", namespace) == pytest.approx(
+        late.search("tell me a joke about dogs", namespace))
+
+
+def test_flush_and_reload(tmp_path):
+    cache = cache_at(tmp_path / "cache")
+    cache.add("tell me a joke", None, 'openai', "Why did the chicken cross the road?", 'openai')
+    cache.flush()
+
+    reloaded = cache_at(tmp_path / "cache")
+    assert reloaded.get("tell me a joke", None, 'openai') == "Why did the chicken cross the road?"
+
+
+def test_processes_sharing_a_file_do_not_see_each_others_entries(tmp_path):
+    path = tmp_path / "cache"
+    cache_at(path).flush()
+    first = cache_at(path)
+    second = cache_at(path)
+
+    # Both take slot 0; with a shared mapping the second vector would overwrite the first
+    first.add("what is the weather like", None, 'openai', "Sunny.", 'openai')
+    second.add("recommend a good book", None, 'openai', "Dune.", 'openai')
+
+    assert first.get("what is the weather like", None, 'openai') == "Sunny."
+    assert first.get("recommend a good book", None, 'openai') is None
+    assert second.get("what is the weather like", None, 'openai') is None
+
+
+def test_mismatched_vectors_are_not_loaded(tmp_path):
+    path = tmp_path / "cache"
+    cache = cache_at(path)
+    cache.add("tell me a joke", None, 'openai', "A joke.", 'openai')
+    cache.flush()
+    with open(f"{path}.vectors", 'r+b') as f:
+        f.write(b'\x00' * 64)
+
+    assert cache_at(path).stats()['size'] == 0
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs fork")
+def test_forked_child_takes_over_saving(tmp_path):
+    path = tmp_path / "cache"
+    cache = cache_at(path)
+    cache.add("tell me a joke", None, 'openai', "A joke.", 'openai')
+    cache.flush()
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            cache.add("recommend a good book", None, 'openai', "Dune.", 'openai')
+            cache.flush()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+    # The parent handed saving over, so its flush leaves the child's entries in place
+    cache.flush()
+    reloaded = cache_at(path)
+    assert reloaded.get("recommend a good book", None, 'openai') == "Dune."
+    assert reloaded.get("tell me a joke", None, 'openai') == "A joke."
+
+
+def test_path_is_ignored_with_several_workers(tmp_path, monkeypatch):
+    monkeypatch.setenv("SEMANTIC_CACHE", "1")
+    monkeypatch.setenv("SEMANTIC_CACHE_PATH", str(tmp_path / "cache"))
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    assert create_semantic_cache().path is None
+
+    monkeypatch.setenv("WEB_CONCURRENCY", "1")
+    assert create_semantic_cache().path == str(tmp_path / "cache")
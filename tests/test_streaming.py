@@ -0,0 +1,109 @@
+"""
+Tests for streamed responses, run through the chatbot against fake OpenAI clients that yield chunks.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from ai_models import OpenAIModel
+from chatbot import Chatbot
+from response_cache import ResponseCache, ErrorResponse
+
+CHUNKS = ["Hel", "lo ", "there"]
+
+
+def chunk(text: str):
+    """Build a streamed chat completion chunk carrying some text."""
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class FakeCompletions:
+    """Stand-in for client.chat.completions that streams CHUNKS, failing after `fail_after` of them if set."""
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.calls = 0
+
+    def _texts(self):
+        self.calls += 1
+        for number, text in enumerate(CHUNKS):
+            if number == self.fail_after:
+                raise ConnectionError("connection reset")
+            yield text
+
+    def create(self, stream=False, **kwargs):
+        assert stream
+        return (chunk(text) for text in self._texts())
+
+
+class FakeAsyncCompletions(FakeCompletions):
+    """Stand-in for the asyncio client's chat.completions."""
+
+    async def create(self, stream=False, **kwargs):
+        assert stream
+        return self._stream()
+
+    async def _stream(self):
+        for text in self._texts():
+            await asyncio.sleep(0)
+            yield chunk(text)
+
+
+def chatbot_with(completions) -> Chatbot:
+    """Build a chatbot whose only API model is an OpenAI model over fake completions."""
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    model = OpenAIModel(client=client, async_client=client)
+    return Chatbot(model_preference="openai", openai_model=model, response_cache=ResponseCache())
+
+
+def stream(chatbot: Chatbot, message: str, use_async: bool):
+    """Collect a streamed response, through the sync or the async path."""
+    if not use_async:
+        return list(chatbot.stream_response(message, []))
+
+    async def collect():
+        return [piece async for piece in chatbot.stream_response_async(message, [])]
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("use_async", [False, True], ids=["sync", "async"])
+def test_chunks_are_streamed_in_order_and_cached_joined(use_async):
+    completions = FakeAsyncCompletions() if use_async else FakeCompletions()
+    chatbot = chatbot_with(completions)
+
+    assert stream(chatbot, "hello", use_async) == CHUNKS
+    key = chatbot.response_cache.make_key("hello", [], "openai")
+    assert chatbot.response_cache.get(key) == "Hello there"
+
+    # The repeat is answered from the cache in one piece
+    assert stream(chatbot, "Hello!", use_async) == ["Hello there"]
+    assert completions.calls == 1
+
+
+@pytest.mark.parametrize("use_async", [False, True], ids=["sync", "async"])
+def test_error_mid_stream_follows_the_partial_text_and_is_not_cached(use_async):
+    completions = FakeAsyncCompletions(fail_after=2) if use_async else FakeCompletions(fail_after=2)
+    chatbot = chatbot_with(completions)
+
+    pieces = stream(chatbot, "hello", use_async)
+    assert pieces[:2] == CHUNKS[:2]
+    assert len(pieces) == 3
+    assert isinstance(pieces[2], ErrorResponse)
+    assert "connection reset" in pieces[2]
+
+    assert chatbot.response_cache.get(chatbot.response_cache.make_key("hello", [], "openai")) is None
+    stream(chatbot, "hello", use_async)
+    assert completions.calls == 2
+
+
+@pytest.mark.parametrize("use_async", [False, True], ids=["sync", "async"])
+def test_error_before_the_first_chunk_falls_back(use_async):
+    completions = FakeAsyncCompletions(fail_after=0) if use_async else FakeCompletions(fail_after=0)
+    chatbot = chatbot_with(completions)
+
+    pieces = stream(chatbot, "hello", use_async)
+    # The rule-based fallback answers in one piece instead of the failed model
+    assert len(pieces) == 1
+    assert not isinstance(pieces[0], ErrorResponse)
+    assert completions.calls == 1
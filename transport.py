@@ -0,0 +1,246 @@
+"""
+Shared HTTP transport for the model backends.
+This module builds one pooled httpx client per process (and one asyncio client) with keep-alive
+limits, connect/read timeouts and HTTP/2 when the h2 package is installed, and counts how often
+pooled connections are reused.
+"""
+import os
+import logging
+import threading
+from importlib.util import find_spec
+from typing import Dict, Any, Optional
+
+try:
+    import httpx
+    httpx_available = True
+except ImportError:
+    httpx_available = False
+
+logger = logging.getLogger(__name__)
+
+# httpcore trace events marking a new TCP connection and a request sent on any connection
+_CONNECT_EVENT = 'connection.connect_tcp.complete'
+_REQUEST_EVENTS = ('http11.send_request_headers.complete', 'http2.send_request_headers.complete')
+
+
+class TransportConfig:
+    """Connection pool and timeout settings shared by every backend client."""
+
+    def __init__(self, max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30.0, connect_timeout: float = 5.0, read_timeout: float = 60.0,
+                 http2: Optional[bool] = None):
+        """
+        Initialize the settings.
+
+        Args:
+            max_connections: Maximum open connections per client
+            max_keepalive_connections: Maximum idle connections kept alive for reuse
+            keepalive_expiry: Seconds an idle connection is kept
+            connect_timeout: Seconds allowed to establish a connection (including TLS)
+            read_timeout: Seconds allowed between bytes of a response
+            http2: Negotiate HTTP/2; None enables it when the h2 package is installed
+        """
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.http2 = find_spec('h2') is not None if http2 is None else http2
+
+    @classmethod
+    def from_env(cls) -> 'TransportConfig':
+        """
+        Read the settings from HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY,
+        HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT and HTTP2 (1/0, unset for automatic).
+        """
+        http2 = os.environ.get("HTTP2", "").lower()
+        return cls(
+            max_connections=int(os.environ.get("HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.environ.get("HTTP_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "30")),
+            connect_timeout=float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.environ.get("HTTP_READ_TIMEOUT", "60")),
+            http2=None if not http2 else http2 in ("1", "true", "yes")
+        )
+
+    def timeout(self) -> 'httpx.Timeout':
+        """Get the httpx timeout; writes and pool waits share the connect timeout."""
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    def limits(self) -> 'httpx.Limits':
+        """Get the httpx connection pool limits."""
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry
+        )
+
+
+class PoolStats:
+    """Count requests and new connections seen by a client's trace hooks."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.errors = 0
+
+    def trace(self, event: str, info: Dict[str, Any]):
+        """httpcore trace callback for the sync client."""
+        if event == _CONNECT_EVENT:
+            with self._lock:
+                self.connections_opened += 1
+        elif event in _REQUEST_EVENTS:
+            with self._lock:
+                self.requests += 1
+        elif event.endswith('.failed'):
+            with self._lock:
+                self.errors += 1
+
+    async def trace_async(self, event: str, info: Dict[str, Any]):
+        """httpcore trace callback for the asyncio client."""
+        self.trace(event, info)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get the counters and the share of requests sent on a reused connection."""
+        with self._lock:
+            requests = self.requests
+            opened = self.connections_opened
+            errors = self.errors
+        return {
+            'requests': requests,
+            'connections_opened': opened,
+            'reuse_rate': 1 - opened / requests if requests else 0.0,
+            'errors': errors
+        }
+
+
+_lock = threading.RLock()
+_config: Optional[TransportConfig] = None
+_client = None
+_async_client = None
+_stats = {'sync': PoolStats(), 'async': PoolStats()}
+
+
+def config() -> TransportConfig:
+    """Get the process-wide transport settings, read from the environment on first use."""
+    global _config
+    if _config is None:
+        with _lock:
+            if _config is None:
+                _config = TransportConfig.from_env()
+    return _config
+
+
+def configure(settings: TransportConfig):
+    """
+    Replace the transport settings; clients already built keep theirs.
+
+    Args:
+        settings: Settings for clients built from now on
+    """
+    global _config
+    with _lock:
+        _config = settings
+
+
+def _build(client_class, trace):
+    """Build a pooled client that attaches the trace callback to every request."""
+    settings = config()
+
+    def attach_trace(request):
+        request.extensions['trace'] = trace
+
+    async def attach_trace_async(request):
+        request.extensions['trace'] = trace
+
+    hook = attach_trace_async if client_class is httpx.AsyncClient else attach_trace
+    try:
+        client = client_class(limits=settings.limits(), timeout=settings.timeout(), http2=settings.http2,
+                              event_hooks={'request': [hook]})
+    except ImportError:
+        # http2=True without the h2 package
+        client = client_class(limits=settings.limits(), timeout=settings.timeout(), event_hooks={'request': [hook]})
+    logger.info("Built shared %s (max %s connections, %s keep-alive, http2=%s)", client_class.__name__,
+                settings.max_connections, settings.max_keepalive_connections, settings.http2)
+    return client
+
+
+def shared_client() -> Optional['httpx.Client']:
+    """
+    Get the process-wide pooled client for blocking calls.
+
+    Returns:
+        The client, or None if httpx is not installed
+    """
+    global _client
+    if not httpx_available:
+        return None
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = _build(httpx.Client, _stats['sync'].trace)
+    return _client
+
+
+def shared_async_client() -> Optional['httpx.AsyncClient']:
+    """
+    Get the process-wide pooled client for asyncio calls.
+
+    Its connections belong to the event loop that opened them, so it must only
+    be used from the server's loop.
+
+    Returns:
+        The client, or None if httpx is not installed
+    """
+    global _async_client
+    if not httpx_available:
+        return None
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                _async_client = _build(httpx.AsyncClient, _stats['async'].trace_async)
+    return _async_client
+
+
+def _pool_connections(client) -> Dict[str, int]:
+    """Count a client's open and idle pooled connections."""
+    # httpx does not expose its pool, so read it from the default transport if it is there
+    pool = getattr(getattr(client, '_transport', None), '_pool', None)
+    connections = list(getattr(pool, 'connections', []))
+    return {
+        'open': len(connections),
+        'idle': sum(1 for connection in connections if connection.is_idle())
+    }
+
+
+def stats() -> Dict[str, Any]:
+    """
+    Get statistics of the shared clients.
+
+    Returns:
+        Dictionary with the pool settings and, per client built, request, connection and reuse counts
+    """
+    if not httpx_available:
+        return {'available': False}
+
+    settings = config()
+    result = {
+        'available': True,
+        'http2': settings.http2,
+        'max_connections': settings.max_connections,
+        'max_keepalive_connections': settings.max_keepalive_connections
+    }
+    for name, client in (('sync', _client), ('async', _async_client)):
+        if client is not None:
+            result[name] = dict(_stats[name].to_dict(), **_pool_connections(client))
+    return result
+
+
+def close():
+    """Close the shared blocking client; the asyncio client closes with its event loop."""
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None